@@ -0,0 +1,136 @@
+"""
+Process-wide access to the analytics API for the GraphQL server.
+
+Page.resolve_pageviews used to make a brand new gcga() for every group or
+piece of content it resolved, which rebuilt the OAuth credentials and then
+made one blocking batchGet each. Here:
+
+- Credentials are built once (gcga keeps them on the class) and each worker
+  thread keeps its own gcga, so HTTP connections get reused. The API client
+  is not thread safe, hence one per thread rather than one overall.
+- Pageview counts are cached per (platform, guid, date range).
+- The PageviewsLoader in loaders.py collects every pageviews lookup in a
+  response and hands them to fetch_pageviews() in one go, which packs them
+  with gcga.bulk_pageviews and runs a few of those at a time.
+  fetch_pageviews_async() does the same for async_app.py.
+
+Point use_service() at a stand-in for the Reporting API to run all of this
+without talking to Google.
+"""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from caching import TTLCache
+
+
+DEFAULT_START_DATE = '30daysAgo'
+DEFAULT_END_DATE = 'today'
+
+# How many bulk_pageviews calls can be in flight at once
+MAX_WORKERS = 4
+# How many guids go to each of those calls. A few hundred already
+# fit in a single batchGet, so this only splits really big responses
+CHUNK_SIZE = 500
+
+# Pageviews don't move much within a few minutes
+pageviews_cache = TTLCache(maxsize=50000, ttl=15 * 60)
+
+_local = threading.local()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+_service = None
+# Bumped by use_service() so every thread drops the client it had
+_generation = 0
+
+
+def use_service(service):
+    """ Make every client use this service object instead of building
+        a real one. Mostly for testing against a local stand-in. """
+    global _service, _generation
+    _service = service
+    _generation += 1
+    pageviews_cache.clear()
+
+
+def get_client():
+    """ Returns the gcga object belonging to the current thread """
+    client = getattr(_local, 'client', None)
+    if client is None or _local.generation != _generation:
+        # gcga brings pandas along, which the server shouldn't pay for
+        # at startup when most queries never ask for pageviews
+        from gcga import gcga
+        client = gcga(analytics=_service)
+        _local.client = client
+        _local.generation = _generation
+    return client
+
+
+def _first_pageviews(result):
+    """ Same assumption the resolver always made: the top row is the page itself """
+    if not result['pageviews']:
+        return 0
+    return int(result['pageviews'][0])
+
+
+def _fetch_chunk(platform, guids, start_date, end_date):
+    client = get_client()
+    client.set_platform(platform)
+    results = client.bulk_pageviews(guids, start_date, end_date)
+    return [_first_pageviews(results[guid]) for guid in guids]
+
+
+def _split_cached(guids, platform, start_date, end_date):
+    """ The pageviews already in the cache, and the rest of guids in chunks of CHUNK_SIZE """
+    views = {}
+    missing = []
+    for guid in guids:
+        cached = pageviews_cache.get((platform, guid, start_date, end_date))
+        if cached is None:
+            missing.append(guid)
+        else:
+            views[guid] = cached
+
+    chunks = [missing[i:i + CHUNK_SIZE] for i in range(0, len(missing), CHUNK_SIZE)]
+    return views, chunks
+
+
+def _store(views, chunk, counts, platform, start_date, end_date):
+    for guid, count in zip(chunk, counts):
+        views[guid] = count
+        pageviews_cache.set((platform, guid, start_date, end_date), count)
+
+
+def fetch_pageviews(guids, platform='gcconnex', start_date=DEFAULT_START_DATE, end_date=DEFAULT_END_DATE):
+    """
+    Returns the pageviews for each guid, in order.
+
+    Anything not in the cache is split into chunks of CHUNK_SIZE guids,
+    and the chunks are sent off concurrently.
+    """
+    views, chunks = _split_cached(guids, platform, start_date, end_date)
+    futures = [_executor.submit(_fetch_chunk, platform, chunk, start_date, end_date) for chunk in chunks]
+
+    for chunk, future in zip(chunks, futures):
+        _store(views, chunk, future.result(), platform, start_date, end_date)
+
+    return [views[guid] for guid in guids]
+
+
+async def fetch_pageviews_async(guids, platform='gcconnex', start_date=DEFAULT_START_DATE, end_date=DEFAULT_END_DATE):
+    """
+    fetch_pageviews() for async_app.py: the chunks go to the same threads,
+    but the event loop waits on them instead of blocking a thread of its own
+    """
+    loop = asyncio.get_running_loop()
+    views, chunks = _split_cached(guids, platform, start_date, end_date)
+    results = await asyncio.gather(*(
+        loop.run_in_executor(_executor, _fetch_chunk, platform, chunk, start_date, end_date)
+        for chunk in chunks
+    ))
+
+    for chunk, counts in zip(chunks, results):
+        _store(views, chunk, counts, platform, start_date, end_date)
+
+    return [views[guid] for guid in guids]
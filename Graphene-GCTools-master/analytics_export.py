@@ -0,0 +1,148 @@
+"""
+Parquet export of the frames analytics_helpers.py builds.
+
+The helpers hand back pandas frames full of object columns (strings, lists,
+dicts), and the jobs downstream used to ask GraphQL for the same data again
+on every run. Instead a frame can be saved once per day under a name:
+
+    export = ParquetExport('exports')
+    export.write('groups', analytics_helpers.to_frame(result, 'groups.edges', columns))
+    export.read('groups', '20180101', '20180331')   # three months of snapshots
+
+which lands in exports/groups/YYYYMMDD.parquet. Strings are dictionary
+encoded (each distinct department or group name is stored once) and come
+back as categoricals. Lists and dicts are kept as Parquet list and struct
+columns rather than flattened to text, and come back as arrays and dicts.
+Column names come back as strings (extract_list()'s 0, 1, 2 become '0', '1', '2').
+
+Files are read memory mapped, and read_table() hands back the Arrow table
+as is, for jobs that don't need pandas at all.
+
+Needs pyarrow, which is optional everywhere else.
+"""
+
+
+import datetime
+import math
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+_DAY = re.compile(r'^(\d{8})\.parquet$')
+
+
+def _text(value):
+    if value is None or isinstance(value, float) and math.isnan(value):
+        return None
+    return str(value)
+
+
+def _prepare(df):
+    """
+    The frame as it should be written: string columns as categoricals,
+    so they are dictionary encoded, and columns mixing types (which
+    Arrow can't store) as text
+    """
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object and not isinstance(values.dtype, pd.StringDtype):
+            continue
+        if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+            df[column] = values.astype('category')
+            continue
+        # Lists, dicts, numbers with some None...
+        try:
+            pa.array(values, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = values.map(_text).astype('category')
+    return df
+
+
+def to_table(df):
+    """ A frame as an Arrow table, strings dictionary encoded """
+    # A plain 0..n index is only metadata, any other index is kept as a column
+    preserve_index = not isinstance(df.index, pd.RangeIndex)
+    return pa.Table.from_pandas(_prepare(df), preserve_index=preserve_index)
+
+
+class ParquetExport:
+    """
+    path:        the directory holding one sub-directory per name
+    compression: the Parquet codec for the files
+    """
+    def __init__(self, path='analytics_export', compression='snappy'):
+        if pa is None:
+            raise ImportError('ParquetExport needs pyarrow (pip install pyarrow)')
+        self.path = path
+        self.compression = compression
+
+    def _file(self, name, day):
+        return os.path.join(self.path, name, day + '.parquet')
+
+    @staticmethod
+    def _day(day):
+        if day is None:
+            day = datetime.date.today()
+        if isinstance(day, (datetime.date, datetime.datetime)):
+            return day.strftime('%Y%m%d')
+        return day
+
+    def write(self, name, df, day=None):
+        """ Saves df as the name snapshot for day (today by default), replacing any """
+        day = self._day(day)
+        path = self._file(name, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written to the side and moved in, so a reader never sees half a file
+        tmp = path + '.tmp'
+        pq.write_table(to_table(df), tmp, compression=self.compression, use_dictionary=True)
+        os.replace(tmp, path)
+        return path
+
+    def days(self, name):
+        """ Every day there is a name snapshot for, oldest first """
+        try:
+            files = os.listdir(os.path.join(self.path, name))
+        except FileNotFoundError:
+            return []
+        return sorted(match.group(1) for match in map(_DAY.match, files) if match)
+
+    def read_table(self, name, first=None, last=None, columns=None):
+        """
+        The name snapshots from first to last (YYYYMMDD or dates, both
+        included) as one Arrow table, with a 'snapshot' column for the day
+        each row is from. columns only reads those columns off disk
+        """
+        first = self._day(first) if first is not None else None
+        last = self._day(last) if last is not None else None
+        tables = []
+        for day in self.days(name):
+            if first is not None and day < first or last is not None and day > last:
+                continue
+            table = pq.read_table(self._file(name, day), columns=columns, memory_map=True)
+            snapshot = pa.DictionaryArray.from_arrays(np.zeros(len(table), dtype=np.int32), [day])
+            tables.append(table.append_column('snapshot', snapshot))
+
+        if not tables:
+            return None
+        # A column that only some days have is null for the others, and one
+        # whose type changed from day to day gets one that fits them all: pandas
+        # turns an int column with a None in it into floats, and a column that
+        # was all None on some day is Arrow's null type
+        return pa.concat_tables(tables, promote_options='permissive')
+
+    def read(self, name, first=None, last=None, columns=None):
+        """ read_table() as a frame, or None if there aren't any snapshots """
+        table = self.read_table(name, first, last, columns)
+        if table is None:
+            return None
+        return table.to_pandas()
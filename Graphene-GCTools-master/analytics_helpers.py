@@ -1,3 +1,6 @@
+from itertools import chain, islice
+
+import numpy as np
 import pandas as pd
 import json
 """
@@ -6,13 +9,158 @@ in the team, there are some helper functions to convert the json files into data
 in a proper and predictable manner
 """
 
+# Optional: reads big responses from a file bit by bit
+# instead of json.load-ing all of it. Only stream_frame() needs it
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
 def to_json(graphqldata):
-    
+    """
+    The data of a result as plain dicts and lists.
+    to_frame() reads the result as it is, and doesn't need this copy
+    """
     data = graphqldata.data
     return json.loads(json.dumps(data))
 
 
+def _split_path(path):
+    return path.split('.') if path else []
+
+
+def _records(value, keys):
+    """
+    Everything at keys under value. A list along the way
+    is walked through, so each of its elements is a record
+    """
+    if value is None:
+        return
+    if isinstance(value, list):
+        for item in value:
+            yield from _records(item, keys)
+    elif not keys:
+        yield value
+    elif isinstance(value, dict):
+        yield from _records(value.get(keys[0]), keys[1:])
+
+
+def _column_value(value, keys):
+    """ The value at keys in a record, a list of them if there was a list along the way """
+    for i, key in enumerate(keys):
+        if isinstance(value, dict):
+            value = value.get(key)
+        elif isinstance(value, list):
+            rest = keys[i:]
+            return [_column_value(item, rest) for item in value]
+        else:
+            return None
+    return value
+
+
+def _records_to_frame(records, columns):
+    """ One pass over records, filling one list per column """
+    paths = [_split_path(column) for column in columns]
+    buffers = [[] for _ in columns]
+    for record in records:
+        for keys, buffer in zip(paths, buffers):
+            # Straight lookups in the usual case, the slow way
+            # only for lists and missing keys along the path
+            value = record
+            try:
+                for key in keys:
+                    value = value[key]
+            except (KeyError, TypeError, IndexError):
+                value = _column_value(record, keys)
+            buffer.append(value)
+    return pd.DataFrame(dict(zip(columns, buffers)), columns=columns)
+
+
+def to_frame(graphqldata, path, columns):
+    """
+    Flattens a GraphQL result straight into a dataframe, in one pass,
+    without to_json()'s copy or running find() once per key
+
+    graphqldata: an ExecutionResult, or a response like {'data': ...}
+    path:        dotted path to the rows, e.g. 'groups.edges'. Each
+                 element of a list along the way is a row
+    columns:     dotted paths inside a row, e.g. ['node.name', 'node.owner.email'],
+                 which are also the column names. Missing values are None,
+                 a list along the way gives a list (see extract_list())
+    """
+    data = graphqldata.data if hasattr(graphqldata, 'data') else graphqldata['data']
+    return _records_to_frame(_records(data, _split_path(path)), columns)
+
+
+def _stream_records(file, keys):
+    """
+    Same as _records(), for a response in a file, without ever holding
+    more than one record in memory. ijson names list elements 'item'
+    in its prefixes, which are dropped to compare with keys
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as f:
+            yield from _stream_records(f, keys)
+        return
+
+    target = ['data'] + keys
+    # prefix -> whether it is where the records are
+    is_target = {}
+    builder = None
+    depth = 0
+    for prefix, event, value in ijson.parse(file, use_float=True):
+        if builder is None:
+            if event in ('start_array', 'end_array', 'end_map', 'map_key', 'null'):
+                continue
+            found = is_target.get(prefix)
+            if found is None:
+                found = is_target[prefix] = [part for part in _split_path(prefix) if part != 'item'] == target
+            if not found:
+                continue
+            builder = ijson.common.ObjectBuilder()
+
+        builder.event(event, value)
+        if event in ('start_map', 'start_array'):
+            depth += 1
+        elif event in ('end_map', 'end_array'):
+            depth -= 1
+        if depth == 0:
+            yield builder.value
+            builder = None
+
+
+def stream_frame(file, path, columns, chunksize=None):
+    """
+    to_frame() for a JSON response saved to a file (a path or a file
+    object opened in binary mode), read incrementally with ijson rather
+    than loaded whole
+
+    With chunksize, returns an iterator of dataframes of
+    up to chunksize rows each, like pd.read_csv does
+    """
+    if ijson is None:
+        raise ImportError('stream_frame needs ijson (pip install ijson)')
+
+    records = _stream_records(file, _split_path(path))
+    if chunksize is None:
+        return _records_to_frame(records, columns)
+    return _stream_chunks(records, columns, chunksize)
+
+
+def _stream_chunks(records, columns, chunksize):
+    while True:
+        chunk = _records_to_frame(islice(records, chunksize), columns)
+        if not len(chunk):
+            return
+        yield chunk
+
+
 def find(key, dictionary):
+    """
+    Every value of key anywhere in dictionary. Walks the whole thing
+    each time, to_frame() gets all the columns in one pass
+    """
     for k, v in dictionary.items():
         if k == key:
             yield v
@@ -29,51 +177,62 @@ def split_nested_dict(df, col, concat=False, drop=False):
     """
     Splits a column that is a nested dictionary into a dataframe
     Each key is their own col
+
+    The whole column goes to the DataFrame constructor in one go,
+    instead of one apply per key. A dictionary missing a key gets
+    NaN there (this used to raise a KeyError)
     """
-    
-    # Obtain a list of keys
-    keys = df[col].apply(lambda x: list(x.keys()))
-    
-    key_list = []
-    
-    # Loops through all the lists in the array
-    for i in keys.values:
-        # Enters each list in the array
-        for j in i:
-            if j not in key_list:
-                key_list.append(j)
-                
-    # Construct DataFrame
-    series_list = []
-    
-    for key in key_list:
-        # Creates a series from every key in the dataframe
-        series_list.append(pd.Series(df[col].apply(lambda x: x[key])))
-    
-    new_df = pd.DataFrame(series_list)
-    
-    if len(new_df) == len(key_list):
-        # If this is true, then the df is sideways
-        new_df = new_df.T
-    
-    # Renaming the dataframe with the keys
-    new_df.columns = key_list
-    
+    values = df[col].tolist()
+
+    # Every key, in the order they first show up
+    key_list = list(dict.fromkeys(key for value in values for key in value))
+
+    new_df = pd.DataFrame.from_records(values, columns=key_list, index=df.index)
+
+    # The old version built the frame sideways and transposed it, so every
+    # column came out with the one dtype that fits all the values
+    # (with True/False counting as numbers next to other numbers). Keep that
+    if len(key_list) > 1:
+        flat = pd.Series(new_df.to_numpy(dtype=object).ravel())
+        dtype = flat.infer_objects().dtype
+        if dtype == object and all(type(x) in (bool, int, float) for x in flat):
+            dtype = pd.to_numeric(flat).dtype
+        new_df = new_df.astype(dtype)
+
     if not concat:
         return new_df
-    
-    
+
+
     new_df = pd.concat([df, new_df], axis=1)
-    
+
     if drop:
         new_df.drop(col, inplace=True, axis=1)
-        
+
     return new_df
 
 def len_of_nested_list(df, col):
     return df[col].apply(lambda x: len(x))
 
 
+def _extract_key(x, key):
+    try:
+        return x[key]
+    except:
+        pass
+
+
+def _flatten(df, col):
+    """
+    Every element of every list in df[col], one after the other,
+    with the row number and the position in the list of each
+    """
+    lists = df[col].tolist()
+    lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+    elements = np.fromiter(chain.from_iterable(lists), dtype=object, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(lists)), lengths)
+    positions = np.arange(len(elements)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return elements, rows, positions
+
 
 def extract_list(df, col, extract=None, concat=False):
     """
@@ -84,24 +243,36 @@ def extract_list(df, col, extract=None, concat=False):
     of a list
     
     Be careful!
+
+    The lists are flattened into one array and dropped into place in
+    a single grid, rather than making a pd.Series out of every row
     """
-    # Makes a series of each element in a list
-    new_df = df[col].apply(lambda x: pd.Series(x))
-    
+    elements, rows, positions = _flatten(df, col)
+    width = int(positions.max()) + 1 if len(positions) else 0
+
     # Lets you pull a specific element
     if extract is not None:
-        def extract_key(x,key):
-            try:
-                return x[key]
-            except:
-                pass
         # Pulls out a specific key
-        new_df = new_df.applymap(lambda x: extract_key(x, extract))
-    
-    
+        elements = np.fromiter((_extract_key(x, extract) for x in elements), dtype=object, count=len(elements))
+    elif len(elements):
+        # Each row used to be its own pd.Series padded with NaN, so in a list
+        # of plain numbers that has a float or is short, the ints became floats
+        kinds = np.fromiter((type(x) for x in elements), dtype=object, count=len(elements))
+        lengths = np.bincount(rows, minlength=len(df))
+        ints = np.bincount(rows, weights=kinds == int, minlength=len(df))
+        floats = np.bincount(rows, weights=kinds == float, minlength=len(df))
+        float_rows = (ints + floats == lengths) & ((floats > 0) | (lengths < width))
+        convert = float_rows[rows] & (kinds == int)
+        elements[convert] = elements[convert].astype(np.float64)
+
+    # Short lists are padded the same way as before: NaN, or None once a key was pulled out
+    grid = np.full((len(df), width), np.nan if extract is None else None, dtype=object)
+    grid[rows, positions] = elements
+    new_df = pd.DataFrame(grid, index=df.index).infer_objects()
+
     if concat:
         new_df = pd.concat([df, new_df], axis=1)
-    
+
     return new_df
 
 
@@ -109,12 +280,33 @@ def list_value_counts(df, col, key, concat=False):
     """
     Builds off of extract_list(),
     drilling down to a specific key,
-    and 
+    and counts how many times each value shows up in each row
+
+    One bincount over all of extract_list(), instead of a value_counts
+    per row of it transposed. The columns (the values) are always
+    sorted, the old version only sorted them when the rows had
+    different values
     """
+    # Same values and dtype as extract_list(...).T gave the old version
+    grid = extract_list(df, col, key).to_numpy()
+    rows = np.repeat(np.arange(len(df)), grid.shape[1])
+    values = grid.ravel()
+    found = pd.notna(values)
+
+    if found.any():
+        codes, uniques = pd.factorize(values[found], sort=True)
+        columns = pd.Index(uniques)
+    else:
+        codes = np.zeros(0, dtype=np.int64)
+        columns = pd.RangeIndex(0)
+    # Rows without any value still get their row of zeros
+    cells = np.bincount(rows[found] * len(columns) + codes, minlength=len(df) * len(columns))
+    counts = pd.DataFrame(cells.reshape(len(df), len(columns)), index=df.index, columns=columns)
+    # A value missing from a row used to come out as NaN, filled with 0
+    if (counts.to_numpy() == 0).any():
+        counts = counts.astype(np.float64)
+
     if not concat:
-        return extract_list(df, col, key).T.apply(lambda x: x.value_counts()).fillna(0).T
-    
-    new_df = extract_list(df, col, key).T.apply(lambda x: x.value_counts()).fillna(0).T
-    return pd.concat([df, new_df],axis=1)
-    
-    
\ No newline at end of file
+        return counts
+
+    return pd.concat([df, counts], axis=1)
@@ -0,0 +1,136 @@
+"""
+Local on-disk store of analytics results, one partition per day.
+
+A call like gcga.pageviews(url) over the default '30daysAgo'..'today' range
+used to fetch all 30 days every time, when only the last day or two can
+actually have changed. With a store attached, gcga only asks the API for the
+days it has never seen and the ones that are recent enough to still be moving,
+then answers the whole range from here.
+
+Rows are kept per (platform, filter, day, pagePath, pageTitle), where filter is
+the list of filter expressions the rows were fetched with. Uses sqlite3 from the
+standard library, so there is nothing to install or run.
+"""
+
+
+from contextlib import closing
+import datetime
+import json
+import sqlite3
+import time
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pageviews (
+    platform   TEXT NOT NULL,
+    filter     TEXT NOT NULL,
+    day        TEXT NOT NULL,
+    page_path  TEXT NOT NULL,
+    page_title TEXT NOT NULL,
+    views      INTEGER NOT NULL,
+    PRIMARY KEY (platform, filter, day, page_path, page_title)
+);
+CREATE TABLE IF NOT EXISTS fetched_days (
+    platform   TEXT NOT NULL,
+    filter     TEXT NOT NULL,
+    day        TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (platform, filter, day)
+);
+"""
+
+
+def filter_key(filter_list):
+    """ The filter part of a partition, from a gcga filter list """
+    return json.dumps(list(filter_list))
+
+
+def day_range(start, end):
+    """ Every day from start to end (dates), as YYYYMMDD strings like ga:date """
+    days = []
+    day = start
+    while day <= end:
+        days.append(day.strftime('%Y%m%d'))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def day_runs(days):
+    """ Groups sorted YYYYMMDD strings into contiguous (first, last) runs,
+        so each run can be fetched with a single date range """
+    runs = []
+    previous = None
+    for day in days:
+        current = datetime.datetime.strptime(day, '%Y%m%d').date()
+        if previous is not None and current - previous == datetime.timedelta(days=1):
+            runs[-1][1] = current
+        else:
+            runs.append([current, current])
+        previous = current
+    return [tuple(run) for run in runs]
+
+
+class AnalyticsStore:
+    """
+    path:         where the sqlite file lives
+    mutable_days: how many of the most recent days are still changing
+                  (Google keeps processing hits for a day or two)
+    mutable_ttl:  seconds before a still changing day is fetched again
+    """
+    def __init__(self, path='analytics_store.sqlite', mutable_days=3, mutable_ttl=15 * 60):
+        self.path = path
+        self.mutable_days = mutable_days
+        self.mutable_ttl = mutable_ttl
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # A connection per call keeps this safe to use from any thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def days_to_fetch(self, platform, key, days):
+        """ The days out of days that have to come from the API """
+        today = datetime.date.today()
+        cutoff = (today - datetime.timedelta(days=self.mutable_days)).strftime('%Y%m%d')
+        now = time.time()
+
+        with closing(self._connect()) as conn:
+            fetched = dict(conn.execute(
+                'SELECT day, fetched_at FROM fetched_days '
+                'WHERE platform = ? AND filter = ? AND day BETWEEN ? AND ?',
+                (platform, key, min(days), max(days))
+            ).fetchall()) if days else {}
+
+        missing = []
+        for day in days:
+            fetched_at = fetched.get(day)
+            if fetched_at is None:
+                missing.append(day)
+            elif day >= cutoff and now - fetched_at > self.mutable_ttl:
+                missing.append(day)
+        return missing
+
+    def write(self, platform, key, days, rows):
+        """ Replaces the partitions for days with rows of
+            (day, page_path, page_title, views) """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                'DELETE FROM pageviews WHERE platform = ? AND filter = ? AND day = ?',
+                [(platform, key, day) for day in days])
+            conn.executemany(
+                'INSERT OR REPLACE INTO pageviews VALUES (?, ?, ?, ?, ?, ?)',
+                ((platform, key, day, path, title, int(views)) for day, path, title, views in rows))
+            conn.executemany(
+                'INSERT OR REPLACE INTO fetched_days VALUES (?, ?, ?, ?)',
+                [(platform, key, day, now) for day in days])
+
+    def rows(self, platform, key, first, last):
+        """ Every (day, page_path, page_title, views) from first to last """
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                'SELECT day, page_path, page_title, views FROM pageviews '
+                'WHERE platform = ? AND filter = ? AND day BETWEEN ? AND ? '
+                'ORDER BY day',
+                (platform, key, first, last)
+            ).fetchall()
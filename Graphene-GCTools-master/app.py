@@ -1,21 +1,42 @@
-from flask import Flask
-from flask_graphql import GraphQLView
+from flask import Flask, Response, abort, request
 
-from models import db_session
+from models import db_session, engines
+import slow_queries
 from schema import schema, Users
+from backend import GCToolsBackend
+from persisted_queries import PersistedQueries, PersistedQueryView
+import response_cache
+import tracing
+
+# Off unless GCTOOLS_SLOW_QUERY_LOG is set (see slow_queries.py)
+slow_query_log = slow_queries.install_from_environ()
 
 app = Flask(__name__)
 app.debug = True
 
 app.add_url_rule(
     '/graphql',
-    view_func=GraphQLView.as_view(
+    view_func=PersistedQueryView.as_view(
         'graphql',
         schema=schema,
+        # Rejects queries that are too expensive before they run (see query_cost.py)
+        # and, if GCTOOLS_RESPONSE_CACHE is set, reuses answers while the database
+        # hasn't changed (see response_cache.py).
+        # Times SQL and resolvers, sent back with the X-GCTools-Trace header (see tracing.py)
+        backend=GCToolsBackend(response_cache=response_cache.from_environ(), tracer=tracing.Tracer()),
+        # Lets clients send a hash instead of the full query (see persisted_queries.py)
+        persisted_queries=PersistedQueries(),
         graphiql=True # for having the GraphiQL interface
     )
 )
 
+@app.route('/metrics')
+def metrics():
+    # For a scraper with the token in GCTOOLS_METRICS_TOKEN, not for the world
+    if not tracing.metrics_allowed(request.headers.get('Authorization')):
+        abort(404)
+    return Response(tracing.render_metrics(engines), content_type=tracing.CONTENT_TYPE)
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
     db_session.remove()
@@ -0,0 +1,214 @@
+"""
+asyncio version of app.py, for queries that spend their time waiting.
+
+app.py resolves a query on one Flask thread, so a query asking for pageviews
+(an HTTP call to Google Analytics) next to a few lists of members and content
+waits on each of those one after the other. Here:
+
+- the query runs on the event loop, with graphql-core's AsyncioExecutor
+- every call that blocks goes through an AsyncRunner (see the Runner in
+  loaders.py): MySQL queries, from the loaders, the @blocking resolvers, the
+  first build of the snapshots and the response cache's watermark, run in a
+  thread pool, and pageviews come from analytics_client.fetch_pageviews_async,
+  so sibling fields are all waited on at the same time instead of in turn
+- a request never has more than max_concurrency of those going at once,
+  so one big query can't take over the pool
+- a session can only be used by one thread at a time, so a request has one
+  per call it can have going at once, all reading from the same replica
+  (see database.py). Its queries run side by side like its pageviews do, and
+  it hands every session back once it's answered
+
+Same schema, backend (cost checks, response cache) and persisted queries as
+app.py. There is no GraphiQL here, use app.py for that. Needs aiohttp:
+
+    pip install aiohttp
+    python async_app.py
+"""
+
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+from aiohttp import web
+from graphql.execution.executors.asyncio import AsyncioExecutor
+from graphql_server import (HttpQueryError, default_format_error, encode_execution_results,
+                            json_encode, load_json_body, run_http_query)
+from promise import Promise
+
+import analytics_client
+from backend import GCToolsBackend
+import database
+from loaders import Loaders, Runner
+import models
+from models import db_session, engines
+from persisted_queries import PersistedQueries
+import response_cache
+import slow_queries
+from schema import schema
+import tracing
+
+
+# Threads running MySQL queries, shared by every request
+# (and about as many connections out of the engine's pool)
+THREADS = 8
+# How many blocking calls a single request can have going at once
+MAX_CONCURRENCY = 4
+
+
+class AsyncRunner(Runner):
+    """
+    Runner for one request under asyncio. Hands back Promises that
+    settle on the event loop once the work is done
+
+    pool:            the thread pool for MySQL
+    max_concurrency: how many calls can be going at once
+    """
+    def __init__(self, pool, max_concurrency=MAX_CONCURRENCY):
+        self.pool = pool
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # One session per call going at once, each used by one thread at a time
+        self.slots = list(range(max_concurrency))
+        # So all of them read from the same replica
+        self.turn = database.next_turn()
+
+    def _run(self, slot, fn, args):
+        # In the pool, with a copy of the request's context, so the statements
+        # count in the trace (see tracing.py) and go through the slot's session
+        models.request_scope.set((self, slot))
+        if not db_session.registry.has():
+            db_session(turn=self.turn)
+        return fn(*args)
+
+    async def _blocking(self, fn, args):
+        async with self.semaphore:
+            # There are as many slots as the semaphore lets calls in
+            slot = self.slots.pop()
+            try:
+                context = contextvars.copy_context()
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.pool, context.run, self._run, slot, fn, args)
+            finally:
+                self.slots.append(slot)
+
+    async def _pageviews(self, guids):
+        async with self.semaphore:
+            return await analytics_client.fetch_pageviews_async(guids)
+
+    def blocking(self, fn, *args):
+        return Promise.resolve(self._blocking(fn, args))
+
+    def pageviews(self, guids):
+        return Promise.resolve(self._pageviews(guids))
+
+    def close(self):
+        """
+        Same as app.py's teardown: the request is answered, its connections go back
+        to the pool. Whatever was loaded stays readable on the rows, they are just detached
+        """
+        for slot in self.slots:
+            scope = models.request_scope.set((self, slot))
+            try:
+                db_session.remove()
+            finally:
+                models.request_scope.reset(scope)
+
+
+class Context:
+    """
+    info.context for a request. Has the headers like the flask request
+    does (for Cache-Control, see response_cache.py) and its own loaders
+    """
+    def __init__(self, request, runner):
+        self.request = request
+        self.headers = request.headers
+        self.gctools_loaders = Loaders(runner)
+
+
+class GraphQLHandler:
+    """
+    The /graphql endpoint, doing what flask_graphql's GraphQLView does
+    (GET and POST, JSON or form bodies, errors as JSON) without GraphiQL
+    """
+    def __init__(self, schema, backend, persisted_queries=None, pool=None, max_concurrency=MAX_CONCURRENCY):
+        self.schema = schema
+        self.backend = backend
+        self.persisted_queries = persisted_queries
+        self.pool = pool if pool is not None else ThreadPoolExecutor(max_workers=THREADS)
+        self.max_concurrency = max_concurrency
+
+    async def parse_body(self, request):
+        content_type = request.content_type
+        if content_type == 'application/graphql':
+            return {'query': await request.text()}
+
+        elif content_type == 'application/json':
+            return load_json_body(await request.text())
+
+        elif content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+            return dict(await request.post())
+
+        return {}
+
+    async def handle(self, request):
+        runner = AsyncRunner(self.pool, self.max_concurrency)
+        context = Context(request, runner)
+        try:
+            data = await self.parse_body(request)
+            if self.persisted_queries is not None and not isinstance(data, list):
+                data = self.persisted_queries.resolve(data, request.query)
+
+            execution_results, all_params = run_http_query(
+                self.schema,
+                request.method.lower(),
+                data,
+                query_data=request.query,
+                backend=self.backend,
+                context=context,
+                executor=AsyncioExecutor(loop=asyncio.get_running_loop()),
+                return_promise=True,
+            )
+            execution_results = await Promise.all(execution_results)
+            result, status_code = encode_execution_results(
+                execution_results,
+                format_error=default_format_error,
+                encode=json_encode,
+            )
+            return web.Response(text=result, status=status_code, content_type='application/json')
+
+        except HttpQueryError as e:
+            return web.Response(
+                text=json_encode({'errors': [default_format_error(e)]}),
+                status=e.status_code,
+                headers=e.headers,
+                content_type='application/json',
+            )
+        finally:
+            runner.close()
+
+
+async def metrics(request):
+    """ Same /metrics as app.py """
+    if not tracing.metrics_allowed(request.headers.get('Authorization')):
+        raise web.HTTPNotFound()
+    return web.Response(body=tracing.render_metrics(engines).encode('utf8'),
+                        headers={'Content-Type': tracing.CONTENT_TYPE})
+
+
+# Same as app.py, off unless GCTOOLS_SLOW_QUERY_LOG is set
+slow_query_log = slow_queries.install_from_environ()
+
+handler = GraphQLHandler(
+    schema,
+    # Same as app.py: query cost checks, the response cache and tracing
+    backend=GCToolsBackend(response_cache=response_cache.from_environ(), tracer=tracing.Tracer()),
+    persisted_queries=PersistedQueries(),
+)
+
+app = web.Application()
+app.router.add_route('GET', '/graphql', handler.handle)
+app.router.add_route('POST', '/graphql', handler.handle)
+app.router.add_route('GET', '/metrics', metrics)
+
+if __name__ == '__main__':
+    web.run_app(app)
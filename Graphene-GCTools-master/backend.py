@@ -0,0 +1,168 @@
+"""
+The GraphQL backend used by app.py.
+
+A backend is what flask_graphql hands the query string to: it parses it into
+a document, and the document's execute() validates and runs it. Doing our own
+lets us step in between those steps without touching the view:
+
+- the cost and depth of the query are checked (see query_cost.py) before
+  anything gets executed, and over-budget queries never reach the database
+- whatever we want to report back goes in the response's extensions
+- parsed and validated documents are kept in an LRU cache keyed on the query
+  text. The front-ends send the same few queries over and over (and with
+  persisted queries, see persisted_queries.py, the text is always identical),
+  so parse() and validate() only run the first time a query is seen
+- with a ResponseCache (see response_cache.py), the data of whole queries is
+  reused for as long as the database hasn't changed, unless they ask for
+  something that doesn't come from the database
+- with a Tracer (see tracing.py), the SQL statements and resolvers of every
+  query that gets executed are timed
+"""
+
+
+from collections import OrderedDict
+
+from graphql import parse
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.validation import validate
+from promise import is_thenable
+
+from caching import TTLCache
+from loaders import get_loaders
+import query_cost
+
+
+# How many distinct queries to keep parsed and validated
+DOCUMENT_CACHE_SIZE = 1000
+
+
+class Result(ExecutionResult):
+    """
+    ExecutionResult that also writes out its extensions.
+    graphql-core keeps them, but leaves them out of to_dict()
+    """
+    __slots__ = ()
+
+    def to_dict(self, format_error=None, dict_class=OrderedDict):
+        response = super(Result, self).to_dict(format_error=format_error, dict_class=dict_class)
+        if self.extensions:
+            response['extensions'] = self.extensions
+        return response
+
+
+class GCToolsBackend(GraphQLBackend):
+    """
+    max_cost / max_depth: the budget every query has to fit in
+                          (None turns that check off)
+    document_cache_size:  how many parsed documents to keep (0 turns it off)
+    response_cache:       a ResponseCache to reuse whole responses, off by default
+    tracer:               a Tracer to time queries with, off by default
+    """
+    def __init__(self, max_cost=query_cost.MAX_COST, max_depth=query_cost.MAX_DEPTH, executor=None,
+                 document_cache_size=DOCUMENT_CACHE_SIZE, response_cache=None, tracer=None):
+        self.max_cost = max_cost
+        self.max_depth = max_depth
+        self.executor = executor
+        self.response_cache = response_cache
+        self.tracer = tracer
+        self.documents = TTLCache(maxsize=document_cache_size) if document_cache_size else None
+
+    def document_from_string(self, schema, document_string):
+        if isinstance(document_string, ast.Document):
+            return self._make_document(schema, print_ast(document_string), document_string)
+
+        if self.documents is None:
+            return self._make_document(schema, document_string, parse(document_string))
+
+        key = (id(schema), document_string)
+        document = self.documents.get(key)
+        if document is None:
+            # Syntax errors raise here, so they never end up in the cache
+            document = self._make_document(schema, document_string, parse(document_string))
+            self.documents.set(key, document)
+        return document
+
+    def _make_document(self, schema, document_string, document_ast):
+        """ Parsed once, validated once: the errors are kept with the document """
+        validation_errors = validate(schema, document_ast)
+        document = GraphQLDocument(schema=schema, document_string=document_string,
+                                   document_ast=document_ast, execute=None)
+        # The same query however it was typed, for the response cache
+        document.normalized_string = print_ast(document_ast)
+        document.execute = lambda *args, **kwargs: self.execute(document, validation_errors, *args, **kwargs)
+        return document
+
+    def execute(self, document, validation_errors, *args, **kwargs):
+        if validation_errors:
+            return Result(errors=validation_errors, invalid=True)
+
+        analysis = query_cost.CostAnalysis(document.schema, document.document_ast,
+                                           variables=kwargs.get('variable_values'),
+                                           operation_name=kwargs.get('operation_name'))
+        extensions = {'cost': analysis.to_dict(self.max_cost, self.max_depth)}
+        cost_errors = query_cost.check_cost(analysis, self.max_cost, self.max_depth)
+        if cost_errors:
+            return Result(errors=cost_errors, invalid=True, extensions=extensions)
+
+        cache = self.response_cache
+        operation_name = kwargs.get('operation_name')
+        # Keyword from flask_graphql, second positional (after root_value) from schema.execute()
+        context = kwargs.get('context', kwargs.get('context_value', args[1] if len(args) > 1 else None))
+        if cache is None or document.get_operation_type(operation_name) != 'query' or cache.wants_fresh(context) \
+                or not cache.cacheable(analysis.fields):
+            return self._run(document, extensions, None, None, context, args, kwargs)
+
+        cache_key = cache.key(document, operation_name, kwargs.get('variable_values'))
+        # Taken before running the query, so anything written meanwhile makes the entry stale
+        if kwargs.get('return_promise'):
+            # async_app.py: the watermark's queries go to the request's runner, not the event loop
+            return get_loaders(context).runner.blocking(cache.watermark).then(
+                lambda watermark: self._cached_or_run(document, extensions, cache_key, watermark, context,
+                                                      args, kwargs))
+        return self._cached_or_run(document, extensions, cache_key, cache.watermark(), context, args, kwargs)
+
+    def _cached_or_run(self, document, extensions, cache_key, watermark, context, args, kwargs):
+        cache = self.response_cache
+        data = cache.get(cache_key, watermark)
+        if data is not None:
+            extensions['cache'] = cache.stats(hit=True)
+            return Result(data=data, extensions=extensions)
+        return self._run(document, extensions, cache_key, watermark, context, args, kwargs)
+
+    def _run(self, document, extensions, cache_key, watermark, context, args, kwargs):
+        if self.executor is not None:
+            kwargs.setdefault('executor', self.executor)
+
+        trace = None
+        if self.tracer is not None:
+            kwargs['middleware'] = self.tracer.middleware(kwargs.get('middleware'))
+            trace, token = self.tracer.start()
+        try:
+            result = execute(document.schema, document.document_ast, *args, **kwargs)
+        finally:
+            if trace is not None:
+                self.tracer.detach(token)
+
+        if is_thenable(result):
+            # With return_promise=True (see async_app.py) the result isn't there yet
+            return result.then(lambda result: self._finish(result, extensions, cache_key, watermark,
+                                                           trace, context))
+        return self._finish(result, extensions, cache_key, watermark, trace, context)
+
+    def _finish(self, result, extensions, cache_key, watermark, trace=None, context=None):
+        cache = self.response_cache
+        if cache_key is not None:
+            if not result.errors and not result.invalid:
+                cache.set(cache_key, result.data, watermark)
+            extensions['cache'] = cache.stats(hit=False)
+
+        if trace is not None:
+            tracing = self.tracer.finish(trace, context)
+            if tracing is not None:
+                extensions['tracing'] = tracing
+
+        return Result(data=result.data, errors=result.errors, invalid=result.invalid,
+                      extensions=dict(result.extensions, **extensions))
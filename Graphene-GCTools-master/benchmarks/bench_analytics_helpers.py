@@ -0,0 +1,158 @@
+"""
+Benchmark for the DataFrame helpers in analytics_helpers.py.
+
+Times the old per-row versions of split_nested_dict, extract_list and
+list_value_counts against the vectorized ones on synthetic nested payloads
+shaped like our GraphQL exports (a group with its owner as a dict, and its
+members and tags as lists of dicts), and checks that both give the same
+frame.
+
+    python benchmarks/bench_analytics_helpers.py [rows ...]
+
+Defaults to 10,000, 100,000 and 1,000,000 rows. The old versions get
+slow fast (split_nested_dict builds a frame with one column per row and
+transposes it), so they are only run up to OLD_MAX_ROWS rows, set
+--old-max-rows to change that.
+
+list_value_counts now always sorts its columns, so those are put in the
+same order before comparing.
+"""
+
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import analytics_helpers
+
+
+OLD_MAX_ROWS = 100000
+
+
+# THE OLD WAY, as analytics_helpers.py did it before it was vectorized
+
+def old_split_nested_dict(df, col, concat=False, drop=False):
+    keys = df[col].apply(lambda x: list(x.keys()))
+    key_list = []
+    for i in keys.values:
+        for j in i:
+            if j not in key_list:
+                key_list.append(j)
+    series_list = []
+    for key in key_list:
+        series_list.append(pd.Series(df[col].apply(lambda x: x[key])))
+    new_df = pd.DataFrame(series_list)
+    if len(new_df) == len(key_list):
+        new_df = new_df.T
+    new_df.columns = key_list
+    if not concat:
+        return new_df
+    new_df = pd.concat([df, new_df], axis=1)
+    if drop:
+        new_df.drop(col, inplace=True, axis=1)
+    return new_df
+
+
+def old_extract_list(df, col, extract=None, concat=False):
+    new_df = df[col].apply(lambda x: pd.Series(x))
+    if extract is not None:
+        def extract_key(x, key):
+            try:
+                return x[key]
+            except:
+                pass
+        # applymap is called map in newer pandas
+        applymap = new_df.applymap if hasattr(new_df, 'applymap') else new_df.map
+        new_df = applymap(lambda x: extract_key(x, extract))
+    if concat:
+        new_df = pd.concat([df, new_df], axis=1)
+    return new_df
+
+
+def old_list_value_counts(df, col, key, concat=False):
+    if not concat:
+        return old_extract_list(df, col, key).T.apply(lambda x: x.value_counts()).fillna(0).T
+    new_df = old_extract_list(df, col, key).T.apply(lambda x: x.value_counts()).fillna(0).T
+    return pd.concat([df, new_df], axis=1)
+
+
+# SYNTHETIC DATA
+
+DEPARTMENTS = ['ESDC', 'TBS', 'SSC', 'PSPC', 'StatCan', 'NRCan', 'DFO', 'CRA']
+TAGS = ['policy', 'data', 'hr', 'gc2.0', 'innovation', 'training', 'open']
+
+
+def make_groups(n, rng):
+    """ n groups, as json.loads would hand them back from a GraphQL response """
+    owners = rng.randint(1, 10**6, n)
+    member_counts = rng.randint(0, 6, n)
+    tag_counts = rng.randint(0, 4, n)
+    groups = []
+    for i in range(n):
+        groups.append({
+            'owner': {
+                'guid': int(owners[i]),
+                'name': 'user{}'.format(owners[i]),
+                'department': DEPARTMENTS[owners[i] % len(DEPARTMENTS)],
+            },
+            'members': [
+                {'name': 'user{}'.format(j), 'department': DEPARTMENTS[(i + j) % len(DEPARTMENTS)]}
+                for j in range(member_counts[i])
+            ],
+            'tags': [{'string': TAGS[(i * 3 + j) % len(TAGS)]} for j in range(tag_counts[i])],
+        })
+    return pd.DataFrame(groups)
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print('  {:<12} {:8.3f}s'.format(label, elapsed))
+    return result, elapsed
+
+
+def compare(name, old, new, run_old, same_columns=False):
+    print(name)
+    new_result, new_time = timed('vectorized', new)
+    if not run_old:
+        return
+    old_result, old_time = timed('per row', old)
+    if same_columns:
+        old_result = old_result[list(new_result.columns)]
+    pd.testing.assert_frame_equal(old_result, new_result)
+    print('  {:<12} {:8.1f}x'.format('speedup', old_time / new_time))
+
+
+def main(sizes, old_max_rows):
+    for n in sizes:
+        rng = np.random.RandomState(0)
+        df = make_groups(n, rng)
+        run_old = n <= old_max_rows
+        print('{:,} rows{}'.format(n, '' if run_old else ' (new versions only)'))
+
+        compare('split_nested_dict',
+                lambda: old_split_nested_dict(df, 'owner', concat=True, drop=True),
+                lambda: analytics_helpers.split_nested_dict(df, 'owner', concat=True, drop=True),
+                run_old)
+        compare('extract_list',
+                lambda: old_extract_list(df, 'members', 'department'),
+                lambda: analytics_helpers.extract_list(df, 'members', 'department'),
+                run_old)
+        compare('list_value_counts',
+                lambda: old_list_value_counts(df, 'tags', 'string'),
+                lambda: analytics_helpers.list_value_counts(df, 'tags', 'string'),
+                run_old, same_columns=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', nargs='*', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--old-max-rows', type=int, default=OLD_MAX_ROWS)
+    args = parser.parse_args()
+    main(args.sizes, args.old_max_rows)
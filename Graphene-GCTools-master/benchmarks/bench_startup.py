@@ -0,0 +1,113 @@
+"""
+Benchmark for how long the GraphQL server takes to import.
+
+Every gunicorn worker (and every test run, and every shell) imports app.py,
+which used to ask for the database credentials on the terminal, connect to
+MySQL and load pandas, matplotlib and seaborn through gcga before a single
+request came in. Now the engines are made on the first query (see
+database.Engines), gcga is only imported when pageviews are asked for and
+numpy by the social graph's first build.
+
+Each run imports the module in a fresh interpreter with:
+
+- no terminal: getpass fails the run instead of waiting for input
+- no network: socket connects fail the run, so any I/O at import shows up
+- GCTOOLS_DB_URL set to a SQLite file that is never opened
+
+and prints the fastest of the runs, what the frameworks (Flask, graphene,
+SQLAlchemy) take on their own, and the modules that took longest in the
+last run, from python -X importtime.
+
+    python benchmarks/bench_startup.py [--runs 10] [--target 300] [module]
+
+module defaults to app, async_app works too if aiohttp is installed.
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Startup we're aiming for, in milliseconds
+TARGET = 300
+
+FRAMEWORKS = 'flask, flask_graphql, graphene, graphene_sqlalchemy, sqlalchemy.orm, sqlalchemy.ext.declarative'
+
+# Runs in the child interpreter before the import being timed
+GUARD = '''
+import getpass, socket
+
+def _no_prompt(*args, **kwargs):
+    raise RuntimeError('getpass() called at import')
+
+def _no_connect(self, address, *args, **kwargs):
+    raise RuntimeError('network connection to {} at import'.format(address))
+
+getpass.getpass = _no_prompt
+socket.socket.connect = _no_connect
+socket.socket.connect_ex = _no_connect
+'''
+
+
+def run(statement, importtime=False):
+    """ Seconds to run statement in a fresh interpreter, and what it wrote to stderr """
+    env = dict(os.environ, GCTOOLS_DB_URL='sqlite:///' + os.path.join(ROOT, 'bench_startup.sqlite'))
+    env.pop('GCTOOLS_DB_CONFIG', None)
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', GUARD + statement]
+
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=ROOT, env=env, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit('{} failed:\n{}'.format(statement, result.stderr))
+    return elapsed, result.stderr
+
+
+def fastest(statement, runs):
+    return min(run(statement)[0] for _ in range(runs))
+
+
+def slowest_modules(stderr, count):
+    """ The count modules with the largest cumulative import time, from -X importtime """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative), name.rstrip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main(module, runs, target):
+    baseline = fastest('pass', runs)
+    frameworks = fastest('import ' + FRAMEWORKS, runs) - baseline
+    startup = fastest('import ' + module, runs) - baseline
+
+    print('import {:<14} {:8.0f} ms'.format(module, startup * 1000))
+    print('  {:<19} {:8.0f} ms'.format('frameworks alone', frameworks * 1000))
+    print('  {:<19} {:8.0f} ms'.format('our own modules', (startup - frameworks) * 1000))
+    print('  {:<19} {:8.0f} ms {}'.format('target', target,
+                                           'met' if startup * 1000 <= target else 'missed'))
+
+    print('slowest imports (cumulative)')
+    _, stderr = run('import ' + module, importtime=True)
+    for cumulative, name in slowest_modules(stderr, 15):
+        print('  {:8.1f} ms {}'.format(cumulative / 1000, name))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('module', nargs='?', default='app')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--target', type=float, default=TARGET)
+    args = parser.parse_args()
+    main(args.module, args.runs, args.target)
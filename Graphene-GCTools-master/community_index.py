@@ -0,0 +1,144 @@
+"""
+Which groups each audience community has content in.
+
+Community.groups used to find them on every request with
+
+    SELECT g.*
+    FROM elgggroups_entity g
+    WHERE g.guid IN (SELECT g.guid
+                     FROM elgggroups_entity g, elggentities e, elggmetadata md
+                     WHERE e.container_guid = g.guid
+                     AND   md.entity_guid = e.guid
+                     AND   md.name_id = 35557
+                     AND   md.value_id = [COMMUNITY])
+
+where the subquery cross joins the groups all over again. For the big
+communities that was one of the slowest things you could ask for, and a page
+of communities asked for it once per community.
+
+Now the community -> groups mapping is built with one join over the audience
+metadata and kept up to date from the watermarks (see snapshots.py), the same
+way as group_stats.py: groups that got content, or newly tagged content, since
+the last refresh are looked at again exactly. Content being deleted, or moved
+out of a group nothing else happened in, waits for the periodic rebuild.
+
+Community.groups pages through the guids from here (see pagination.py) and
+loads the groups on the page together for every community in the request, and
+Community.groupsCount is just a lookup.
+"""
+
+
+import bisect
+
+from models import db_session, Entities, Groups, Metadata
+from snapshots import Snapshot
+
+
+# The metadata name the audience of a piece of content is stored under
+AUDIENCE_NAME_ID = 35557
+
+
+class CommunityIndex(Snapshot):
+    """
+    community (metastring id) -> sorted list of the guids of the groups with content for it
+    """
+    def __init__(self, *args, **kwargs):
+        super(CommunityIndex, self).__init__(*args, **kwargs)
+        self._groups = {}
+        # group guid -> frozenset of its communities, to know what to take out on updates
+        self._communities = {}
+
+    def _pairs(self, guids=None):
+        """
+        (community, group) for every group with content for the community,
+        or just for the groups in guids.
+
+        SQL Query:
+
+        SELECT DISTINCT md.value_id, e.container_guid
+        FROM elggmetadata md
+        JOIN elggentities e ON e.guid = md.entity_guid
+        JOIN elgggroups_entity g ON g.guid = e.container_guid
+        WHERE md.name_id = 35557
+        """
+        query = db_session.query(Metadata.value_id, Entities.container_guid).\
+            join(Entities, Entities.guid == Metadata.entity_guid).\
+            filter(Metadata.name_id == AUDIENCE_NAME_ID)
+        if guids is None:
+            # Users own content too, we only want the ones in groups
+            query = query.join(Groups, Groups.guid == Entities.container_guid)
+        else:
+            query = query.filter(Entities.container_guid.in_(guids))
+        return query.distinct()
+
+    def build(self, upper):
+        groups = {}
+        communities = {}
+        for community, guid in self._pairs():
+            groups.setdefault(community, []).append(guid)
+            communities.setdefault(guid, set()).add(community)
+
+        for guids in groups.values():
+            guids.sort()
+        self._groups = groups
+        self._communities = {guid: frozenset(found) for guid, found in communities.items()}
+
+    def update(self, lower, upper):
+        """
+        Looks again at the groups that got content, or audience metadata on
+        their content, in the window. Moved content has a new time_updated
+        """
+        touched = set()
+        touched.update(guid for (guid,) in db_session.query(Entities.container_guid).
+                       join(Groups, Groups.guid == Entities.container_guid).
+                       filter(Entities.time_updated > lower).distinct())
+        touched.update(guid for (guid,) in db_session.query(Entities.container_guid).
+                       join(Metadata, Metadata.entity_guid == Entities.guid).
+                       join(Groups, Groups.guid == Entities.container_guid).
+                       filter(Metadata.name_id == AUDIENCE_NAME_ID, Metadata.time_created > lower).distinct())
+
+        touched = list(touched)
+        for i in range(0, len(touched), 1000):
+            chunk = touched[i:i + 1000]
+            found = {guid: set() for guid in chunk}
+            for community, guid in self._pairs(chunk):
+                found[guid].add(community)
+            self._apply(found)
+        return bool(touched)
+
+    def _apply(self, found):
+        """ Sets the communities of each group in found ({guid: communities}) """
+        # Changed lists are copies swapped in at the end, so readers never see half an update
+        changed = {}
+        for guid, communities in found.items():
+            old = self._communities.get(guid, frozenset())
+            for community in old - communities:
+                guids = changed.setdefault(community, list(self._groups.get(community, ())))
+                guids.remove(guid)
+            for community in communities - old:
+                guids = changed.setdefault(community, list(self._groups.get(community, ())))
+                bisect.insort(guids, guid)
+
+            if communities:
+                self._communities[guid] = frozenset(communities)
+            else:
+                self._communities.pop(guid, None)
+
+        for community, guids in changed.items():
+            if guids:
+                self._groups[community] = guids
+            else:
+                self._groups.pop(community, None)
+
+    def groups(self, community):
+        """ The guids of the community's groups, in order """
+        self.keep_fresh()
+        return self._groups.get(community, [])
+
+    def count(self, community):
+        """ How many groups the community has """
+        return len(self.groups(community))
+
+
+# One index for the whole process
+community_index = CommunityIndex()
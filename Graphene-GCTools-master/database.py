@@ -0,0 +1,246 @@
+"""
+Engine settings, read replicas and pool metrics for models.py.
+
+The engine used to be made with SQLAlchemy's default pool against one
+hard-coded host. The settings now come from, in order of precedence:
+
+- environment variables: GCTOOLS_DB_URL, GCTOOLS_DB_REPLICAS (comma separated
+  URLs), GCTOOLS_DB_POOL_SIZE, GCTOOLS_DB_MAX_OVERFLOW, GCTOOLS_DB_POOL_RECYCLE,
+  GCTOOLS_DB_POOL_TIMEOUT and GCTOOLS_DB_PRE_PING
+- a JSON file named by GCTOOLS_DB_CONFIG, with the same keys in lower case
+  without the prefix: {"url": ..., "replicas": [...], "pool_size": 20, ...}
+- the defaults below
+
+Without a url, models.py still asks for the credentials like it always has,
+the first time something needs the database rather than when it's imported.
+
+With replicas, every session reads from one of them (picked per session,
+so a request sees one consistent replica) and only flushes go to the
+primary. Everything the GraphQL server does is a read.
+
+Every pool keeps track of how long checkouts waited for a connection, see
+pool_stats(). A wait that isn't close to zero means the pool is too small
+for the load.
+"""
+
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+
+logger = logging.getLogger(__name__)
+
+ENV_PREFIX = 'GCTOOLS_DB_'
+
+DEFAULTS = {
+    'url': None,
+    'replicas': [],
+    # Connections kept open, and how many more can be opened under load
+    'pool_size': 10,
+    'max_overflow': 10,
+    # MySQL drops connections idle for wait_timeout (8 hours by default), recycle well before
+    'pool_recycle': 3600,
+    # Seconds to wait for a connection before giving up
+    'pool_timeout': 30,
+    # Test each connection on checkout, so a dropped one is replaced instead of failing a query
+    'pre_ping': True,
+}
+
+# Checkouts waiting longer than this (in seconds) get logged
+SLOW_CHECKOUT = 1.0
+
+
+def _parse(key, value):
+    """ An environment variable as the type its default has """
+    default = DEFAULTS[key]
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, list):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return value
+
+
+def load_config(environ=None):
+    """ The engine settings, from the environment, the config file and DEFAULTS """
+    if environ is None:
+        environ = os.environ
+
+    config = dict(DEFAULTS)
+    path = environ.get(ENV_PREFIX + 'CONFIG')
+    if path:
+        with open(path) as f:
+            settings = json.load(f)
+        unknown = set(settings) - set(DEFAULTS)
+        if unknown:
+            raise ValueError('Unknown database settings in {}: {}'.format(path, ', '.join(sorted(unknown))))
+        config.update(settings)
+
+    for key in DEFAULTS:
+        value = environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            config[key] = _parse(key, value)
+    return config
+
+
+class PoolMetrics:
+    """ How long checkouts from one pool had to wait for a connection """
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow = 0
+        self._lock = threading.Lock()
+
+    def record(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            if wait > self.max_wait:
+                self.max_wait = wait
+            if wait > SLOW_CHECKOUT:
+                self.slow += 1
+
+    def stats(self):
+        return {
+            'checkouts': self.checkouts,
+            'total_wait': self.total_wait,
+            'average_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+            'max_wait': self.max_wait,
+            'slow': self.slow,
+        }
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that records the time spent getting each connection """
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def recreate(self):
+        # engine.dispose() makes a new pool, the numbers carry over
+        pool = super(TimedQueuePool, self).recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            self.metrics.record(wait)
+            if wait > SLOW_CHECKOUT:
+                logger.warning('Waited %.2fs for a database connection (%s)', wait, self.status())
+
+
+def make_engine(url, config):
+    return create_engine(
+        url,
+        encoding='latin1',
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_size=config['pool_size'],
+        max_overflow=config['max_overflow'],
+        pool_recycle=config['pool_recycle'],
+        pool_timeout=config['pool_timeout'],
+        pool_pre_ping=config['pre_ping'],
+    )
+
+
+class Engines:
+    """
+    The primary and replica engines, made the first time a session needs
+    one, so importing models.py doesn't read credentials or connect.
+
+    make_primary: makes the primary engine out of the config
+    """
+    def __init__(self, make_primary):
+        self._make_primary = make_primary
+        self._primary = None
+        self._replicas = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._primary is None:
+                config = load_config()
+                primary = self._make_primary(config)
+                self._replicas = [make_engine(url, config) for url in config['replicas']]
+                self._primary = primary
+
+    @property
+    def primary(self):
+        if self._primary is None:
+            self._load()
+        return self._primary
+
+    @property
+    def loaded(self):
+        """ Whether the engines have been made yet """
+        return self._primary is not None
+
+    @property
+    def replicas(self):
+        if self._primary is None:
+            self._load()
+        return self._replicas
+
+    def all(self):
+        """ Every engine by name """
+        engines = {'primary': self.primary}
+        for i, replica in enumerate(self.replicas):
+            engines['replica{}'.format(i + 1)] = replica
+        return engines
+
+
+# Replicas are handed out to new sessions in turn
+_turns = itertools.count()
+
+
+def next_turn():
+    """ A turn for sessions that should all read from the same replica (see RoutingSession) """
+    return next(_turns)
+
+
+class RoutingSession(Session):
+    """
+    Session that reads from a replica and writes to the primary.
+
+    engines: the Engines to pick from
+    turn:    which replica to read from, sessions given the same turn read
+             from the same one. Takes the next turn if None
+    """
+    def __init__(self, engines, turn=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self._engines = engines
+        self._turn = turn
+        self._replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replicas = self._engines.replicas
+        if not replicas or self._flushing:
+            return self._engines.primary
+        if self._replica is None:
+            turn = self._turn if self._turn is not None else next_turn()
+            self._replica = replicas[turn % len(replicas)]
+        return self._replica
+
+
+def pool_stats(engines):
+    """ Checkout waits and current use of the pool of each engine (see Engines.all()) """
+    stats = {}
+    for name, engine in engines.all().items():
+        pool = engine.pool
+        stats[name] = dict(pool.metrics.stats(), size=pool.size(),
+                           checked_out=pool.checkedout(), overflow=pool.overflow())
+    return stats
@@ -8,17 +8,81 @@
 
 # IMPORTS
 
-# For querying the analytics API
-from apiclient.discovery import build
-from oauth2client.service_account import ServiceAccountCredentials
+# The analytics API client libraries are imported in _initialize_API, only
+# when a real service is built: they take a while to load and a stand-in
+# (see analytics_client.use_service) doesn't need them
 
 # For munging data retrieved from API
 import pandas as pd
 import code
-import matplotlib
-import matplotlib.pyplot as plt
-import seaborn as sns
 from numpy import sum
+import numpy as np
+from array import array
+import datetime
+import re
+
+from analytics_store import filter_key, day_range, day_runs
+
+# Optional: string kernels that actually run in C. Without it the
+# url parsing below falls back to going row by row.
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
+
+def _get_query(url):
+    """ The search terms out of a /search?q=...&... path """
+    try:
+        query = url[url.index('=')+1:url.index('&')]
+        if len(query) == 0:
+            return 'EMPTY'
+        return query
+    except:
+        return 'query malformed'
+
+
+def _get_filetype(url):
+    """ Returns filetype inferred from url """
+    url2 = url[url.find('/')+1:]
+    return url2[:url2.find('/')]
+
+
+class ReportColumns:
+    """ Typed column buffers for report rows.
+
+        Rows are appended one at a time, so nothing but the buffers is
+        ever kept in memory: every dimension is stored as int32 codes into
+        its own table of distinct values (it becomes a categorical column),
+        and the metric as int64. Only meant for integer metrics like
+        ga:pageviews. """
+
+    def __init__(self, n_dimensions=1):
+        self.codes = [array('l') for _ in range(n_dimensions)]
+        self.categories = [{} for _ in range(n_dimensions)]
+        self.metric = array('q')
+
+    def append(self, dimensions, value):
+        for codes, categories, dimension in zip(self.codes, self.categories, dimensions):
+            code = categories.get(dimension)
+            if code is None:
+                code = categories[dimension] = len(categories)
+            codes.append(code)
+        self.metric.append(int(value))
+
+    def __len__(self):
+        return len(self.metric)
+
+    def to_frame(self):
+        """ Same columns as _parse_response_into_df, but typed """
+        names = ['dimension', 'dimension2']
+        columns = {}
+        for name, codes, categories in zip(names, self.codes, self.categories):
+            columns[name] = pd.Categorical.from_codes(
+                np.asarray(codes, dtype=np.int32), list(categories))
+        columns['metric'] = np.asarray(self.metric, dtype=np.int64)
+        return pd.DataFrame(columns)
 
 
 class gcga:
@@ -28,6 +92,19 @@ class gcga:
     _SCOPES = ['https://www.googleapis.com/auth/analytics.readonly']
     _KEY_FILE_LOCATION = '/Users/Owner/Documents/Work_transfer/GraphQLPractice/Graphene_Attempt - Phase Two/Other_Data/client_secrets.json'
     
+    # The Reporting API takes at most this many reportRequests per batchGet
+    _MAX_REQUESTS_PER_BATCH = 5
+
+    # Filter expressions longer than this are rejected by the API
+    _MAX_EXPRESSION_LENGTH = 128
+    # How many of those expressions we OR together in a single report request
+    _MAX_FILTERS_PER_CLAUSE = 10
+    # Rows per page of a report. The API defaults to 1000 and caps it at 100000
+    _PAGE_SIZE = 10000
+
+    # Shared by every gcga object, building them means reading the key file
+    _credentials = None
+
     # Keep platform IDs for easy naming
     _view_ID = {
       'gccollab':'127642570',
@@ -37,19 +114,33 @@ class gcga:
     
     # ANALYTICS API HOUSEKEEPING FUNCTIONS
     
-    def __init__(self):
+    def __init__(self, analytics=None, store=None):
+        """ analytics can be any object that quacks like the Reporting API
+            service (reports().batchGet(body=...).execute()), which is how
+            to point this at a local stand-in instead of Google.
+
+            store is an optional analytics_store.AnalyticsStore. With one,
+            pageviews and content_views only fetch the days they're missing. """
         # Set the default platform
         self.curr_platform = 'gcconnex'
         # Initialize the API object
-        self.analytics = self._initialize_API()
+        if analytics is None:
+            analytics = self._initialize_API()
+        self.analytics = analytics
+        self.store = store
     
     def _initialize_API(self):
         """ Initialize the Analytics API object """
-        credentials = ServiceAccountCredentials.from_json_keyfile_name(
-          gcga._KEY_FILE_LOCATION, gcga._SCOPES)
+        from apiclient.discovery import build
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        if gcga._credentials is None:
+            gcga._credentials = ServiceAccountCredentials.from_json_keyfile_name(
+              gcga._KEY_FILE_LOCATION, gcga._SCOPES)
         
         # Build the service object.
-        analytics = build('analyticsreporting', 'v4', credentials=credentials)
+        # The discovery cache only works with oauth2client<4 and just logs a warning
+        analytics = build('analyticsreporting', 'v4', credentials=gcga._credentials, cache_discovery=False)
         return analytics
 
     # REPORT FUNCTIONS (internal use only)
@@ -72,8 +163,8 @@ class gcga:
                 }
             ]
 
-    def _make_report(self, start_date, end_date, metric, dimension, filterClauses, order, double_dimension=False):
-        """ Build the report request and send it off. Return report object.
+    def _build_request(self, start_date, end_date, metric, dimension, filterClauses, order, double_dimension=False):
+        """ Build a single entry of reportRequests.
             string, string, string, string, list of dicts """
         # Order can be by date or views
         orderBy = self._construct_orderby(order)
@@ -82,21 +173,109 @@ class gcga:
             dim = [{'name': dimension}, {'name': 'ga:PageTitle'}]
         else:
             dim = [{'name': dimension}]
-            
+
+        return {
+            'viewId': self._view_ID[self.curr_platform],
+            'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
+            'metrics': [{'expression': metric}],
+            'dimensions': dim,
+            'dimensionFilterClauses': filterClauses,
+            'orderBys': orderBy,
+            'pageSize': gcga._PAGE_SIZE
+        }
+
+    def _batch_get(self, report_requests):
+        """ Send off up to _MAX_REQUESTS_PER_BATCH report requests in one call """
         return self.analytics.reports().batchGet(
-            body={
-                'reportRequests':[
-                    {
-                        'viewId': self._view_ID[self.curr_platform],
-                        'dateRanges': [{'startDate': start_date, 'endDate': end_date}],
-                        'metrics': [{'expression': metric}],
-                        'dimensions': dim,
-                        'dimensionFilterClauses': filterClauses,
-                        'orderBys': orderBy
-                    }
-                ]
-            }
+            body={'reportRequests': report_requests}
         ).execute()
+
+    def _iter_report_rows(self, report_requests):
+        """ Yields (request index, dimensions, metric value) for every row of
+            every report, following nextPageToken until each one runs out.
+
+            Pages are only fetched as the rows are consumed. Rows of one
+            request always come out in order, but rows of different
+            requests can be interleaved. """
+        pending = list(enumerate(report_requests))
+        while pending:
+            next_pending = []
+            for i in range(0, len(pending), gcga._MAX_REQUESTS_PER_BATCH):
+                chunk = pending[i:i + gcga._MAX_REQUESTS_PER_BATCH]
+                response = self._batch_get([request for _, request in chunk])
+                # Reports come back in the same order as the requests
+                for (index, request), report in zip(chunk, response.get('reports', [])):
+                    for row in report.get('data', {}).get('rows', []):
+                        yield index, row.get('dimensions', []), row.get('metrics', [])[0]['values'][0]
+                    token = report.get('nextPageToken')
+                    if token:
+                        next_pending.append((index, dict(request, pageToken=token)))
+            pending = next_pending
+
+    def report_rows(self, start_date, end_date, metric, dimension, filter_list, order='views', double_dimension=False):
+        """ Generator over (dimensions, metric value) for a whole report,
+            however many pages it takes. filter_list is in the same format
+            as for _construct_filter_clause.
+
+            Use this to go through very large reports without holding them. """
+        filter_clause = self._construct_filter_clause(metric, dimension, filter_list)
+        request = self._build_request(start_date, end_date, metric, dimension, filter_clause, order, double_dimension)
+        for _, dimensions, value in self._iter_report_rows([request]):
+            yield dimensions, value
+
+    def _report_into_df(self, report_request, double_dimension=False, typed=False):
+        """ Runs a single report request (every page of it) into a dataframe """
+        rows = ((dimensions, value) for _, dimensions, value in self._iter_report_rows([report_request]))
+        return self._rows_into_df(rows, double_dimension, typed)
+
+    @staticmethod
+    def _resolve_date(date):
+        """ Turns the API's date strings ('today', 'yesterday',
+            'NdaysAgo' or YYYY-MM-DD) into a date """
+        today = datetime.date.today()
+        if date == 'today':
+            return today
+        if date == 'yesterday':
+            return today - datetime.timedelta(days=1)
+        days_ago = re.match(r'^(\d+)daysAgo$', date)
+        if days_ago:
+            return today - datetime.timedelta(days=int(days_ago.group(1)))
+        return datetime.datetime.strptime(date, '%Y-%m-%d').date()
+
+    def _daily_rows(self, filter_list, start_date, end_date):
+        """ Per day pageviews of every (pagePath, pageTitle) matching the
+            filters, answered from the store.
+
+            Only the days the store doesn't have (or that are still
+            changing) are fetched, one report per contiguous run of days.
+            Returns a dataframe of date, path, title and views (int). """
+        metric = 'ga:pageviews'
+        key = filter_key(filter_list)
+        start = self._resolve_date(start_date)
+        end = self._resolve_date(end_date)
+        days = day_range(start, end)
+
+        to_fetch = self.store.days_to_fetch(self.curr_platform, key, days)
+        filter_clause = self._construct_filter_clause(metric, 'ga:pagePath', filter_list)
+        for first, last in day_runs(to_fetch):
+            request = self._build_request(first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d'),
+                                          metric, 'ga:date', filter_clause, order='date')
+            request['dimensions'] = [{'name': 'ga:date'}, {'name': 'ga:pagePath'}, {'name': 'ga:PageTitle'}]
+            rows = [
+                (dimensions[0], dimensions[1], dimensions[2], value)
+                for _, dimensions, value in self._iter_report_rows([request])
+            ]
+            self.store.write(self.curr_platform, key, day_range(first, last), rows)
+
+        rows = self.store.rows(self.curr_platform, key, days[0], days[-1]) if days else []
+        return pd.DataFrame(rows, columns=['date', 'path', 'title', 'views'])
+
+    def _make_report(self, start_date, end_date, metric, dimension, filterClauses, order, double_dimension=False):
+        """ Build the report request and send it off. Return report object.
+            string, string, string, string, list of dicts """
+        return self._batch_get([
+            self._build_request(start_date, end_date, metric, dimension, filterClauses, order, double_dimension)
+        ])
     
     def _construct_filter_clause(self, metric, dimension, filter_list):
         """ Build the filterClause object.
@@ -131,49 +310,45 @@ class gcga:
         return filter_clauses
    
     def _parse_response_into_df(self, response, double_dimension=False):
-        """ Convert a response object into a pandas dataframe """
+        """ Convert a response object into a pandas dataframe.
+            Only looks at the page of rows in the response, use
+            _report_into_df to get all of them. """
+        rows = (
+            (row.get('dimensions', []), row.get('metrics', [])[0]['values'][0])
+            for report in response.get('reports', [])
+            for row in report.get('data', {}).get('rows', [])
+        )
+        return self._rows_into_df(rows, double_dimension)
+
+    def _rows_into_df(self, rows, double_dimension=False, typed=False):
+        """ Convert (dimensions, metric value) rows into a pandas dataframe.
+
+            By default the metric is left as a string, like it always was.
+            With typed=True the rows go through ReportColumns instead. """
+        if typed:
+            columns = ReportColumns(2 if double_dimension else 1)
+            for dimensions, value in rows:
+                columns.append(dimensions, value)
+            return columns.to_frame()
+
         # Still needs a way to use multiple metrics
         # Stash the results in parallel lists
         dimension_list = []
         metric_list = []
         d2_list = []
-        
-        for report in response.get('reports', []):
-            columnHeader = report.get('columnHeader', {})
-            dimensionHeaders = columnHeader.get('dimensions', [])
-            metricHeaders = columnHeader.get('metricHeader', {}).get('metricHeaderEntries', [])
-                
-            # This is where it starts going through the actual response
-            for row in report.get('data', {}).get('rows', []):
-                dimensions = row.get('dimensions', [])
-                dateRangeValues = row.get('metrics', [])
-                dimension_list.append(dimensions[0])
-                #code.interact(local=locals())
-                if double_dimension == True:
-                    d2_list.append(dimensions[1])
-                metric_list.append(dateRangeValues[0]['values'][0])
-            
-            # THIS BETRAYED US ALL!!
-            """
-            for header, dimension in zip(dimensionHeaders, dimensions):
-                dimension_list.append(dimension)
-                #dimension.append(get_query(dimension).replace('+',' '))
-                # get_query and similar functions should only be called when appropriate
-                # Maybe more appropriate to do after function completes?
-            for i, values in enumerate(dateRangeValues):
-                for metricHeader, value in zip(metricHeaders, values.get('values')):
-                    metric_list.append(value)
-                    #print(value)"""
-        
+
+        for dimensions, value in rows:
+            dimension_list.append(dimensions[0])
+            if double_dimension == True:
+                d2_list.append(dimensions[1])
+            metric_list.append(value)
+
         # Produce a dataframe from the results
-        #code.interact(local=locals())
         if double_dimension == True:
             return pd.DataFrame({'dimension':dimension_list, 'dimension2':d2_list, 'metric':metric_list})
         else:
             return pd.DataFrame({'dimension':dimension_list, 'metric':metric_list})
-            
-        #return df[df['dimension'] != 'EMPTY']
-   
+
     # USER FACING FUNCTIONS
     
     def set_platform(self, platform):
@@ -187,14 +362,6 @@ class gcga:
     def search_queries(self, start_date='30daysAgo', end_date='today', cutoff=None):
         """ Return a dataframe containing search queries in descending order.
             Dates should be provided in YYYY-MM-DD format. """
-        def get_query(url):
-            try:
-                query = url[url.index('=')+1:url.index('&')]
-                if len(query) == 0:
-                    return 'EMPTY'
-                return query
-            except:
-                return 'query malformed'
         metric = 'ga:pageviews'
         dimension = 'ga:pagePath'
         # Build the filter clauses
@@ -203,32 +370,191 @@ class gcga:
             ['^/search', 'NOTsucces|error'])
         # Send out the request and store the response
         #code.interact(local=locals())
-        response = self._make_report(start_date, end_date, metric, dimension, filter_clause, order='views')
+        request = self._build_request(start_date, end_date, metric, dimension, filter_clause, order='views')
         
         # Need function to process response into a dataframe
-        df = self._parse_response_into_df(response)
+        df = self._report_into_df(request)
         df.columns = ['query', 'searches']
-        df['query'] = df['query'].apply(lambda x: get_query(x).replace('+',' '))
+        df['query'] = gcga._search_terms(df['query'])
         return df[df['query'] != 'EMPTY']
         # parse_response_to_df(response)
     
+    @staticmethod
+    def _search_terms(urls):
+        """ Pulls the search terms out of a series of /search?q=...&... paths.
+
+            Whatever sits between the first = and the first &, with + turned
+            back into spaces. 'EMPTY' when there is nothing in between and
+            'query malformed' when either character is missing. """
+        if pa is None:
+            return urls.astype(object).map(lambda x: _get_query(x).replace('+', ' '))
+
+        arr = pa.array(urls.astype(object).values, type=pa.string())
+        equals = pc.find_substring(arr, '=')
+        amp = pc.find_substring(arr, '&')
+        # Only right when the first & comes after the first =, the masks take care of the rest
+        query = pc.replace_substring_regex(arr, pattern=r'(?s)^[^=]*=([^&]*)&.*$', replacement=r'\1')
+        query = pc.replace_substring(query, '+', ' ')
+        empty = pc.or_(pc.equal(query, ''), pc.less(amp, equals))
+        malformed = pc.or_(pc.less(equals, 0), pc.less(amp, 0))
+        query = pc.if_else(malformed, 'query malformed', pc.if_else(empty, 'EMPTY', query))
+        return pd.Series(query.to_numpy(zero_copy_only=False), index=urls.index, dtype=object)
+
+    @staticmethod
+    def _filetypes(urls):
+        """ Filetype inferred from a series of urls: the first segment of the path.
+
+            Strips everything up to the first /, then everything from the next
+            one. A path with no second / just loses its last character, which
+            is what the per-row version has always done. """
+        if pa is None:
+            return urls.astype(object).map(_get_filetype)
+
+        arr = pa.array(urls.astype(object).values, type=pa.string())
+        # A url without any / is the same as one starting with a /,
+        # so give those one and every url splits into at least two parts
+        arr = pc.if_else(pc.match_substring(arr, '/'), arr, pc.binary_join_element_wise('', arr, '/'))
+        parts = pc.split_pattern(arr, '/', max_splits=2)
+        second = pc.list_element(parts, 1)
+        filetypes = pc.if_else(pc.equal(pc.list_value_length(parts), 3), second,
+                               pc.utf8_slice_codeunits(second, start=0, stop=-1))
+        return pd.Series(filetypes.to_numpy(zero_copy_only=False), index=urls.index, dtype=object)
+
+    @staticmethod
+    def _format_dates(dates):
+        """ YYYYMMDD strings from a series of datetimes. Same as
+            .dt.strftime('%Y%m%d'), but without formatting each one """
+        return (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).astype(str)
+
+    def _content_views_request(self, regex_query, start_date, end_date):
+        """ The report request behind content_views """
+        metric = 'ga:pageviews'
+        dimension = 'ga:pagePath'
+
+        filter_clause = self._construct_filter_clause(metric, dimension, [regex_query])
+        return self._build_request(start_date, end_date, metric, 'ga:PagePath', filter_clause, order='views', double_dimension=True)
+
     def content_views(self, regex_query, start_date='30daysAgo', end_date='today'):
         """Returns a dataframe containing views for each piece of content in a group"""
+        if self.store is not None:
+            df = self._content_views_from_store(regex_query, start_date, end_date)
+        else:
+            df = self._report_into_df(self._content_views_request(regex_query, start_date, end_date), double_dimension=True)
+        return self._content_views_from_df(df)
+
+    def _content_views_from_store(self, regex_query, start_date, end_date):
+        """ Same dataframe as the content_views report, but added up from the store """
+        daily = self._daily_rows([regex_query], start_date, end_date)
+        df = daily.groupby(['path', 'title'], sort=False)['views'].sum().reset_index()
+        df = df.sort_values('views', ascending=False, kind='mergesort')
+        return pd.DataFrame({
+            'dimension': df['path'].values,
+            'dimension2': df['title'].values,
+            'metric': df['views'].astype(str).values
+        })
+
+    def batch_content_views(self, regex_queries, start_date='30daysAgo', end_date='today'):
+        """ Same as content_views, but for many regexes at once.
+            Sends _MAX_REQUESTS_PER_BATCH report requests per batchGet call
+            and returns one result per regex, in the same order. """
+        report_requests = [
+            self._content_views_request(regex_query, start_date, end_date) for regex_query in regex_queries
+        ]
+        rows = [[] for _ in report_requests]
+        for index, dimensions, value in self._iter_report_rows(report_requests):
+            rows[index].append((dimensions, value))
+
+        return [
+            self._content_views_from_df(self._rows_into_df(report_rows, double_dimension=True))
+            for report_rows in rows
+        ]
 
-        def get_filetype(url):
-            # Returns filetype inferred from url
-            url2 = url[url.find('/')+1:]
-            return url2[:url2.find('/')]
+    @staticmethod
+    def _guid_regex(guids):
+        """ Matches any of the guids as a whole segment of the pagePath """
+        return '/(' + '|'.join(guids) + ')([/?]|$)'
 
+    def _pack_guids(self, guids):
+        """ Split guids into regexes as long as the API allows,
+            then group those into report requests' worth of filters """
+        overhead = len(self._guid_regex([]))
+        expressions = []
+        current = []
+        length = overhead
+        for guid in guids:
+            # +1 for the | in between
+            extra = len(guid) + (1 if current else 0)
+            if current and length + extra > gcga._MAX_EXPRESSION_LENGTH:
+                expressions.append(self._guid_regex(current))
+                current = []
+                length = overhead
+                extra = len(guid)
+            current.append(guid)
+            length += extra
+        if current:
+            expressions.append(self._guid_regex(current))
+
+        size = gcga._MAX_FILTERS_PER_CLAUSE
+        return [expressions[i:i + size] for i in range(0, len(expressions), size)]
+
+    def bulk_pageviews(self, guids, start_date='30daysAgo', end_date='today'):
+        """ Returns {guid: content_views(guid)} for many guids at once.
+
+            The guids are packed into regex alternations, several of those
+            OR'd into each report request, and _MAX_REQUESTS_PER_BATCH requests
+            into each batchGet, so hundreds of groups only take a few calls.
+            Rows are handed back to their guid by pulling the numeric segments
+            out of the pagePath.
+
+            Unlike content_views, a guid only matches a whole segment of the
+            path, so 123 no longer picks up the views of /blog/view/51234/. """
         metric = 'ga:pageviews'
         dimension = 'ga:pagePath'
+        keys = {str(guid): guid for guid in guids}
 
-        filter_clause = self._construct_filter_clause(metric, dimension, [regex_query])
-        response_stats = self._make_report(start_date, end_date, metric, 'ga:PagePath', filter_clause, order='views', double_dimension=True)
+        report_requests = []
+        for expressions in self._pack_guids(list(keys)):
+            filter_clause = [{
+                'operator': 'OR',
+                'filters': [
+                    {
+                        'dimensionName': dimension,
+                        'not'          : False,
+                        'expressions'  : [expression]
+                    } for expression in expressions
+                ]
+            }]
+            report_requests.append(
+                self._build_request(start_date, end_date, metric, 'ga:PagePath', filter_clause, order='views', double_dimension=True))
 
-        df = self._parse_response_into_df(response_stats, double_dimension=True)
-        
-        df['dimension'] = df['dimension'].apply(lambda x: get_filetype(x))
+        # Keep each request's rows together, so every guid's rows
+        # stay in descending order of views
+        rows = [[] for _ in report_requests]
+        for index, dimensions, value in self._iter_report_rows(report_requests):
+            rows[index].append((dimensions, value))
+
+        df = self._rows_into_df((row for report_rows in rows for row in report_rows), double_dimension=True)
+        # A path can mention more than one of the guids (rare, but it happens).
+        # With no rows at all the column comes out as floats, which .str won't take
+        df['guid'] = df['dimension'].astype(object).str.findall(r'/(\d+)(?=[/?]|$)')
+        df = df.explode('guid')
+        df = df[df['guid'].isin(list(keys))]
+        # Each guid only sits in one request, whose report is already in
+        # descending order of views. A path naming two guids from different
+        # requests would come back twice though.
+        df = df.drop_duplicates(['guid', 'dimension', 'dimension2'])
+
+        results = {}
+        grouped = dict(list(df.groupby('guid', sort=False)))
+        for key, guid in keys.items():
+            rows = grouped.get(key, df.iloc[0:0])
+            results[guid] = self._content_views_from_df(rows.drop(columns='guid').reset_index(drop=True))
+        return results
+
+    def _content_views_from_df(self, df):
+        """ Turn the parsed content_views report into lists """
+
+        df['dimension'] = gcga._filetypes(df['dimension'])
 
         #return df
         return {
@@ -253,35 +579,43 @@ class gcga:
         filter_clause = self._construct_filter_clause(metric, 'ga:pagePath', URLs)
         # Should first construct report for found pagePaths. Print to ensure nothing is wonky.
         # Construct report for stats.
-        response_names = self._make_report(start_date, end_date, metric, 'ga:pagePath', filter_clause, order='views')
-        response_stats = self._make_report(start_date, end_date, metric, 'ga:date', filter_clause, order='date')
-        
-        df_names = self._parse_response_into_df(response_names)
-        df = self._parse_response_into_df(response_stats)
+        if self.store is not None:
+            # Days the pages had no views simply have no rows, same as the API
+            daily = self._daily_rows(URLs, start_date, end_date)
+            daily = daily.groupby('date', sort=True)['views'].sum()
+            df = pd.DataFrame({'dimension': daily.index.values, 'metric': daily.astype(str).values})
+        else:
+            request_names = self._build_request(start_date, end_date, metric, 'ga:pagePath', filter_clause, order='views')
+            request_stats = self._build_request(start_date, end_date, metric, 'ga:date', filter_clause, order='date')
+
+            df_names = self._report_into_df(request_names)
+            df = self._report_into_df(request_stats)
         df.columns = ['date', 'pageviews']
-        df['date'] = df['date'].apply(lambda x: pd.to_datetime(x, format='%Y%m%d'))
+        df['date'] = pd.to_datetime(df['date'], format='%Y%m%d')
         
         df.set_index('date', inplace=True)
+        # Numbers before the missing days are filled in with 0, pandas'
+        # string dtype won't take an int
+        df['pageviews'] = df['pageviews'].astype(int)
         
-        
-        idx = pd.date_range(start_date, end_date)
+        # pandas doesn't know what '30daysAgo' is
+        idx = pd.date_range(self._resolve_date(start_date), self._resolve_date(end_date))
         #code.interact(local=locals())
         df = df.reindex(idx, fill_value=0)
         df = df[df.index.weekday < 5] # Should work now
-        df['pageviews'] = df['pageviews'].astype(int)
         if intervals == True: # Create both monthly and daily
-            df_month = df.groupby(pd.TimeGrouper(freq='M')).sum()
-            #code.interact(local=locals())
+            # MonthEnd rather than 'M', which newer pandas spells 'ME'
+            df_month = df.resample(pd.offsets.MonthEnd()).sum()
             df_month.reset_index(inplace=True)
             df_month.rename(columns={'index':'date'}, inplace=True)
             df_month['pageviews'] = df_month['pageviews'].astype(str)
-            df_month['date'] = df_month['date'].apply(lambda x: x.strftime('%Y%m%d'))
+            df_month['date'] = gcga._format_dates(df_month['date'])
             
         df.reset_index(inplace=True)
         #code.interact(local=locals()) 
         df.rename(columns={'index':'date'}, inplace=True)
         df['pageviews'] = df['pageviews'].astype(str)
-        df['date'] = df['date'].apply(lambda x: x.strftime('%Y%m%d'))
+        df['date'] = gcga._format_dates(df['date'])
 
         # Build lists from columns for C3 timechart format
         if intervals == True:
@@ -300,14 +634,3 @@ class gcga:
                 'dates': df['date'].values.tolist(),
                 'pageviews': df['pageviews'].values.tolist()
             }
-
-# For testing purposes
-ga = gcga()
-#a = '{"stepIndex":4,"reqType":{"category":1,"filter":"https://gcconnex.gc.ca/groups/profile/272967/enblueprint-2020-objectif-2020fr"},"metric":2,"time":{"startDate":"2017-01-16","endDate":"2018-01-16","allTime":false}}'
-a = ga.content_views('16005726')
-#a = ga.pageviews('https://gcconnex.gc.ca/newsfeed/')
-#a = ga.pageviews(['https://gccollab.ca/newsfeed/', 'NOToffset'], intervals=True, start_date='2010-01-01', end_date='2017-01-01')
-
-
-
-
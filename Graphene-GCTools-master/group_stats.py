@@ -0,0 +1,120 @@
+"""
+Precomputed member/discussion/blog/file counts for every group.
+
+These used to be column_property subqueries on the Groups model, which meant
+that loading any group (even just for its name) ran four extra scans over
+elggentity_relationships and elggentities. Listing all the groups was
+one of the slowest things you could ask for.
+
+Now the counts are built once with two GROUP BY queries and kept up to date
+from the time_created/time_updated watermarks (see snapshots.py). Groups that
+got a new member or new content since the last refresh are recounted exactly,
+so deletions in those groups are caught right away. Everything else waits for
+the periodic rebuild, including the group content was moved out of: only the
+group it was moved into is recounted, nothing records where it used to be.
+"""
+
+
+from sqlalchemy import func
+
+from models import db_session, Entities, Relationships, Groups
+from snapshots import Snapshot
+
+
+# Field name -> entity subtype being counted
+CONTENT_SUBTYPES = {
+    'discussions_count': 7,
+    'blogs_count': 5,
+    'files_count': 1,
+}
+
+FIELDS = ('members_count',) + tuple(CONTENT_SUBTYPES)
+
+
+class GroupStats(Snapshot):
+    """
+    group guid -> {'members_count': ..., 'discussions_count': ..., ...}
+    """
+    def __init__(self, *args, **kwargs):
+        super(GroupStats, self).__init__(*args, **kwargs)
+        self._counts = {}
+
+    def _count(self, guids=None):
+        """
+        Counts everything, or just the groups in guids.
+
+        SQL Queries:
+
+        SELECT r.guid_two, count(r.guid_one)
+        FROM elggentity_relationships r
+        WHERE r.relationship = 'member'
+        GROUP BY r.guid_two
+
+        SELECT e.container_guid, e.subtype, count(e.guid)
+        FROM elggentities e
+        JOIN elgggroups_entity g ON g.guid = e.container_guid
+        WHERE e.subtype IN (7, 5, 1)
+        GROUP BY e.container_guid, e.subtype
+        """
+        counts = {}
+        if guids is not None:
+            # Groups that lost everything still need to show up as zeros
+            for guid in guids:
+                counts[guid] = dict.fromkeys(FIELDS, 0)
+
+        members = db_session.query(Relationships.guid_two, func.count(Relationships.guid_one)).\
+            filter(Relationships.relationship == 'member')
+        # Users own blogs and files too, we only want the ones in groups
+        content = db_session.query(Entities.container_guid, Entities.subtype, func.count(Entities.guid)).\
+            join(Groups, Groups.guid == Entities.container_guid).\
+            filter(Entities.subtype.in_(list(CONTENT_SUBTYPES.values())))
+        if guids is not None:
+            members = members.filter(Relationships.guid_two.in_(guids))
+            content = content.filter(Entities.container_guid.in_(guids))
+
+        subtype_fields = {subtype: field for field, subtype in CONTENT_SUBTYPES.items()}
+
+        for guid, count in members.group_by(Relationships.guid_two):
+            counts.setdefault(guid, dict.fromkeys(FIELDS, 0))['members_count'] = count
+        for guid, subtype, count in content.group_by(Entities.container_guid, Entities.subtype):
+            counts.setdefault(guid, dict.fromkeys(FIELDS, 0))[subtype_fields[subtype]] = count
+
+        return counts
+
+    def build(self, upper):
+        self._counts = self._count()
+
+    def update(self, lower, upper):
+        """
+        Recounts the groups that were touched in the window.
+
+        Relationships only have a time_created, but content can also be
+        moved between groups, so for entities we go on time_updated
+        (which is never older than time_created). That recounts the group
+        the content is in now, the one it left keeps counting it until the
+        next rebuild
+        """
+        touched = set()
+        touched.update(guid for (guid,) in db_session.query(Relationships.guid_two).filter(
+            Relationships.relationship == 'member',
+            Relationships.time_created > lower
+        ).distinct())
+        touched.update(guid for (guid,) in db_session.query(Entities.container_guid).filter(
+            Entities.subtype.in_(list(CONTENT_SUBTYPES.values())),
+            Entities.time_updated > lower
+        ).distinct())
+
+        touched = list(touched)
+        for i in range(0, len(touched), 1000):
+            # Swapping in whole dicts keeps readers from seeing half an update
+            self._counts.update(self._count(touched[i:i + 1000]))
+        return bool(touched)
+
+    def get(self, guid):
+        """ Returns the counts for one group, all zeros if we know nothing of it """
+        self.keep_fresh()
+        return self._counts.get(guid) or dict.fromkeys(FIELDS, 0)
+
+
+# One store for the whole process
+group_stats = GroupStats()
@@ -0,0 +1,387 @@
+"""
+DataLoaders for the resolvers in schema.py.
+
+Every resolver used to run its own query for the object it was called on,
+so a list of 50 groups asking for their members was 50 trips to MySQL (and
+each of those members asking for groupsJoined was another one per member).
+
+A DataLoader collects every key asked for while one level of the GraphQL
+query is being resolved and hands them all to batch_load_fn at once, so
+each loader below turns that into a single IN (...) query per level.
+
+Loaders hold a per-key cache, so they must never outlive a request.
+Use get_loaders(info.context) to grab the set belonging to the current request.
+
+Who is friends with or a member of what doesn't come from here, but from the
+snapshot in social_graph.py.
+
+The loaders don't run their queries themselves, they hand them to the
+request's Runner. The default one just runs them; async_app.py swaps in one
+that sends them to a thread pool.
+"""
+
+
+from collections import defaultdict, namedtuple
+import functools
+
+from promise import Promise
+from promise.dataloader import DataLoader
+from sqlalchemy import cast, Integer
+
+import analytics_client
+import tracing
+from models import db_session, Users as UsersModel, Entities as EntitiesModel, Groups as GroupsModel
+from models import ObjectsEntity as ObjectsEntityModel, Metadata as MetadataModel, Metastrings as MetastringsModel
+
+
+# MySQL is fine with big IN lists, but there is no point in
+# building a query string that hits max_allowed_packet
+MAX_IN_SIZE = 1000
+
+# Bio spec -> metadata name_id. The metastring of each of these
+# holds the guid of an elggobjects_entity row
+BIO_SPECS = {
+    'work': 48642,
+    'education': 63856,
+    'skills': 730759,
+}
+
+# One entry of a user's bio
+BioRecord = namedtuple('BioRecord', ['spec', 'guid', 'title', 'description'])
+
+
+class Runner:
+    """
+    How a request runs the calls that block (MySQL, the analytics API):
+    right away, on the thread resolving the query. That's all app.py needs
+    """
+    def blocking(self, fn, *args):
+        """ fn(*args) as a Promise """
+        return Promise.resolve(fn(*args))
+
+    def pageviews(self, guids):
+        return self.blocking(analytics_client.fetch_pageviews, guids)
+
+
+def chunks(keys, size=MAX_IN_SIZE):
+    """ Split a list of keys into IN-sized pieces """
+    keys = list(keys)
+    for i in range(0, len(keys), size):
+        yield keys[i:i + size]
+
+
+class GroupedLoader(DataLoader):
+    """
+    Base class for all the loaders in this file.
+
+    Subclasses only need to implement fetch(keys), which runs the query
+    and yields (key, object) pairs. The pairs are grouped back by key
+    in the same order as the keys that were asked for.
+
+    If many is False, each key resolves to a single object (or None)
+    instead of a list.
+
+    The fields whose load() calls make up a batch are written down, so
+    the batch's queries count under them in a trace (see tracing.py).
+    """
+    many = True
+    runner = Runner()
+
+    def __init__(self, *args, **kwargs):
+        super(GroupedLoader, self).__init__(*args, **kwargs)
+        # What was being resolved for every key queued since the last batch
+        self._resolving = []
+
+    def do_resolve_reject(self, key, resolve, reject):
+        # Only keys that aren't cached get here, right as they are queued
+        resolving = tracing.resolving()
+        if resolving is not None:
+            self._resolving.append(resolving)
+        super(GroupedLoader, self).do_resolve_reject(key, resolve, reject)
+
+    def fetch(self, keys):
+        raise NotImplementedError
+
+    def _load(self, keys):
+        grouped = defaultdict(list)
+        for key, obj in self.fetch(keys):
+            grouped[key].append(obj)
+
+        if self.many:
+            return [grouped.get(key, []) for key in keys]
+        return [grouped[key][0] if key in grouped else None for key in keys]
+
+    def batch_load_fn(self, keys):
+        resolved, self._resolving = self._resolving, []
+        return self.runner.blocking(tracing.in_batch, resolved, self._load, keys)
+
+
+class ContentLoader(GroupedLoader):
+    """
+    (group guid, subtypes) -> list of entities contained in the group
+
+    The subtypes are part of the key because Group.content can be filtered
+    on them. Keys sharing the same subtypes go out in the same query,
+    which in practice is always all of them.
+
+    SELECT e.*
+    FROM elggentities e
+    WHERE e.container_guid IN ([GROUP GUIDS])
+    AND   e.subtype IN (SUBTYPE)
+    """
+    def fetch(self, keys):
+        by_subtype = defaultdict(list)
+        for guid, subtypes in keys:
+            by_subtype[subtypes].append(guid)
+
+        for subtypes, guids in by_subtype.items():
+            for chunk in chunks(guids):
+                for entity in EntitiesModel.query.filter(
+                        EntitiesModel.container_guid.in_(chunk),
+                        EntitiesModel.subtype.in_(subtypes)
+                ):
+                    yield (entity.container_guid, subtypes), entity
+
+
+class UsersLoader(GroupedLoader):
+    """
+    user guid -> user
+
+    Used for Content.author, where we already have the owner_guid,
+    and for colleagues and members, where social_graph.py has the guids
+    """
+    many = False
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for user in UsersModel.query.filter(UsersModel.guid.in_(chunk)):
+                yield user.guid, user
+
+
+class GroupsLoader(GroupedLoader):
+    """
+    group guid -> group
+    """
+    many = False
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for group in GroupsModel.query.filter(GroupsModel.guid.in_(chunk)):
+                yield group.guid, group
+
+
+class OwnerLoader(GroupedLoader):
+    """
+    entity guid -> user that owns it
+
+    Used for Comment.author. Comments are modelled on the objects table,
+    which doesn't have an owner, so we have to go through elggentities.
+
+    SELECT e.guid, ue.*
+    FROM elggentities e
+    JOIN elggusers_entity ue ON ue.guid = e.owner_guid
+    WHERE e.guid IN ([ENTITY GUIDS])
+    """
+    many = False
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for row in db_session.query(EntitiesModel.guid, UsersModel).\
+                    join(UsersModel, UsersModel.guid == EntitiesModel.owner_guid).\
+                    filter(EntitiesModel.guid.in_(chunk)):
+                yield row
+
+
+class EntityLoader(GroupedLoader):
+    """
+    guid -> row of elggentities
+    """
+    many = False
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for entity in EntitiesModel.query.filter(EntitiesModel.guid.in_(chunk)):
+                yield entity.guid, entity
+
+
+class ObjectsEntityLoader(GroupedLoader):
+    """
+    guid -> row of elggobjects_entity (title and description)
+    """
+    many = False
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for obj in ObjectsEntityModel.query.filter(ObjectsEntityModel.guid.in_(chunk)):
+                yield obj.guid, obj
+
+
+class CommentsLoader(GroupedLoader):
+    """
+    content guid -> list of comments (subtypes 64 and 66) on it
+
+    SELECT e.container_guid, oe.*
+    FROM elggobjects_entity oe
+    JOIN elggentities e ON e.guid = oe.guid
+    WHERE e.container_guid IN ([CONTENT GUIDS])
+    AND   e.subtype IN (64,66)
+    """
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for row in db_session.query(EntitiesModel.container_guid, ObjectsEntityModel).\
+                    join(EntitiesModel, EntitiesModel.guid == ObjectsEntityModel.guid).\
+                    filter(
+                        EntitiesModel.container_guid.in_(chunk),
+                        EntitiesModel.subtype.in_([64, 66])
+                    ):
+                yield row
+
+
+class MetastringsLoader(GroupedLoader):
+    """
+    entity guid -> list of metastrings stored under one metadata name
+
+    Tags are name_id 119 and audience is name_id 35557
+
+    SELECT md.entity_guid, ms.*
+    FROM elggmetastrings ms
+    JOIN elggmetadata md ON md.value_id = ms.id
+    WHERE md.name_id = [NAME ID]
+    AND   md.entity_guid IN ([ENTITY GUIDS])
+    """
+    def __init__(self, name_id, *args, **kwargs):
+        super(MetastringsLoader, self).__init__(*args, **kwargs)
+        self.name_id = name_id
+
+    def fetch(self, keys):
+        for chunk in chunks(keys):
+            for row in db_session.query(MetadataModel.entity_guid, MetastringsModel).\
+                    join(MetadataModel, MetadataModel.value_id == MetastringsModel.id).\
+                    filter(
+                        MetadataModel.name_id == self.name_id,
+                        MetadataModel.entity_guid.in_(chunk)
+                    ):
+                yield row
+
+
+class BioLoader(GroupedLoader):
+    """
+    user guid -> list of BioRecord, every spec at once
+
+    The metastring holds the guid as text, so it is cast to an integer
+    before the join (comparing the integer guid to the string column,
+    like the old IN (SELECT ms.string ...), can't use the primary key)
+
+    SELECT md.entity_guid, md.name_id, oe.*
+    FROM elggmetadata md
+    JOIN elggmetastrings ms ON ms.id = md.value_id
+    JOIN elggobjects_entity oe ON oe.guid = CAST(ms.string AS SIGNED)
+    WHERE md.name_id IN (48642, 63856, 730759)
+    AND   md.entity_guid IN ([USER GUIDS])
+    """
+    def fetch(self, keys):
+        specs = {name_id: spec for spec, name_id in BIO_SPECS.items()}
+        for chunk in chunks(keys):
+            for guid, name_id, obj in db_session.query(MetadataModel.entity_guid, MetadataModel.name_id, ObjectsEntityModel).\
+                    join(MetastringsModel, MetastringsModel.id == MetadataModel.value_id).\
+                    join(ObjectsEntityModel, ObjectsEntityModel.guid == cast(MetastringsModel.string, Integer)).\
+                    filter(
+                        MetadataModel.name_id.in_(list(specs)),
+                        MetadataModel.entity_guid.in_(chunk)
+                    ).order_by(ObjectsEntityModel.guid):
+                yield guid, BioRecord(specs[name_id], obj.guid, obj.title, obj.description)
+
+
+class PageviewsLoader(DataLoader):
+    """
+    guid -> pageviews over the default date range
+
+    Every group and piece of content in the response asking for pageviews
+    ends up in one call to analytics_client.fetch_pageviews, which handles
+    the caching and the batching of the actual API calls.
+    """
+    runner = Runner()
+
+    def batch_load_fn(self, keys):
+        return self.runner.pageviews(keys)
+
+
+class Loaders:
+    """
+    The set of loaders for a single request.
+
+    runner: how they run their queries, a Runner by default
+    """
+    def __init__(self, runner=None):
+        self.content = ContentLoader()
+        self.users = UsersLoader()
+        self.groups = GroupsLoader()
+        self.owner = OwnerLoader()
+        self.entity = EntityLoader()
+        self.objects_entity = ObjectsEntityLoader()
+        self.comments = CommentsLoader()
+        self.tags = MetastringsLoader(119)
+        self.audience = MetastringsLoader(35557)
+        self.bio = BioLoader()
+        self.pageviews = PageviewsLoader()
+
+        runner = runner if runner is not None else Runner()
+        for loader in vars(self).values():
+            loader.runner = runner
+        self.runner = runner
+
+
+def load_rows(loader, keys):
+    """
+    Loads many keys at once, leaving out the ones that have no row
+    (say, a member that was deleted since social_graph.py last looked)
+    """
+    return loader.load_many(keys).then(lambda rows: [row for row in rows if row is not None])
+
+
+def blocking(resolver):
+    """
+    For resolvers that run their own queries rather than going through a
+    loader: the whole resolver goes to the request's runner. That includes
+    building the query, so none of it happens on async_app.py's event loop
+    """
+    @functools.wraps(resolver)
+    def wrapper(root, info, **args):
+        return get_loaders(info.context).runner.blocking(lambda: resolver(root, info, **args))
+    return wrapper
+
+
+def from_snapshot(info, snapshot, read, then=None):
+    """
+    read() out of one of the snapshots (social_graph.py, group_stats.py...),
+    then then() on what it returns.
+
+    Once the snapshot is built that is just a lookup, done right here. Its
+    first build is a few big queries though, so until then read() goes to
+    the request's runner like @blocking resolvers do
+    """
+    if snapshot.built:
+        value = read()
+        return then(value) if then is not None else value
+    promise = get_loaders(info.context).runner.blocking(read)
+    return promise.then(then) if then is not None else promise
+
+
+def get_loaders(context):
+    """
+    Returns the loaders attached to the request context, making them
+    the first time they are asked for.
+
+    flask_graphql passes the flask request as the context, but a plain
+    dict works as well (handy when calling schema.execute by hand)
+    """
+    if isinstance(context, dict):
+        if 'loaders' not in context:
+            context['loaders'] = Loaders()
+        return context['loaders']
+
+    loaders = getattr(context, 'gctools_loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        setattr(context, 'gctools_loaders', loaders)
+    return loaders
@@ -11,38 +11,68 @@ from sqlalchemy import *
 from sqlalchemy.orm import (scoped_session, sessionmaker, relationship, backref, column_property, foreign)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import select
-import gcconnex as gc
 from getpass import getpass
+import contextvars
+import threading
+import database
 import code
 
 
 
-def create_engine_connection():
+def create_engine_connection(config=None):
     """
-    Copy and paste from the GCconnex file.
-    This makes it so you actually need to have
-    the credentials to log in.
+    The engine for the primary database, set up from the
+    environment or a config file (see database.py).
+
+    Without a url there, it's the copy and paste from the
+    GCconnex file: you actually need to have the credentials
+    to log in.
     """
-    username = getpass("Username")
-    password = getpass("Password")
-    database = getpass("Database Name")
-    db_connection = "mysql+pymysql://{}:{}@192.168.1.99:3306/{}".format(
-        username, password, database)
-    
+    if config is None:
+        config = database.load_config()
+
+    db_connection = config['url']
+    if db_connection is None:
+        username = getpass("Username")
+        password = getpass("Password")
+        database_name = getpass("Database Name")
+        db_connection = "mysql+pymysql://{}:{}@192.168.1.99:3306/{}".format(
+            username, password, database_name)
+
     # Uses the string formed from above to connect to the database
-    engine = create_engine(db_connection, encoding='latin1', echo=False)
+    return database.make_engine(db_connection, config)
+
+
+# Made on first use (see database.Engines): importing this module
+# doesn't ask for credentials or connect to anything
+engines = database.Engines(create_engine_connection)
 
-    return engine
 
+def __getattr__(name):
+    # models.engine is still there, made when first asked for
+    if name == 'engine':
+        return engines.primary
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
-engine = create_engine_connection()
 
-# This does something
+# What the current session belongs to. async_app.py sets it, so a request's
+# sessions follow its calls across the threads they run in (see AsyncRunner).
+# Left unset, like in app.py, there is one session per thread
+request_scope = contextvars.ContextVar('gctools_request_scope', default=None)
+
+
+def _session_scope():
+    scope = request_scope.get()
+    return scope if scope is not None else threading.current_thread()
+
+
+# Reads go to a replica when there are some
 db_session = scoped_session(sessionmaker(
+    class_=database.RoutingSession,
+    engines=engines,
     autocommit=False,
-    autoflush=False,
-    bind=engine
-))
+    autoflush=False
+), scopefunc=_session_scope)
 
 # This also does something
 Base = declarative_base()
@@ -133,16 +163,10 @@ class Users(Base):
     """
     Mapping out the Users table.
 
-    Through SQLAlchemy, you can add
-    a pseudo-ish column that is a query.
-
-    I found it was easier to add in the department
-    feature in the SQLAlchemy models than to clutter
-    up the schema any more than it needed to be.
-
-    Because department and job only ever have one
-    entry per user, it was possible to just select a max
-    of the row that corresponds to those entries
+    Department and job used to be column_property
+    subqueries in here (two extra queries for every
+    user loaded). They are now read from the cache in
+    profile_cache.py by the schema.
     """
     __tablename__ = 'elggusers_entity'
     guid = Column(Integer, primary_key=True)
@@ -155,131 +179,18 @@ class Users(Base):
     prev_last_login = Column(Integer)
     # Switch out integer tags for names
 
-    """
-    SQL Version of Department Query:
-
-    SELECT max(ms.string)
-    FROM elggmetastrings ms,
-         elggmetadata md,
-         elggusers_entity ue
-    WHERE md.entity_guid = ue.guid
-    AND   md.name_id = 8667
-    AND   ms.id = md.value_id
-    AND   ue.guid = [USER GUID]
-    """
-    department = column_property(
-        select([func.max(Metastrings.string)]).\
-        where(
-            (Metadata.entity_guid == guid) &
-            (Metadata.name_id == 8667) &
-            (Metastrings.id == Metadata.value_id)
-        )
-    )
-
-    """
-    SQL Version of Job Query:
-    SELECT max(ms.string)
-    FROM elggmetastrings ms,
-         elggmetadata md,
-         elggusers_entity ue
-    WHERE md.entity_guid = [USER GUID]
-    AND   md.name_id = 1535
-    AND   ms.id = md.value_id
-    """
-    job = column_property(
-        select([func.max(Metastrings.string)]).\
-        where(
-            (Metadata.entity_guid == guid) &
-            (Metadata.name_id == 1535) &
-            (Metastrings.id == Metadata.value_id)
-        )
-    )
-
 
 class Groups(Base):
     """
     Mapping out groups
 
-    Similar to the Users table, it is often
-    easier to get some properties of a group
-    in the SQL model rather than from
-    GraphQL's schema
+    The member, discussion, blog and file counts used to be
+    column_property subqueries in here, but they ran on every
+    group loaded whether or not anybody asked for them.
+    They now live in group_stats.py and are only looked up
+    when a query selects them.
     """
     __tablename__ = 'elgggroups_entity'
     guid = Column(Integer, primary_key=True)
     name = Column(String)
     description = Column(String)
-
-
-    """
-    In many cases, just having the count of members can suffice for queries
-    and even many development cases
-
-    SQL Query:
-
-    SELECT count(r.guid_two)
-    FROM elggentity_relationships r
-    WHERE r.guid_two = [GROUP GUID]
-    AND r.relationship = 'member'
-
-    Because the database interprets a user joining a group as them sending
-    a member request to the group, the user is guid_one and the group is
-    guid_two. There is no difference in counting guid_one or guid_two
-    """
-    members_count = column_property(
-        select([func.count(Relationships.guid_two)]).\
-        where(and_(Relationships.guid_two == guid,
-                  Relationships.relationship == 'member'))
-    )
-    """
-    Counting the number of discussions found within a group
-
-    SQL Query:
-
-    SELECT count(e.guid)
-    FROM elggentities e
-    WHERE e.container_guid = [GROUP GUID]
-    AND   e.subtype = 7
-    """
-    discussions_count = column_property(
-        select([func.count(Entities.guid)]).\
-        where(and_(
-            Entities.container_guid == guid,
-            Entities.subtype == 7
-        ))
-    )
-    """
-    Counting the number of blogs found within a group
-
-    SQL Query:
-
-    SELECT count(e.guid)
-    FROM elggentities e
-    WHERE e.container_guid = [GROUP GUID]
-    AND   e.subtype = 5
-    """
-    blogs_count = column_property(
-        select([func.count(Entities.guid)]).\
-        where(and_(
-            Entities.container_guid == guid,
-            Entities.subtype == 5
-        ))
-    )
-    """
-    Counting the number of files found within a group
-
-    SQL Query:
-
-    SELECT count(e.guid)
-    FROM elggentities e
-    WHERE e.container_guid = [GROUP GUID]
-    AND   e.subtype = 1
-    """
-    files_count = column_property(
-        select([func.count(Entities.guid)]).\
-        where(and_(
-            Entities.container_guid == guid,
-            Entities.subtype == 1
-        ))
-    )
-
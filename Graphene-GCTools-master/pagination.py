@@ -0,0 +1,210 @@
+"""
+Keyset (a.k.a. seek) pagination for the root fields in schema.py.
+
+Query.user, Query.groups and Query.communities used to return everything
+that matched with .all(), so a broad name filter pulled tens of thousands of
+rows into memory at once. They are Relay connections now, and instead of
+OFFSET (which makes MySQL walk past every skipped row) each page starts
+right after the key of the last row of the previous page:
+
+    SELECT ... WHERE [FILTERS] AND guid > [AFTER] ORDER BY guid LIMIT [FIRST + 1]
+
+The extra row only tells us whether there is a next page. The cursors are
+just the key, base64 encoded like graphene's own cursors.
+
+When every key is known up front (Community.groups, out of
+community_index.py), loaded_connection() does the same paging on the list
+itself and loads the page through a loader instead.
+
+Searches (Query.user and Query.groups with a name) come back from the search
+index best match first, which paging by guid would throw away. Those go
+through ranked_connection() instead: the page is a slice of the ranking, and
+the cursors are positions in it. A search whose results changed between two
+pages can repeat or skip a row at the edge, like OFFSET would.
+"""
+
+
+import base64
+import bisect
+
+from graphene.relay import PageInfo
+from graphene_sqlalchemy import SQLAlchemyConnectionField
+from graphql.error import GraphQLError
+
+
+# Page size when first/last isn't given
+DEFAULT_PAGE_SIZE = 20
+# Bigger first/last values are cut down to this
+MAX_PAGE_SIZE = 100
+
+_PREFIX = 'keyset:'
+_RANK_PREFIX = 'rank:'
+
+
+def encode_cursor(key, prefix=_PREFIX):
+    return base64.b64encode((prefix + str(key)).encode('utf8')).decode('ascii')
+
+
+def decode_cursor(cursor, prefix=_PREFIX):
+    """ The key in a cursor, or None if it isn't one of ours """
+    try:
+        value = base64.b64decode(cursor).decode('utf8')
+    except (TypeError, ValueError):
+        return None
+    if not value.startswith(prefix):
+        return None
+    try:
+        return int(value[len(prefix):])
+    except ValueError:
+        return None
+
+
+def page_size(size):
+    if size is None:
+        return DEFAULT_PAGE_SIZE
+    return max(0, min(size, MAX_PAGE_SIZE))
+
+
+def _window(keys, after, before, size, backwards):
+    """ The keys a page can come from, out of a sorted list of candidates """
+    start = bisect.bisect_right(keys, after) if after is not None else 0
+    end = bisect.bisect_left(keys, before) if before is not None else len(keys)
+    if backwards:
+        return keys[max(start, end - size - 1):end]
+    return keys[start:start + size + 1]
+
+
+def keyset_connection(connection_type, query, key_column, args, key=None):
+    """
+    Runs one page of query and wraps it in connection_type.
+
+    query:      the filtered SQLAlchemy query, without any ordering
+    key_column: the unique integer column to page on (usually the guid)
+    args:       the resolver args, with first/last/after/before
+    key:        gets the key back out of a row, defaults to the key_column attribute
+    """
+    if key is None:
+        key = lambda row: getattr(row, key_column.key)
+
+    after = decode_cursor(args['after']) if args.get('after') else None
+    before = decode_cursor(args['before']) if args.get('before') else None
+    if after is not None:
+        query = query.filter(key_column > after)
+    if before is not None:
+        query = query.filter(key_column < before)
+
+    # Paging backwards: take the rows just before the cursor, then flip them around
+    backwards = args.get('last') is not None and args.get('first') is None
+    size = page_size(args.get('last') if backwards else args.get('first'))
+
+    order = key_column.desc() if backwards else key_column
+    rows = query.order_by(order).limit(size + 1).all()
+    has_more = len(rows) > size
+    rows = rows[:size]
+    if backwards:
+        rows.reverse()
+
+    edges = [connection_type.Edge(node=row, cursor=encode_cursor(key(row))) for row in rows]
+    page_info = PageInfo(
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+        # Only what we can tell without another query
+        has_previous_page=has_more if backwards else after is not None,
+        has_next_page=before is not None if backwards else has_more,
+    )
+    return connection_type(edges=edges, page_info=page_info)
+
+
+def loaded_connection(connection_type, keys, args, load, key=None):
+    """
+    One page of keys we already have all of (say, from community_index.py),
+    paged like keyset_connection() and with the same cursors, but without a
+    query of its own: load(page) hands back a Promise of the rows on the
+    page, through a loader, so the pages of every parent in the request are
+    loaded together.
+
+    load: page of keys -> Promise of the rows, in order, missing ones left out
+    key:  gets the key back out of a row, defaults to its guid
+    """
+    if key is None:
+        key = lambda row: row.guid
+
+    after = decode_cursor(args['after']) if args.get('after') else None
+    before = decode_cursor(args['before']) if args.get('before') else None
+
+    backwards = args.get('last') is not None and args.get('first') is None
+    size = page_size(args.get('last') if backwards else args.get('first'))
+    window = _window(sorted(keys), after, before, size, backwards)
+    has_more = len(window) > size
+    page = window[len(window) - size:] if backwards else window[:size]
+
+    def wrap(rows):
+        edges = [connection_type.Edge(node=row, cursor=encode_cursor(key(row))) for row in rows]
+        page_info = PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_more if backwards else after is not None,
+            has_next_page=before is not None if backwards else has_more,
+        )
+        return connection_type(edges=edges, page_info=page_info)
+
+    return load(page).then(wrap)
+
+
+def ranked_connection(connection_type, query, key_column, args, keys):
+    """
+    One page of keys, in the order they come in (say, best match first
+    from a search index), wrapped in connection_type. The cursors are
+    positions in keys.
+
+    query:      the filtered SQLAlchemy query, only the rows on the page are loaded from it
+    key_column: the column keys are values of
+    args:       the resolver args, with first/last/after/before
+    """
+    after = decode_cursor(args['after'], _RANK_PREFIX) if args.get('after') else None
+    before = decode_cursor(args['before'], _RANK_PREFIX) if args.get('before') else None
+    start = after + 1 if after is not None else 0
+    end = min(before, len(keys)) if before is not None else len(keys)
+
+    backwards = args.get('last') is not None and args.get('first') is None
+    size = page_size(args.get('last') if backwards else args.get('first'))
+    if backwards:
+        start = max(start, end - size)
+    else:
+        end = min(end, start + size)
+
+    page = keys[start:end]
+    rows = {}
+    if page:
+        rows = {getattr(row, key_column.key): row for row in query.filter(key_column.in_(page))}
+
+    # A row deleted since the index last looked is just left out
+    edges = [connection_type.Edge(node=rows[key], cursor=encode_cursor(position, _RANK_PREFIX))
+             for position, key in enumerate(page, start) if key in rows]
+    page_info = PageInfo(
+        start_cursor=edges[0].cursor if edges else None,
+        end_cursor=edges[-1].cursor if edges else None,
+        has_previous_page=start > 0,
+        has_next_page=end < len(keys),
+    )
+    return connection_type(edges=edges, page_info=page_info)
+
+
+class PagedConnectionField(SQLAlchemyConnectionField):
+    """
+    SQLAlchemyConnectionField that has to be given first or last, and
+    returns at most MAX_PAGE_SIZE rows. For allUsers and allEntities,
+    which otherwise hand back the whole table.
+
+    These still page with OFFSET, see keyset_connection() for the fields
+    that get used for more than poking around in GraphiQL
+    """
+    @classmethod
+    def connection_resolver(cls, resolver, connection_type, model, root, info, **args):
+        if args.get('first') is None and args.get('last') is None:
+            raise GraphQLError('{} needs first or last (at most {}).'.format(info.field_name, MAX_PAGE_SIZE))
+        for name in ('first', 'last'):
+            if args.get(name) is not None:
+                args[name] = page_size(args[name])
+        return super(PagedConnectionField, cls).connection_resolver(resolver, connection_type, model, root, info,
+                                                                    **args)
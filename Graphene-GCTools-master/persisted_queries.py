@@ -0,0 +1,131 @@
+"""
+Persisted queries for the /graphql endpoint.
+
+Instead of sending the whole query text with every request, a client sends
+its sha256 hash:
+
+    {"extensions": {"persistedQuery": {"version": 1, "sha256Hash": "..."}},
+     "variables": {...}}
+
+(or the same as GET parameters, with extensions as a JSON string) and the
+hash is swapped for the query text before the request goes any further.
+Since the text is then always exactly the same, the document cache in
+backend.py hands back the already parsed and validated document.
+
+Queries get here in two ways:
+
+- registered up front, from a JSON file of {hash: query} (see load())
+- automatically, the way Apollo's automatic persisted queries work: a client
+  sends just the hash, gets back a PersistedQueryNotFound error, and then
+  sends the hash along with the query, which is remembered from then on
+"""
+
+
+import hashlib
+import json
+
+from flask import request
+from flask_graphql import GraphQLView
+from graphql_server import HttpQueryError
+
+from caching import TTLCache
+
+
+# How many automatically persisted queries to remember
+MAX_AUTOMATIC_QUERIES = 1000
+
+
+def query_hash(query):
+    """ The hash a client sends for a query """
+    return hashlib.sha256(query.encode('utf8')).hexdigest()
+
+
+class PersistedQueries:
+    """
+    path:      a JSON file of {hash: query} to register on startup
+    automatic: whether clients can register queries themselves
+    maxsize:   how many of those to keep (least recently used go first)
+    """
+    def __init__(self, path=None, automatic=True, maxsize=MAX_AUTOMATIC_QUERIES):
+        self.automatic = automatic
+        self.registered = {}
+        self.cache = TTLCache(maxsize=maxsize)
+        if path is not None:
+            self.load(path)
+
+    def load(self, path):
+        with open(path) as f:
+            for sha, query in json.load(f).items():
+                if query_hash(query) != sha:
+                    raise ValueError('Persisted query {} does not match its hash'.format(sha))
+                self.registered[sha] = query
+
+    def register(self, query):
+        """ Registers a query for good and returns its hash """
+        sha = query_hash(query)
+        self.registered[sha] = query
+        return sha
+
+    def get(self, sha):
+        query = self.registered.get(sha)
+        if query is None:
+            query = self.cache.get(sha)
+        return query
+
+    def resolve(self, data, query_data):
+        """
+        Returns the request parameters with the query filled in from its hash.
+
+        data is the request body, query_data the GET parameters, same as what
+        flask_graphql passes around. Requests without a persistedQuery
+        extension come back untouched.
+        """
+        extensions = data.get('extensions') or query_data.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpQueryError(400, 'Extensions are invalid JSON.')
+
+        persisted = (extensions or {}).get('persistedQuery')
+        if not persisted:
+            return data
+
+        sha = persisted.get('sha256Hash')
+        if not sha:
+            raise HttpQueryError(400, 'persistedQuery needs a sha256Hash.')
+
+        query = data.get('query') or query_data.get('query')
+        if query:
+            if query_hash(query) != sha:
+                raise HttpQueryError(400, 'provided sha does not match query')
+            if self.automatic and sha not in self.registered:
+                self.cache.set(sha, query)
+            return data
+
+        query = self.get(sha)
+        if query is None:
+            # Apollo clients look for this exact message, and then retry with the query.
+            # Without automatic registration, there is no point in retrying
+            raise HttpQueryError(200, 'PersistedQueryNotFound' if self.automatic else 'PersistedQueryNotSupported')
+
+        data = dict(data)
+        data['query'] = query
+        return data
+
+
+class PersistedQueryView(GraphQLView):
+    """
+    GraphQLView that understands persisted queries.
+
+    persisted_queries: the PersistedQueries to look hashes up in
+    """
+    persisted_queries = None
+
+    def parse_body(self):
+        data = super(PersistedQueryView, self).parse_body()
+        if self.persisted_queries is None:
+            return data
+        if isinstance(data, list):
+            return [self.persisted_queries.resolve(params, {}) for params in data]
+        return self.persisted_queries.resolve(data, request.args)
@@ -0,0 +1,138 @@
+"""
+Cache of the profile attributes that live in metadata (department and job).
+
+They used to be correlated max() subqueries on the Users model, two per user
+row, including every row of allUsers. Here they are pulled for every user in
+one GROUP BY and kept in a small column store: a dict from guid to row number,
+and for each attribute an array of codes into one shared table of strings.
+Departments repeat a lot, so each distinct string is only kept once.
+
+Kept fresh through the Metadata.time_created watermark (see snapshots.py).
+Users that got new metadata are looked up again in full, which also catches
+the old value being deleted when a profile is edited.
+"""
+
+
+from array import array
+
+from sqlalchemy import func
+
+from models import db_session, Metadata, Metastrings, Users
+from snapshots import Snapshot
+
+
+# Attribute name -> metadata name_id
+PROFILE_FIELDS = {
+    'department': 8667,
+    'job': 1535,
+}
+
+# Code used when a user doesn't have the attribute
+MISSING = -1
+
+
+class ProfileTable:
+    """
+    The column store itself. A rebuild fills a new one and swaps it in,
+    so readers never see a half-built table.
+    """
+    def __init__(self):
+        self.index = {}
+        self.columns = {field: array('l') for field in PROFILE_FIELDS}
+        self.strings = []
+        self.codes = {}
+
+    def _code(self, string):
+        """ Interns a string into the string table """
+        if string is None:
+            return MISSING
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(string)
+            self.codes[string] = code
+        return code
+
+    def set(self, guid, attributes):
+        row = self.index.get(guid)
+        if row is None:
+            # Columns first, so a reader never finds a row that isn't there yet
+            for field, column in self.columns.items():
+                column.append(self._code(attributes.get(field)))
+            self.index[guid] = len(self.columns['department']) - 1
+        else:
+            for field, column in self.columns.items():
+                column[row] = self._code(attributes.get(field))
+
+    def get(self, guid, field):
+        row = self.index.get(guid)
+        if row is None:
+            return None
+        code = self.columns[field][row]
+        if code == MISSING:
+            return None
+        return self.strings[code]
+
+
+class ProfileCache(Snapshot):
+    """
+    user guid -> department, job
+    """
+    def __init__(self, *args, **kwargs):
+        super(ProfileCache, self).__init__(*args, **kwargs)
+        self._table = ProfileTable()
+
+    def _fetch(self, guids=None):
+        """
+        SQL Query:
+
+        SELECT md.entity_guid, md.name_id, max(ms.string)
+        FROM elggmetadata md
+        JOIN elggmetastrings ms ON ms.id = md.value_id
+        JOIN elggusers_entity ue ON ue.guid = md.entity_guid
+        WHERE md.name_id IN (8667, 1535)
+        GROUP BY md.entity_guid, md.name_id
+
+        max() is the same choice the old column_property made
+        when a user somehow has more than one value
+        """
+        fields = {name_id: field for field, name_id in PROFILE_FIELDS.items()}
+        query = db_session.query(Metadata.entity_guid, Metadata.name_id, func.max(Metastrings.string)).\
+            join(Metastrings, Metastrings.id == Metadata.value_id).\
+            join(Users, Users.guid == Metadata.entity_guid).\
+            filter(Metadata.name_id.in_(list(fields)))
+        if guids is not None:
+            query = query.filter(Metadata.entity_guid.in_(guids))
+
+        values = {}
+        for guid, name_id, string in query.group_by(Metadata.entity_guid, Metadata.name_id):
+            values.setdefault(guid, {})[fields[name_id]] = string
+        return values
+
+    def build(self, upper):
+        table = ProfileTable()
+        for guid, attributes in self._fetch().items():
+            table.set(guid, attributes)
+        self._table = table
+
+    def update(self, lower, upper):
+        touched = [guid for (guid,) in db_session.query(Metadata.entity_guid).filter(
+            Metadata.name_id.in_(list(PROFILE_FIELDS.values())),
+            Metadata.time_created > lower
+        ).distinct()]
+
+        for i in range(0, len(touched), 1000):
+            chunk = touched[i:i + 1000]
+            values = self._fetch(chunk)
+            for guid in chunk:
+                self._table.set(guid, values.get(guid, {}))
+        return bool(touched)
+
+    def get(self, guid, field):
+        """ Returns one attribute of one user, or None """
+        self.keep_fresh()
+        return self._table.get(guid, field)
+
+
+# One cache for the whole process
+profile_cache = ProfileCache()
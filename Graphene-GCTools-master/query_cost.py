@@ -0,0 +1,217 @@
+"""
+Static cost analysis of GraphQL queries, done before anything is executed.
+
+Nothing stops a GraphiQL user from asking for allEntities (millions of rows)
+or for Users -> colleagues -> groupsJoined -> members -> ... as deep as they
+like, and any of those can pin the MySQL server. So every query is walked
+once against the schema before it runs:
+
+- every field has a weight: FIELD_COSTS if it is listed there, otherwise 1 for
+  fields returning objects (they cost a query) and 0 for plain scalars
+- a list field multiplies the cost of everything under it by how many items it
+  is expected to return: its first/last/limit argument if it has one (first and
+  last at most pagination.MAX_PAGE_SIZE, like the resolvers do), else LIST_SIZES,
+  else DEFAULT_LIST_SIZE
+- the fields in PAGED_FIELDS have no sensible size without first or last, so
+  a query leaving those out is rejected whatever its cost
+- the depth is how many levels of objects are nested
+
+Introspection (__schema, __type, __typename) is free, so GraphiQL keeps working.
+"""
+
+
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import (GraphQLList, GraphQLNonNull, GraphQLObjectType,
+                                     GraphQLInterfaceType, GraphQLUnionType, get_named_type)
+
+from pagination import MAX_PAGE_SIZE
+
+
+MAX_COST = 5000
+MAX_DEPTH = 8
+
+# How many items we assume a list field returns, when nothing says otherwise
+DEFAULT_LIST_SIZE = 10
+
+# Type.field -> weight of one call to the field
+FIELD_COSTS = {
+    # Straight to the biggest tables, and every page counts the whole table
+    'Query.allEntities': 10,
+    'Query.allUsers': 5,
+    # These go out to the analytics API
+    'Group.pageviews': 5,
+    'Content.pageviews': 5,
+    # Worked out on the relationship graph
+    'Group.similarGroups': 10,
+    'Users.suggestedColleagues': 10,
+}
+
+# Type.field -> how many items the list usually has
+LIST_SIZES = {
+    'Group.members': 50,
+    'Group.content': 50,
+    'Users.colleagues': 50,
+    'Users.groupsJoined': 20,
+    'Colleague.groupsJoined': 20,
+    # Paged connections, without first/last they return pagination.DEFAULT_PAGE_SIZE
+    'Community.groups': 20,
+    'Query.communities': 20,
+    'Query.groups': 20,
+    'Query.user': 20,
+}
+
+# Type.field that must be given first or last (see PagedConnectionField in pagination.py)
+PAGED_FIELDS = ('Query.allEntities', 'Query.allUsers')
+
+
+def _operation(document_ast, operation_name):
+    operations = [d for d in document_ast.definitions if isinstance(d, ast.OperationDefinition)]
+    if operation_name is None:
+        return operations[0] if len(operations) == 1 else None
+    for operation in operations:
+        if operation.name and operation.name.value == operation_name:
+            return operation
+    return None
+
+
+def _argument(field_ast, name, variables):
+    """ The integer value of an argument, following variables """
+    for argument in field_ast.arguments or []:
+        if argument.name.value != name:
+            continue
+        value = argument.value
+        if isinstance(value, ast.Variable):
+            value = (variables or {}).get(value.name.value)
+            return int(value) if value is not None else None
+        if isinstance(value, ast.IntValue):
+            return int(value.value)
+    return None
+
+
+def _is_list(graphql_type):
+    if isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return isinstance(graphql_type, GraphQLList)
+
+
+class CostAnalysis:
+    """
+    Works out the cost and depth of one operation.
+
+    field_costs / list_sizes / default_list_size default to the module values.
+    """
+    def __init__(self, schema, document_ast, variables=None, operation_name=None,
+                 field_costs=None, list_sizes=None, default_list_size=None):
+        self.schema = schema
+        self.variables = variables
+        self.field_costs = FIELD_COSTS if field_costs is None else field_costs
+        self.list_sizes = LIST_SIZES if list_sizes is None else list_sizes
+        self.default_list_size = DEFAULT_LIST_SIZE if default_list_size is None else default_list_size
+        self.fragments = {
+            d.name.value: d for d in document_ast.definitions if isinstance(d, ast.FragmentDefinition)
+        }
+
+        self.cost = 0
+        self.depth = 0
+        # Every Type.field selected
+        self.fields = set()
+        # Fields from PAGED_FIELDS asked for without first or last
+        self.unpaged = []
+        operation = _operation(document_ast, operation_name)
+        if operation is not None:
+            if operation.operation == 'mutation':
+                root = schema.get_mutation_type()
+            elif operation.operation == 'subscription':
+                root = schema.get_subscription_type()
+            else:
+                root = schema.get_query_type()
+            self.cost, self.depth = self._selection_set(operation.selection_set, root, 1)
+
+    def _fields(self, selection_set, parent_type):
+        """ Flattens fragments, yielding (field ast, type it is selected on) """
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield selection, parent_type
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                for field in self._fields(selection.selection_set, fragment_type):
+                    yield field
+            elif isinstance(selection, ast.FragmentSpread):
+                fragment = self.fragments.get(selection.name.value)
+                if fragment is None:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value)
+                for field in self._fields(fragment.selection_set, fragment_type):
+                    yield field
+
+    def _selection_set(self, selection_set, parent_type, depth):
+        cost = 0
+        max_depth = depth
+        for field_ast, field_parent in self._fields(selection_set, parent_type):
+            name = field_ast.name.value
+            if name.startswith('__'):
+                continue
+
+            fields = field_parent.fields if isinstance(field_parent, (GraphQLObjectType, GraphQLInterfaceType)) else {}
+            field_def = fields.get(name)
+            if field_def is None:
+                # Validation has already complained about it
+                continue
+
+            key = '{}.{}'.format(field_parent.name, name)
+            self.fields.add(key)
+            named_type = get_named_type(field_def.type)
+            composite = isinstance(named_type, (GraphQLObjectType, GraphQLInterfaceType, GraphQLUnionType))
+            weight = self.field_costs.get(key, 1 if composite else 0)
+
+            child_cost = 0
+            child_depth = depth
+            if field_ast.selection_set is not None and composite:
+                child_cost, child_depth = self._selection_set(field_ast.selection_set, named_type, depth + 1)
+
+            # Connections take first/last, and their edges list is already that size
+            size = _argument(field_ast, 'first', self.variables)
+            if size is None:
+                size = _argument(field_ast, 'last', self.variables)
+            if size is not None:
+                size = min(size, MAX_PAGE_SIZE)
+            elif key in PAGED_FIELDS:
+                self.unpaged.append(key)
+            else:
+                size = _argument(field_ast, 'limit', self.variables)
+            if size is not None:
+                # The resolvers treat a negative size as 0, it mustn't take cost away from the siblings
+                size = max(0, size)
+            elif named_type.name.endswith('Connection') or (
+                    _is_list(field_def.type) and not field_parent.name.endswith('Connection')):
+                size = self.list_sizes.get(key, self.default_list_size)
+
+            cost += (size or 1) * (weight + child_cost)
+            max_depth = max(max_depth, child_depth)
+        return cost, max_depth
+
+    def to_dict(self, max_cost=MAX_COST, max_depth=MAX_DEPTH):
+        return {
+            'requested': self.cost,
+            'maximum': max_cost,
+            'depth': self.depth,
+            'maximumDepth': max_depth,
+        }
+
+
+def check_cost(analysis, max_cost=MAX_COST, max_depth=MAX_DEPTH):
+    """ Returns the errors for a query that is over budget (empty if it is fine) """
+    errors = []
+    for key in analysis.unpaged:
+        errors.append(GraphQLError(
+            '{} needs first or last (at most {}).'.format(key, MAX_PAGE_SIZE)))
+    if max_depth is not None and analysis.depth > max_depth:
+        errors.append(GraphQLError(
+            'Query is nested {} levels deep, the maximum is {}.'.format(analysis.depth, max_depth)))
+    if max_cost is not None and analysis.cost > max_cost:
+        errors.append(GraphQLError(
+            'Query has a cost of {}, the maximum is {}. Ask for fewer or smaller lists.'.format(analysis.cost, max_cost)))
+    return errors
@@ -0,0 +1,152 @@
+"""
+Whole-response cache for GraphQL queries.
+
+Most of what gets asked for (group names, memberships, community lists)
+changes slowly, yet every request used to run the whole resolver tree again.
+With a ResponseCache handed to GCToolsBackend (see backend.py), the data of
+a successful query is kept, keyed on:
+
+- the normalized query (print_ast of the parsed document, so whitespace and
+  comments don't matter) and the operation name
+- the variables
+- the platform, i.e. the elgg database the answer came from
+
+An entry is only served while the watermark it was stored with is still
+current. The watermark is the latest time_updated/last_action in
+elggentities plus the highest relationship id (joining a group or adding a
+colleague only inserts a relationship), plus the generation of the
+snapshots (see snapshots.py). Most of an answer comes out of those, which
+catch up with the database in the background: the first answer after a
+write can still be the old one, and it is only served until the snapshots
+have caught up. That also covers what the database part misses, like a
+profile's department or job being edited. Elgg hard-deletes rows, which a
+watermark can't see, so entries also expire after ttl seconds.
+
+Only queries are cached, never mutations, and a request sent with
+Cache-Control: no-cache always runs for real. Neither are queries asking for
+any of UNCACHED_FIELDS: pageviews come from the analytics API, which the
+watermark knows nothing about, so they would only ever be as fresh as the ttl.
+
+It is off unless turned on from the environment (see from_environ()):
+GCTOOLS_RESPONSE_CACHE set to anything but 0, with GCTOOLS_RESPONSE_CACHE_SIZE
+(1000 responses by default) and GCTOOLS_RESPONSE_CACHE_TTL (300 seconds).
+Whoever turns it on accepts that a deleted row can show up for up to ttl.
+"""
+
+
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from caching import TTLCache
+from models import db_session, engines, Entities, Relationships
+import snapshots
+
+
+ENV_NAME = 'GCTOOLS_RESPONSE_CACHE'
+
+MAXSIZE = 1000
+TTL = 5 * 60
+
+# Type.field whose data doesn't come from the database
+UNCACHED_FIELDS = frozenset(['Group.pageviews', 'Content.pageviews', 'Page.pageviews'])
+
+
+class ResponseCache:
+    """
+    maxsize:        how many responses to keep
+    ttl:            seconds a response stays valid at most
+    check_interval: seconds between two looks at the database watermark
+    """
+    def __init__(self, maxsize=MAXSIZE, ttl=TTL, check_interval=1):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.check_interval = check_interval
+        self._watermark = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def watermark(self):
+        """
+        SELECT max(time_updated), max(last_action),
+               (SELECT max(id) FROM elggentity_relationships)
+        FROM elggentities
+
+        Looked up at most once every check_interval seconds,
+        the generation of the snapshots every time
+        """
+        now = time.time()
+        if self._watermark is None or now - self._checked >= self.check_interval:
+            with self._lock:
+                if self._watermark is None or now - self._checked >= self.check_interval:
+                    row = db_session.execute(select([
+                        func.max(Entities.time_updated),
+                        func.max(Entities.last_action),
+                        select([func.max(Relationships.id)]).as_scalar(),
+                    ])).first()
+                    self._watermark = tuple(row)
+                    self._checked = time.time()
+            # Answers from the cache don't read the snapshots, which is
+            # what would otherwise start their refreshes
+            snapshots.keep_all_fresh()
+        return self._watermark + (snapshots.generation(),)
+
+    @staticmethod
+    def platform():
+        return engines.primary.url.database
+
+    @staticmethod
+    def wants_fresh(context):
+        """ Whether the client asked to skip the cache """
+        headers = getattr(context, 'headers', None)
+        if headers is None:
+            return False
+        return 'no-cache' in headers.get('Cache-Control', '')
+
+    @staticmethod
+    def cacheable(fields):
+        """ Whether a query selecting fields (Type.field, see CostAnalysis.fields) can be cached """
+        return UNCACHED_FIELDS.isdisjoint(fields)
+
+    def key(self, document, operation_name, variables):
+        return (
+            document.normalized_string,
+            operation_name,
+            json.dumps(variables, sort_keys=True) if variables else None,
+            self.platform(),
+        )
+
+    def get(self, key, watermark):
+        """ The cached data for key if it is as recent as watermark, or None """
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        stored_watermark, data = entry
+        if stored_watermark != watermark:
+            # Counted as a hit by the TTLCache, put it right
+            self.cache.hits -= 1
+            self.cache.misses += 1
+            return None
+        return data
+
+    def set(self, key, data, watermark):
+        self.cache.set(key, (watermark, data))
+
+    def stats(self, hit):
+        stats = self.cache.stats()
+        stats['hit'] = hit
+        return stats
+
+
+def from_environ(environ=None):
+    """ A ResponseCache if GCTOOLS_RESPONSE_CACHE is set (and not 0), else None """
+    if environ is None:
+        environ = os.environ
+    if environ.get(ENV_NAME, '0') in ('', '0'):
+        return None
+    return ResponseCache(
+        maxsize=int(environ.get(ENV_NAME + '_SIZE', MAXSIZE)),
+        ttl=float(environ.get(ENV_NAME + '_TTL', TTL)),
+    )
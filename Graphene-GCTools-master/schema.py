@@ -16,11 +16,17 @@ This project also employs the gcga.py to link up a Google Analytics API to pages
 
 import graphene
 from graphene import relay
-from graphene_sqlalchemy import SQLAlchemyObjectType, SQLAlchemyConnectionField
+from graphene_sqlalchemy import SQLAlchemyObjectType
 from sqlalchemy import *
 from models import db_session, Users as UsersModel, Entities as EntitiesModel, Relationships as RelationshipsModel, Groups as GroupsModel
 from models import ObjectsEntity as ObjectsEntityModel, Metadata as MetadataModel, Metastrings as MetastringsModel
-from gcga import gcga
+from loaders import get_loaders, load_rows, blocking, from_snapshot, BIO_SPECS
+from pagination import keyset_connection, loaded_connection, ranked_connection, PagedConnectionField
+from search_index import users_index, groups_index, matches
+from group_stats import group_stats
+from community_index import community_index
+from profile_cache import profile_cache
+from social_graph import social_graph
 import code
 
 class Page(graphene.Interface):
@@ -38,29 +44,15 @@ class Page(graphene.Interface):
 
     def resolve_pageviews(self, info, **args):
         """
-        Uses the gcga class, and calls the
-        content_views() function, which returns a list
+        Looks up the views of the page over the last 30 days
+        (see analytics_client.py), assuming that we are only
+        interested in the top page matching the guid.
+        If there are no views for that period, it is 0.
 
-        This assumes that we are only interested in the first
-        item in the list. If there are no views for that period,
-        the list will return empty
+        Every page in the response is looked up together,
+        and the counts are cached for a few minutes
         """
-        # Gets the guid from the class from which it is being called
-        guid = str(self.guid)
-
-        a = gcga()
-        # Hidden from this is the default values for start_date and end_date
-        # This section will need to be overhauled eventually, so this was for testing
-        # purposes
-        x = a.content_views(guid)['pageviews']
-
-        # If the list is empty, just make the thing.
-        # Else, return the first item (a strong assumption)
-        if not x:
-            x = 0
-        else:
-            x = x[0]
-        return x
+        return get_loaders(info.context).pageviews.load(self.guid)
 
 
 class EntityProperties(SQLAlchemyObjectType):
@@ -80,87 +72,83 @@ class ObjectsEntity(SQLAlchemyObjectType):
         interfaces = (relay.Node,)
 
 
-class Colleague(SQLAlchemyObjectType):
+class Bio(graphene.ObjectType):
     """
-    Imports the SQLAlchemy model we defined in models.py
+    One entry of a user's bio: a job they had, a school
+    they went to, or a skill. Built from loaders.BioRecord
+    """
+    spec = graphene.String()
+    guid = graphene.Int()
+    title = graphene.String()
+    description = graphene.String()
 
-    Also adds bio, which gives a little redundancy.
-    Will be cleaned later
+
+class Profile:
     """
-    class Meta:
-        model = UsersModel
-        interfaces = (relay.Node,)
-    # There are very similar properties in a user profile, that are relatively complex
-    # to query (hence why we didn't do it in models.py)
-    # Skills, Education, and Work
-    # Each of them occupies multiple fields in the Objects_Entity table
-    # Because their queries only differ  by the integer we call, they're all
-    # bunched up in the same query
-    
-    # A list that follows the ObjectsEntity model, queryable on the type of bio (spec)
+    Profile attributes shared by Users and Colleague.
+
+    Department and job come out of the cache in profile_cache.py
+    instead of two subqueries per user row
+    """
+    department = graphene.String()
+    job = graphene.String()
+    # Work, education and skills, queryable on the type of bio (spec)
     # and whether it contains a certain string inside or not
-    bio = graphene.List(ObjectsEntity, spec=graphene.String(), contains = graphene.String())
-    groups_joined = graphene.List(lambda: Group) 
+    bio = graphene.List(Bio, spec=graphene.String(), contains=graphene.String())
+
+    # Lookups in the snapshots only go to the request's runner
+    # until they are first built (see from_snapshot() in loaders.py)
+
+    def resolve_department(self, info, **args):
+        return from_snapshot(info, profile_cache, lambda: profile_cache.get(self.guid, 'department'))
 
+    def resolve_job(self, info, **args):
+        return from_snapshot(info, profile_cache, lambda: profile_cache.get(self.guid, 'job'))
 
     def resolve_bio(self, info, **args):
         """
-        Calls an ObjectsEntity object and resolves to query
-        the object
-
-        As a later update, should make it
-        its own object, to merge metadata properties 
+        Every spec of every user in the request comes out of one query
+        (see BioLoader in loaders.py). Leaving out spec gets them all
         """
-        bio_dict = {
-            "work": 48642,
-            "education": 63856,
-            "skills": 730759
-        }
-        # Calls the arguments defined in the bio variable outside the
-        # method
         bio_type = args.get("spec")
         contains = args.get("contains")
 
-        # A N 0 0 B 1 S H way of asserting the type
-        try:
-            bio_int = bio_dict[bio_type]
-        except KeyError:
+        if bio_type is not None and bio_type not in BIO_SPECS:
             raise KeyError("This isn't a proper type")
-            
-        
-        # Calls in the ObjectsEntity Query on which we will query
-        objectsdata_query = ObjectsEntity.get_query(info)
-
-        return objectsdata_query.filter(
-            ObjectsEntityModel.guid.in_(
-
-                select([MetastringsModel.string]).\
-                where(
-                    and_(
-                        MetadataModel.entity_guid == self.guid,
-                        MetadataModel.value_id == MetastringsModel.id,
-                        MetadataModel.name_id == bio_int
-                    )
-                )
-            )
-    ).filter(ObjectsEntityModel.title.contains(contains) | ObjectsEntityModel.description.contains(contains)).all()
+
+        # Only a handful of rows per user, matched here the same way as the
+        # search indexes do, rather than with two LIKE '%x%' (see search_index.py)
+        return get_loaders(info.context).bio.load(self.guid).then(lambda bio: [
+            record for record in bio
+            if (bio_type is None or record.spec == bio_type)
+            and (contains is None or matches(contains, record.title, record.description))
+        ])
+
+
+class Colleague(Profile, SQLAlchemyObjectType):
+    """
+    Imports the SQLAlchemy model we defined in models.py
+
+    Shares department, job and bio with Users (see Profile)
+    """
+    class Meta:
+        model = UsersModel
+        interfaces = (relay.Node,)
+
+    groups_joined = graphene.List(lambda: Group) 
+
 
     def resolve_groups_joined(self, info, **args):
         """
         Grabbing groups joined
-        """
 
-        return Group.get_query(info).filter(
-                    GroupsModel.guid.in_(
-                        select([RelationshipsModel.guid_two]).\
-                        where(
-                            and_(
-                            RelationshipsModel.guid_one == self.guid,
-                            RelationshipsModel.relationship == 'member',
-                        )))
-                    ).all()
+        The guids come from social_graph.py, the groups are
+        batched with every other user in the request (see loaders.py)
+        """
+        return from_snapshot(info, social_graph, lambda: social_graph.groups_joined(self.guid),
+                             lambda guids: load_rows(get_loaders(info.context).groups, guids))
 
-class Users(SQLAlchemyObjectType):
+class Users(Profile, SQLAlchemyObjectType):
     """
     Imports the user table, and other important
     features about users.
@@ -172,7 +160,8 @@ class Users(SQLAlchemyObjectType):
 
     # The parameters we will look to resolve
     colleagues = graphene.List(Colleague)
-    bio = graphene.List(ObjectsEntity, spec=graphene.String(), contains=graphene.String())
+    # Colleagues of colleagues, the most colleagues in common first
+    suggested_colleagues = graphene.List(Colleague, limit=graphene.Int(default_value=10))
     time_created = graphene.Int()
     groups_joined = graphene.List(lambda: Group) # Lambda means it can reference before assignment
 
@@ -190,86 +179,38 @@ class Users(SQLAlchemyObjectType):
 
         With the caveat that ue.* returns only what is
         defined in the Users model in models.py
-        """
-        usersdata_query = Colleague.get_query(info)
 
-        colleagues = usersdata_query.filter(UsersModel.guid.in_(
-            select([RelationshipsModel.guid_two]).\
-            where(
-                and_(
-                    RelationshipsModel.guid_one == self.guid,
-                    RelationshipsModel.relationship == 'friend'
-                )
-            )
-        )
-        ).all()
-        return colleagues
+        Who is friends with who comes out of social_graph.py, so
+        all that is left is one query for every user in the request
+        (see loaders.py)
+        """
+        return from_snapshot(info, social_graph, lambda: social_graph.colleagues(self.guid),
+                             lambda guids: load_rows(get_loaders(info.context).users, guids))
 
-    def resolve_bio(self, info, **args):
+    def resolve_suggested_colleagues(self, info, **args):
         """
-        As a later update, should make it
-        its own object, to merge metadata properties 
+        Worked out on the relationship graph in social_graph.py
         """
-        bio_dict = {
-            "work": 48642,
-            "education": 63856,
-            "skills": 730759
-        }
-        bio_type = args.get("spec")
-        contains = args.get("contains")
-
-        try:
-            bio_int = bio_dict[bio_type]
-        except KeyError:
-            raise KeyError("This isn't a proper type")
-            
-        
-
-        objectsdata_query = ObjectsEntity.get_query(info)
-
-
-        
-        return objectsdata_query.filter(
-            ObjectsEntityModel.guid.in_(
-
-                select([MetastringsModel.string]).\
-                where(
-                    and_(
-                        MetadataModel.entity_guid == self.guid,
-                        MetadataModel.value_id == MetastringsModel.id,
-                        MetadataModel.name_id == bio_int
-                    )
-                )
-            )
-    ).filter(ObjectsEntityModel.title.contains(contains) |
-            ObjectsEntityModel.description.contains(contains)
-            ).all()
-
+        return from_snapshot(info, social_graph, lambda: social_graph.suggested_colleagues(self.guid, args.get("limit")),
+                             lambda guids: load_rows(get_loaders(info.context).users, guids))
 
     def resolve_time_created(self, info, **args):
         """
         Grabbing the user registration
         """
-        return db_session.query(EntitiesModel.time_created).\
-            filter(
-                self.guid == EntitiesModel.guid
-            ).scalar()
+        return get_loaders(info.context).entity.load(self.guid).then(
+            lambda entity: entity.time_created if entity is not None else None)
 
 
     def resolve_groups_joined(self, info, **args):
         """
         Grabbing groups joined
-        """
 
-        return Group.get_query(info).filter(
-                    GroupsModel.guid.in_(
-                        select([RelationshipsModel.guid_two]).\
-                        where(
-                            and_(
-                            RelationshipsModel.guid_one == self.guid,
-                            RelationshipsModel.relationship == 'member',
-                        )))
-                    ).all()
+        The guids come from social_graph.py, the groups are
+        batched with every other user in the request (see loaders.py)
+        """
+        return from_snapshot(info, social_graph, lambda: social_graph.groups_joined(self.guid),
+                             lambda guids: load_rows(get_loaders(info.context).groups, guids))
 
 
 class Comment(SQLAlchemyObjectType):
@@ -301,13 +242,7 @@ class Comment(SQLAlchemyObjectType):
         we are getting access to all of the methods in the User
         Class 
         """
-        return Users.get_query(info).filter(
-               UsersModel.guid.in_(
-                   select([EntitiesModel.owner_guid]).\
-                   where(
-                       EntitiesModel.guid == self.guid
-                   )
-               )).first()     
+        return get_loaders(info.context).owner.load(self.guid)
 
 class Content(SQLAlchemyObjectType):
     """
@@ -340,20 +275,18 @@ class Content(SQLAlchemyObjectType):
         we are getting access to all of the methods in the User
         Class 
         """
-        return Users.get_query(info).filter(
-               self.owner_guid == UsersModel.guid
-               ).first()
+        return get_loaders(info.context).users.load(self.owner_guid)
 
 
     def resolve_title(self, info, **args):
 
-        return db_session.query(ObjectsEntityModel.title).filter(
-        self.guid == ObjectsEntityModel.guid).scalar()
+        return get_loaders(info.context).objects_entity.load(self.guid).then(
+            lambda obj: obj.title if obj is not None else None)
 
     def resolve_description(self, info, **args):
-        
-      return db_session.query(ObjectsEntityModel.description).filter(
-        self.guid == ObjectsEntityModel.guid).scalar()
+
+        return get_loaders(info.context).objects_entity.load(self.guid).then(
+            lambda obj: obj.description if obj is not None else None)
    
 
     def resolve_comments(self, info, **args):
@@ -368,20 +301,7 @@ class Content(SQLAlchemyObjectType):
         to author, and therefore the User class as well.
 
         """
-        # Calls in the comment query object
-        comment_data = Comment.get_query(info)
-
-        return comment_data.filter(
-            ObjectsEntityModel.guid.in_(
-            select([EntitiesModel.guid]).\
-            where(
-                and_(
-                    EntitiesModel.container_guid == self.guid,
-                    EntitiesModel.subtype.in_([64,66])
-                )
-            )
-        )
-    ).all()
+        return get_loaders(info.context).comments.load(self.guid)
 
     def resolve_tags(self, info, **args):
         """
@@ -394,24 +314,13 @@ class Content(SQLAlchemyObjectType):
         AND md.name_id = 119
         AND md.entity_guid = [CONTENT GUID]
         """
-
-        entity_data_model = EntityProperties.get_query(info)
-        return entity_data_model.filter(
-            MetastringsModel.id == MetadataModel.value_id,
-            MetadataModel.name_id == 119,
-            MetadataModel.entity_guid == self.guid
-            ).all()
-        
-  
-        return tags
+        return get_loaders(info.context).tags.load(self.guid)
 
     def resolve_audience(self, info, **args):
-        entity_data_model = EntityProperties.get_query(info)
-        return entity_data_model.filter(
-            MetastringsModel.id == MetadataModel.value_id,
-            MetadataModel.name_id == 35557,
-            MetadataModel.entity_guid == self.guid
-            ).all()
+        """
+        Same as tags, but for metadata name_id 35557
+        """
+        return get_loaders(info.context).audience.load(self.guid)
         
   
 
@@ -449,6 +358,13 @@ class Group(SQLAlchemyObjectType):
         interfaces = (relay.Node, Page)
     # Members are important.
     members = graphene.List(Users)
+    # The groups sharing the most members with this one
+    similar_groups = graphene.List(lambda: Group, limit=graphene.Int(default_value=10))
+    # Counts come from the precomputed store in group_stats.py
+    members_count = graphene.Int()
+    discussions_count = graphene.Int()
+    blogs_count = graphene.Int()
+    files_count = graphene.Int()
     # Content is also important.
     content = graphene.List(Content, subtype=graphene.List(graphene.Int, default_value=[1,5,7,8,18,35,1,9]))
 
@@ -466,16 +382,31 @@ class Group(SQLAlchemyObjectType):
             WHERE r_prime.guid_two = [GROUP GUID]
             AND r_prime.relationship = 'member'
         )
+
+        The inner part is answered by social_graph.py
+        """
+        return from_snapshot(info, social_graph, lambda: social_graph.members(self.guid),
+                             lambda guids: load_rows(get_loaders(info.context).users, guids))
+
+    def resolve_similar_groups(self, info, **args):
+        """
+        Ranked by shared members over all members of both groups,
+        worked out on the relationship graph in social_graph.py
         """
-        return Users.get_query(info).filter(
-                    UsersModel.guid.in_(
-                        select([RelationshipsModel.guid_one]).\
-                        where(
-                            and_(
-                            RelationshipsModel.guid_two == self.guid,
-                            RelationshipsModel.relationship == 'member',
-                        )))
-                    ).all()
+        return from_snapshot(info, social_graph, lambda: social_graph.similar_groups(self.guid, args.get("limit")),
+                             lambda guids: load_rows(get_loaders(info.context).groups, guids))
+
+    def resolve_members_count(self, info, **args):
+        return from_snapshot(info, group_stats, lambda: group_stats.get(self.guid)['members_count'])
+
+    def resolve_discussions_count(self, info, **args):
+        return from_snapshot(info, group_stats, lambda: group_stats.get(self.guid)['discussions_count'])
+
+    def resolve_blogs_count(self, info, **args):
+        return from_snapshot(info, group_stats, lambda: group_stats.get(self.guid)['blogs_count'])
+
+    def resolve_files_count(self, info, **args):
+        return from_snapshot(info, group_stats, lambda: group_stats.get(self.guid)['files_count'])
 
     def resolve_content(self, info, **args):
         """
@@ -493,19 +424,10 @@ class Group(SQLAlchemyObjectType):
             AND   e_prime.subtype IN  (SUBTYPE)
         )
         """
-        subtype = args.get("subtype")
-        
-        return Content.get_query(info).filter(
-                EntitiesModel.guid.in_(
-                select([EntitiesModel.guid]).\
-                where(
-                    and_(
-                        EntitiesModel.container_guid == self.guid,
-                        EntitiesModel.subtype.in_(subtype)
-            )
-        )
-    )
-    ).all()
+        # The subtypes are part of the loader key, so they need to be hashable
+        subtype = tuple(sorted(set(args.get("subtype"))))
+
+        return get_loaders(info.context).content.load((self.guid, subtype))
 
 
 class Community(SQLAlchemyObjectType):
@@ -514,27 +436,27 @@ class Community(SQLAlchemyObjectType):
         model = MetastringsModel
         interfaces = (relay.Node,)
 
-    groups = graphene.List(Group)
-
-
+    # Paged by guid, out of the precomputed index in community_index.py
+    groups = relay.ConnectionField(Group._meta.connection)
+    groups_count = graphene.Int()
 
     def resolve_groups(self, info, **args):
+        """
+        The guids come from community_index.py and are paged right here,
+        then the groups on the page are batched with every other community
+        in the request (see loaders.py)
 
-        return Group.get_query(info).filter(
-            GroupsModel.guid.in_(
-                select([GroupsModel.guid]).\
-                    where(
-                        and_(
-                            EntitiesModel.container_guid == GroupsModel.guid,
-                            MetadataModel.entity_guid == EntitiesModel.guid,
-                            MetadataModel.name_id == 35557,
-                            MetadataModel.value_id == self.id
-
-                        )
-                    )
+        SELECT g.*
+        FROM elgggroups_entity g
+        WHERE g.guid IN ([GUIDS ON THE PAGE OF EVERY COMMUNITY])
+        """
+        groups = get_loaders(info.context).groups
+        return from_snapshot(info, community_index, lambda: community_index.groups(self.id),
+                             lambda guids: loaded_connection(Group._meta.connection, guids, args,
+                                                             lambda page: load_rows(groups, page)))
 
-            )
-        )
+    def resolve_groups_count(self, info, **args):
+        return from_snapshot(info, community_index, lambda: community_index.count(self.id))
 
 
 
@@ -547,28 +469,35 @@ class Query(graphene.ObjectType):
     """
     nodes = relay.Node.Field()
 
-    # Gathers all the users. Don't recommend
-    all_users = SQLAlchemyConnectionField(Users)
-    # Gathers all the entities. Do not do. This returns millions of things
-    all_entities = SQLAlchemyConnectionField(Entities)
-    user = graphene.List(Users, name=graphene.String())
+    # Gathers all the users, a page (first or last, at most 100) at a time
+    all_users = PagedConnectionField(Users)
+    # Gathers all the entities. There are millions, so it has to be paged too
+    all_entities = PagedConnectionField(Entities)
+    # The plural fields are paged by guid, see pagination.py
+    user = relay.ConnectionField(Users._meta.connection, name=graphene.String())
     group = graphene.Field(Group, guid=graphene.Int(), name=graphene.String())
     content = graphene.Field(Content, guid=graphene.Int())
     # Plural groups
-    groups = graphene.List(Group, name=graphene.String())
+    groups = relay.ConnectionField(Group._meta.connection, name=graphene.String())
     community = graphene.Field(Community, name=graphene.String())
-    communities = graphene.List(Community)
+    communities = relay.ConnectionField(Community._meta.connection)
 
+    # The resolvers below query MySQL themselves, hence @blocking (see loaders.py)
 
+    @blocking
     def resolve_user(self, info, **args):
         name = args.get("name")
 
         userdata_query = Users.get_query(info)
 
-        users = userdata_query.filter(UsersModel.name.contains(name)).all()
+        if name is None:
+            return keyset_connection(Users._meta.connection, userdata_query, UsersModel.guid, args)
 
-        return users
+        # The search index finds the guids, best match first, so MySQL only loads the ones on this page
+        guids = users_index.search(name)
+        return ranked_connection(Users._meta.connection, userdata_query, UsersModel.guid, args, guids)
 
+    @blocking
     def resolve_group(self, info, **args):
 
         guid = args.get("guid")
@@ -576,14 +505,16 @@ class Query(graphene.ObjectType):
 
         groupdata_query = Group.get_query(info)
 
-        if guid is not None:
-            groups = groupdata_query.filter(GroupsModel.guid == guid).first()
-
         if name is not None:
-            groups = groupdata_query.filter(GroupsModel.name.contains(name)).first()
+            # Best match from the search index (see search_index.py), it wins over guid like it always has
+            guid = next(iter(groups_index.search(name, limit=1)), None)
+
+        if guid is None:
+            return None
 
-        return groups
+        return groupdata_query.filter(GroupsModel.guid == guid).first()
 
+    @blocking
     def resolve_content(self, info, **args):
 
         guid = args.get("guid")
@@ -593,18 +524,21 @@ class Query(graphene.ObjectType):
             ).first()
 
 
+    @blocking
     def resolve_groups(self, info, **args):
 
-        guid = args.get("guid")
         name = args.get("name")
 
         groupdata_query = Group.get_query(info)
 
-        if name is not None:
-            groups = groupdata_query.filter(GroupsModel.name.contains(name)).all()
+        if name is None:
+            return keyset_connection(Group._meta.connection, groupdata_query, GroupsModel.guid, args)
 
-        return groups
+        # Best match first, like Query.user
+        guids = groups_index.search(name)
+        return ranked_connection(Group._meta.connection, groupdata_query, GroupsModel.guid, args, guids)
 
+    @blocking
     def resolve_community(self, info, **args):
         name = args.get("name")
 
@@ -615,13 +549,27 @@ class Query(graphene.ObjectType):
             MetadataModel.name_id == 35557
         ).first()
 
+    @blocking
     def resolve_communities(self, info, **args):
+        """
+        Every metastring used as an audience (name_id 35557).
+        A semi-join rather than a DISTINCT over metastrings x metadata.
+        groupsCount comes from community_index.py, so a page with
+        its counts is still just this one query
 
-        communitydata_query = Community.get_query(info)
-        return communitydata_query.filter(
-            MetadataModel.value_id == MetastringsModel.id,
-            MetadataModel.name_id == 35557
-        ).distinct()
+        SELECT ms.*
+        FROM elggmetastrings ms
+        WHERE ms.id IN (SELECT md.value_id FROM elggmetadata md WHERE md.name_id = 35557)
+        AND   ms.id > [AFTER]
+        ORDER BY ms.id
+        LIMIT [FIRST + 1]
+        """
+        communitydata_query = Community.get_query(info).filter(
+            MetastringsModel.id.in_(
+                select([MetadataModel.value_id]).where(MetadataModel.name_id == 35557)
+            )
+        )
+        return keyset_connection(Community._meta.connection, communitydata_query, MetastringsModel.id, args)
 
 
 
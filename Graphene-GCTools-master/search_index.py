@@ -0,0 +1,209 @@
+"""
+In-process full-text indexes for name/title/description lookups.
+
+Query.user, Query.group(s) and the bio resolvers used to filter with
+name.contains(...), which is LIKE '%x%', so MySQL scanned all of
+elggusers_entity / elgggroups_entity for every search. Here each table is
+loaded once into an inverted index (token -> {guid: weight}) and kept fresh
+from elggentities.time_updated like the other snapshots (see snapshots.py).
+The resolvers ask the index for guids, and only load those rows.
+
+The bio resolvers only ever look at the few bio entries of one user, so
+rather than index all of elggobjects_entity they use matches() on the rows
+once they're loaded.
+
+Text is lowercased, stripped of accents and HTML, and split on anything that
+isn't a letter or a digit. Every word of a search has to match a word of the
+row, either exactly or as the start of it ("jo smi" finds "John Smith").
+Exact matches, rare words and matches in the heavier fields (the name rather
+than the description) rank first.
+
+Nothing to install or run on the side: it's all dicts and sorted lists.
+"""
+
+
+import bisect
+from collections import defaultdict
+import html
+import math
+import re
+import threading
+import unicodedata
+
+from models import db_session, Entities, Users, Groups
+from snapshots import Snapshot
+
+
+# How much a word that only starts with the search word counts, next to an exact match
+PREFIX_WEIGHT = 0.5
+# Most words a single search word can expand to, so "a" doesn't walk the whole vocabulary
+MAX_PREFIX_EXPANSIONS = 200
+
+_TAGS = re.compile(r'<[^>]*>')
+_WORDS = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """ The words in text, the same way for rows and for searches """
+    if not text:
+        return []
+    text = html.unescape(_TAGS.sub(' ', text))
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _WORDS.findall(text)
+
+
+def matches(text, *values):
+    """
+    Whether values match every word of text, same rules as an index search.
+    For rows that are already loaded, where an index would be overkill
+    """
+    tokens = set()
+    for value in values:
+        tokens.update(tokenize(value))
+    return all(any(token.startswith(word) for token in tokens) for word in tokenize(text))
+
+
+class InvertedIndex:
+    """
+    The index itself. A rebuild fills a new one and swaps it in,
+    updates change it in place under its lock.
+    """
+    def __init__(self):
+        # token -> {guid: weight}
+        self.postings = defaultdict(dict)
+        # guid -> the tokens it was indexed under, to take them back out
+        self.documents = {}
+        # Every token, sorted, for prefix lookups
+        self.vocabulary = []
+        self._lock = threading.Lock()
+
+    def _add(self, guid, weights):
+        self.documents[guid] = tuple(weights)
+        for token, weight in weights.items():
+            self.postings[token][guid] = weight
+
+    def _remove(self, guid):
+        for token in self.documents.pop(guid, ()):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(guid, None)
+                if not posting:
+                    del self.postings[token]
+                    i = bisect.bisect_left(self.vocabulary, token)
+                    if i < len(self.vocabulary) and self.vocabulary[i] == token:
+                        del self.vocabulary[i]
+
+    def load(self, rows):
+        """ Fills an empty index from (guid, {token: weight}) pairs """
+        for guid, weights in rows:
+            self._add(guid, weights)
+        self.vocabulary = sorted(self.postings)
+
+    def set(self, guid, weights):
+        """ Replaces whatever was indexed for guid """
+        with self._lock:
+            self._remove(guid)
+            if not weights:
+                return
+            for token in weights:
+                if token not in self.postings:
+                    bisect.insort(self.vocabulary, token)
+            self._add(guid, weights)
+
+    def _expand(self, word):
+        """ (token, match weight) for every token word matches """
+        matches = []
+        if word in self.postings:
+            matches.append((word, 1.0))
+        i = bisect.bisect_right(self.vocabulary, word)
+        while i < len(self.vocabulary) and len(matches) < MAX_PREFIX_EXPANSIONS:
+            token = self.vocabulary[i]
+            if not token.startswith(word):
+                break
+            matches.append((token, PREFIX_WEIGHT))
+            i += 1
+        return matches
+
+    def search(self, text):
+        """ {guid: score} for every row matching all the words of text """
+        words = tokenize(text)
+        if not words:
+            return {}
+
+        with self._lock:
+            total = len(self.documents)
+            scores = None
+            for word in set(words):
+                word_scores = {}
+                for token, match in self._expand(word):
+                    posting = self.postings[token]
+                    # BM25's idf: rare words are worth more
+                    idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                    for guid, weight in posting.items():
+                        score = match * idf * weight
+                        if score > word_scores.get(guid, 0):
+                            word_scores[guid] = score
+
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {guid: score + word_scores[guid] for guid, score in scores.items() if guid in word_scores}
+                if not scores:
+                    return {}
+            return scores
+
+
+class SearchIndex(Snapshot):
+    """
+    model:  the SQLAlchemy model to index, keyed on guid
+    fields: column name -> weight of a word found in it
+    """
+    def __init__(self, model, fields, *args, **kwargs):
+        super(SearchIndex, self).__init__(*args, **kwargs)
+        self.model = model
+        self.fields = fields
+        self._index = InvertedIndex()
+
+    def _weights(self, row):
+        weights = {}
+        for field, value in zip(self.fields, row[1:]):
+            field_weight = self.fields[field]
+            for token in tokenize(value):
+                weights[token] = weights.get(token, 0) + field_weight
+        return weights
+
+    def _query(self):
+        columns = [getattr(self.model, field) for field in self.fields]
+        return db_session.query(self.model.guid, *columns)
+
+    def build(self, upper):
+        index = InvertedIndex()
+        index.load((row[0], self._weights(row)) for row in self._query().yield_per(10000))
+        self._index = index
+
+    def update(self, lower, upper):
+        """
+        SELECT t.guid, t.[FIELDS]
+        FROM [TABLE] t
+        JOIN elggentities e ON e.guid = t.guid
+        WHERE e.time_updated > [LOWER]
+        """
+        changed = False
+        for row in self._query().join(Entities, Entities.guid == self.model.guid).\
+                filter(Entities.time_updated > lower):
+            self._index.set(row[0], self._weights(row))
+            changed = True
+        return changed
+
+    def search(self, text, limit=None):
+        """ The guids matching text, best first """
+        self.keep_fresh()
+        scores = self._index.search(text)
+        ranked = sorted(scores, key=lambda guid: (-scores[guid], guid))
+        return ranked[:limit] if limit is not None else ranked
+
+
+# One index per table for the whole process
+users_index = SearchIndex(Users, {'name': 2, 'username': 1})
+groups_index = SearchIndex(Groups, {'name': 2, 'description': 1})
@@ -0,0 +1,160 @@
+"""
+In-process snapshots of things that are too expensive to work out on every
+request, but cheap to keep up to date.
+
+A snapshot does one full build the first time it is used, then only looks at
+rows that changed since its watermark (a unix timestamp, like every time_*
+column in elgg). Elgg hard-deletes rows, which a watermark can never see,
+so every so often the whole thing is thrown away and built again.
+
+Subclasses implement build() and update(); readers just call keep_fresh()
+before looking at the data. Only the very first build makes a reader wait,
+after that a refresh that is due runs in a thread of its own, so a request
+(or async_app.py's event loop) never waits on MySQL for it.
+
+Every snapshot counts its generation up when its data changes, and
+generation() adds them all up. That is how the response cache (see
+response_cache.py) knows an answer was put together from older snapshots.
+"""
+
+
+import contextvars
+import logging
+import threading
+import time
+import weakref
+
+from models import db_session
+
+
+logger = logging.getLogger(__name__)
+
+# Every snapshot made, for generation() and keep_all_fresh()
+_snapshots = weakref.WeakSet()
+
+
+def generation():
+    """ Goes up whenever the data of any of the snapshots changes """
+    return sum(snapshot.generation for snapshot in list(_snapshots))
+
+
+def keep_all_fresh():
+    """ keep_fresh() on every snapshot that is built, for callers that don't read them """
+    for snapshot in list(_snapshots):
+        if snapshot.built:
+            snapshot.keep_fresh()
+
+
+class Snapshot:
+    """
+    Base class for the snapshots.
+
+    refresh_interval: seconds to wait between incremental updates
+    rebuild_interval: seconds to wait between full rebuilds
+    lag:              seconds to stay behind the clock, so rows being written
+                      during the current second are picked up next time
+    """
+    refresh_interval = 60
+    rebuild_interval = 6 * 60 * 60
+    lag = 5
+
+    def __init__(self, refresh_interval=None, rebuild_interval=None):
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+        if rebuild_interval is not None:
+            self.rebuild_interval = rebuild_interval
+
+        self.watermark = None
+        self.last_refresh = 0
+        self.last_rebuild = 0
+        # One more every time build() or update() changed the data
+        self.generation = 0
+        self._lock = threading.Lock()
+        # The thread refreshing in the background, if there is one
+        self._refresher = None
+        self._refresher_lock = threading.Lock()
+        _snapshots.add(self)
+
+    @property
+    def built(self):
+        """ Whether the first build is done, after which reading never waits on MySQL """
+        return self.watermark is not None
+
+    def build(self, upper):
+        """ Load everything from scratch """
+        raise NotImplementedError
+
+    def update(self, lower, upper):
+        """ Apply whatever changed in the (lower, upper] window, returns whether anything did """
+        raise NotImplementedError
+
+    def refresh(self, rebuild=False):
+        """
+        Bring the snapshot up to date if it is due.
+
+        Only the very first build makes callers wait. After that, if some
+        other thread is already refreshing, we just carry on with the data
+        we have rather than queue up behind it.
+        """
+        now = time.time()
+        if not rebuild and self.watermark is not None and now - self.last_refresh < self.refresh_interval:
+            return
+
+        if not self._lock.acquire(blocking=self.watermark is None):
+            return
+        try:
+            # Someone may have built it while we were waiting on the lock
+            if not rebuild and self.watermark is not None and now - self.last_refresh < self.refresh_interval:
+                return
+
+            upper = int(now) - self.lag
+            if rebuild or self.watermark is None or now - self.last_rebuild >= self.rebuild_interval:
+                self.build(upper)
+                self.last_rebuild = now
+                self.generation += 1
+            elif upper > self.watermark and self.update(self.watermark, upper):
+                self.generation += 1
+
+            self.watermark = max(upper, self.watermark or 0)
+            self.last_refresh = now
+        finally:
+            self._lock.release()
+
+    def keep_fresh(self):
+        """
+        What readers call. Builds the snapshot right away the first time
+        (there is nothing to read before that), and after that starts a
+        refresh in the background when one is due
+        """
+        if self.watermark is None:
+            self.refresh()
+            return
+        if time.time() - self.last_refresh < self.refresh_interval:
+            return
+
+        with self._refresher_lock:
+            if self._refresher is not None:
+                return
+            # A context of its own: the statements aren't the request's (see
+            # tracing.py), and the thread gets its own session (see models.py)
+            self._refresher = threading.Thread(target=contextvars.Context().run, args=(self._refresh_in_background,),
+                                               name='refresh-' + type(self).__name__, daemon=True)
+            self._refresher.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Refreshing %s failed', type(self).__name__)
+            # Try again after the interval rather than on the next read
+            self.last_refresh = time.time()
+        finally:
+            db_session.remove()
+            with self._refresher_lock:
+                self._refresher = None
+
+    def wait(self):
+        """ Blocks until the background refresh (if any) is done """
+        refresher = self._refresher
+        if refresher is not None:
+            refresher.join()
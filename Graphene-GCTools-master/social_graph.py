@@ -0,0 +1,308 @@
+"""
+Snapshot of the friend and member relationships, kept in memory.
+
+Colleagues, groupsJoined and Group.members went back to
+elggentity_relationships for every request. The relationships are
+loaded here once instead, into compressed sparse row (CSR) arrays:
+
+    keys    sorted guids that have at least one edge
+    offsets where each key's neighbours start in indices (one more than keys)
+    indices every neighbour guid, key by key, each run sorted
+
+so the neighbours of a guid are a binary search and a slice. Everything is
+int32, which is 8 bytes an edge in total instead of a few hundred for the
+same thing in Python lists and ints.
+
+New relationships come in through Relationships.time_created (see
+snapshots.py). They go in a small overlay that is merged into the arrays
+once it gets big. A relationship that is removed (leaving a group,
+unfriending) leaves no trace a watermark can find, so this snapshot is
+rebuilt every hour rather than every six.
+
+The resolvers get guids from here and then load the rows through the
+UsersLoader/GroupsLoader in loaders.py, which are plain primary key lookups.
+
+numpy is imported by the first build rather than with this module: it takes
+longer to import than the rest of app.py put together, and a worker that
+never gets asked for a colleague or a member shouldn't pay for it.
+"""
+
+
+from array import array
+import logging
+
+from models import db_session, Relationships
+from snapshots import Snapshot
+
+
+logger = logging.getLogger(__name__)
+
+# How many new edges to keep in the overlay before merging them into the arrays
+MAX_PENDING = 50000
+
+# How many results similar_groups/suggested_colleagues hand back, by default and at most
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# Past this many members (or friends), a random sample of them is used
+# to find similar groups (or suggestions), so big groups take bounded time
+MAX_SAMPLE = 5000
+
+# Set by _import_numpy(), before the first build
+np = None
+_EMPTY = None
+
+
+def _import_numpy():
+    global np, _EMPTY
+    if np is None:
+        import numpy
+        _EMPTY = numpy.zeros(0, dtype=numpy.int32)
+        np = numpy
+
+
+class Adjacency:
+    """
+    One direction of one relationship, in CSR form.
+
+    The arrays are never changed once built. Updates make a new overlay
+    dict and swap it in, so readers don't need a lock.
+    """
+    def __init__(self, sources, targets):
+        order = np.lexsort((targets, sources))
+        sources = sources[order]
+        targets = targets[order]
+        if len(sources):
+            # The same relationship can be in the table twice
+            keep = np.ones(len(sources), dtype=bool)
+            keep[1:] = (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])
+            sources = sources[keep]
+            targets = targets[keep]
+
+        self.keys, starts = np.unique(sources, return_index=True)
+        self.keys = self.keys.astype(np.int32)
+        self.offsets = np.append(starts, len(sources)).astype(np.int32)
+        self.indices = targets.astype(np.int32)
+        # guid -> sorted array of neighbours not in the arrays yet
+        self.pending = {}
+        self.pending_count = 0
+
+    def _base(self, guid):
+        i = np.searchsorted(self.keys, guid)
+        if i < len(self.keys) and self.keys[i] == guid:
+            return self.indices[self.offsets[i]:self.offsets[i + 1]]
+        return _EMPTY
+
+    def neighbours(self, guid):
+        """ Sorted array of the guids guid points to """
+        base = self._base(guid)
+        extra = self.pending.get(guid)
+        if extra is None:
+            return base
+        return np.union1d(base, extra)
+
+    def gather(self, guids):
+        """ The neighbours of all of guids, one after the other, repeats and all """
+        i = np.searchsorted(self.keys, guids)
+        found = i < len(self.keys)
+        found[found] = self.keys[i[found]] == guids[found]
+        i = i[found]
+
+        starts = self.offsets[i].astype(np.int64)
+        lengths = self.offsets[i + 1] - starts
+        # Start of each slice, repeated along it, plus the position within the slice
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        parts = [self.indices[positions]]
+
+        if self.pending:
+            for guid in set(guids.tolist()) & set(self.pending):
+                parts.append(self.pending[guid])
+        return np.concatenate(parts)
+
+    def degrees(self, guids):
+        """ How many neighbours each of guids has """
+        i = np.searchsorted(self.keys, guids)
+        found = i < len(self.keys)
+        found[found] = self.keys[i[found]] == guids[found]
+        degrees = np.zeros(len(guids), dtype=np.int64)
+        degrees[found] = self.offsets[i[found] + 1] - self.offsets[i[found]]
+        if self.pending:
+            for n, guid in enumerate(guids.tolist()):
+                extra = self.pending.get(guid)
+                if extra is not None:
+                    degrees[n] += len(extra)
+        return degrees
+
+    def edges(self, pending=None):
+        """ (sources, targets) of every edge, overlay included """
+        sources = [np.repeat(self.keys, np.diff(self.offsets))]
+        targets = [self.indices]
+        for guid, extra in (self.pending if pending is None else pending).items():
+            sources.append(np.full(len(extra), guid, dtype=np.int32))
+            targets.append(extra)
+        return np.concatenate(sources), np.concatenate(targets)
+
+    def add(self, sources, targets):
+        """
+        Adds edges to the overlay. Returns the Adjacency to use from now on,
+        which is a new one when the overlay got merged in.
+        """
+        pending = dict(self.pending)
+        count = self.pending_count
+        order = np.argsort(sources, kind='stable')
+        guids, starts = np.unique(sources[order], return_index=True)
+        for guid, new in zip(guids.tolist(), np.split(targets[order], starts[1:])):
+            old = pending.get(guid, _EMPTY)
+            merged = np.setdiff1d(np.union1d(old, new), self._base(guid)).astype(np.int32)
+            count += len(merged) - len(old)
+            pending[guid] = merged
+
+        if count > MAX_PENDING:
+            return Adjacency(*self.edges(pending))
+
+        self.pending = pending
+        self.pending_count = count
+        return self
+
+    def nbytes(self):
+        return self.keys.nbytes + self.offsets.nbytes + self.indices.nbytes + \
+            sum(extra.nbytes for extra in self.pending.values())
+
+
+def _sample(guids, seed):
+    """ At most MAX_SAMPLE of guids, the same ones every time for the same seed """
+    if len(guids) <= MAX_SAMPLE:
+        return guids
+    return np.sort(np.random.RandomState(seed).choice(guids, MAX_SAMPLE, replace=False))
+
+
+def _top(candidates, scores, limit):
+    """ The limit candidates with the best scores, best first (ties go to the lowest guid) """
+    if limit is None:
+        limit = DEFAULT_LIMIT
+    limit = max(0, min(limit, MAX_LIMIT, len(candidates)))
+    if limit == 0:
+        return []
+    if limit < len(candidates):
+        # Everything tied with the limit-th best stays in, or which of them
+        # make the cut would be up to argpartition rather than the guid
+        worst = -np.partition(-scores, limit - 1)[limit - 1]
+        best = scores >= worst
+        candidates, scores = candidates[best], scores[best]
+    order = np.lexsort((candidates, -scores))
+    return candidates[order][:limit].tolist()
+
+
+def _load(relationship, lower=None):
+    """
+    SELECT r.guid_one, r.guid_two
+    FROM elggentity_relationships r
+    WHERE r.relationship = [RELATIONSHIP]
+    AND   r.time_created > [LOWER]
+    """
+    query = db_session.query(Relationships.guid_one, Relationships.guid_two).\
+        filter(Relationships.relationship == relationship)
+    if lower is not None:
+        query = query.filter(Relationships.time_created > lower)
+
+    ones = array('l')
+    twos = array('l')
+    for guid_one, guid_two in query.yield_per(50000):
+        ones.append(guid_one)
+        twos.append(guid_two)
+    return np.array(ones, dtype=np.int32), np.array(twos, dtype=np.int32)
+
+
+class SocialGraph(Snapshot):
+    """
+    colleagues(user guid)    -> user guids they are friends with
+    groups_joined(user guid) -> group guids they are a member of
+    members(group guid)      -> user guids that are members
+    """
+    rebuild_interval = 60 * 60
+
+    def __init__(self, *args, **kwargs):
+        super(SocialGraph, self).__init__(*args, **kwargs)
+        # Made by the first build, which every reader waits for
+        self._friends = self._member_of = self._members = None
+
+    def build(self, upper):
+        _import_numpy()
+        users, friends = _load('friend')
+        friends = Adjacency(users, friends)
+        users, groups = _load('member')
+        member_of = Adjacency(users, groups)
+        members = Adjacency(groups, users)
+
+        self._friends, self._member_of, self._members = friends, member_of, members
+        logger.info('Social graph built: %s', self.memory_usage())
+
+    def update(self, lower, upper):
+        users, friends = _load('friend', lower)
+        if len(users):
+            self._friends = self._friends.add(users, friends)
+        members, groups = _load('member', lower)
+        if len(members):
+            self._member_of = self._member_of.add(members, groups)
+            self._members = self._members.add(groups, members)
+        return bool(len(users) or len(members))
+
+    def memory_usage(self):
+        """ Bytes held by each part of the snapshot, for sizing hosts """
+        usage = {
+            'friends': self._friends.nbytes(),
+            'member_of': self._member_of.nbytes(),
+            'members': self._members.nbytes(),
+        }
+        usage['total'] = sum(usage.values())
+        return usage
+
+    def colleagues(self, guid):
+        self.keep_fresh()
+        return self._friends.neighbours(guid).tolist()
+
+    def groups_joined(self, guid):
+        self.keep_fresh()
+        return self._member_of.neighbours(guid).tolist()
+
+    def members(self, guid):
+        self.keep_fresh()
+        return self._members.neighbours(guid).tolist()
+
+    def similar_groups(self, guid, limit=DEFAULT_LIMIT):
+        """
+        The groups sharing the most members with guid, relative to their size
+        (Jaccard: shared members / members of either group)
+
+        Every group joined by every member is counted with one np.unique,
+        instead of asking for members { groupsJoined } and counting client side
+        """
+        self.keep_fresh()
+        members_graph, member_of = self._members, self._member_of
+        members = members_graph.neighbours(guid)
+        sample = _sample(members, guid)
+
+        candidates, shared = np.unique(member_of.gather(sample), return_counts=True)
+        keep = candidates != guid
+        candidates, shared = candidates[keep], shared[keep].astype(np.float64)
+        # Scale the counts back up when only a sample of the members was used
+        if len(sample):
+            shared *= len(members) / len(sample)
+
+        union = len(members) + members_graph.degrees(candidates) - shared
+        scores = shared / np.maximum(union, 1)
+        return _top(candidates, scores, limit)
+
+    def suggested_colleagues(self, guid, limit=DEFAULT_LIMIT):
+        """
+        Colleagues of colleagues that aren't colleagues yet,
+        the ones with the most colleagues in common first
+        """
+        self.keep_fresh()
+        friends = self._friends.neighbours(guid)
+        candidates, mutual = np.unique(self._friends.gather(_sample(friends, guid)), return_counts=True)
+        keep = (candidates != guid) & ~np.isin(candidates, friends)
+        return _top(candidates[keep], mutual[keep], limit)
+
+
+# One graph for the whole process
+social_graph = SocialGraph()
@@ -0,0 +1,221 @@
+"""
+Shared fixtures for the tests.
+
+Nothing here talks to MySQL or Google:
+
+- the db fixture makes a SQLite file with a few users, groups, content and
+  metadata in it (see populate()), and starts every snapshot over on it
+- the analytics fixture points analytics_client at ReportingService, a
+  stand-in for the Reporting API answering from rows it is given
+
+    pip install pytest
+    python -m pytest tests
+"""
+
+
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+_DB_DIR = tempfile.mkdtemp(prefix='gctools-tests-')
+DB_PATH = os.path.join(_DB_DIR, 'elgg.sqlite')
+
+# Before models.py is imported: nothing asks for credentials, and every
+# setting is the default (see database.py)
+for _name in list(os.environ):
+    if _name.startswith('GCTOOLS_'):
+        del os.environ[_name]
+# The loaders run in threads under async_app.py and the snapshots refresh in one
+os.environ['GCTOOLS_DB_URL'] = 'sqlite:///{}?check_same_thread=false'.format(DB_PATH)
+
+
+import analytics_client
+from community_index import community_index
+from group_stats import group_stats
+import models
+from models import db_session
+from profile_cache import profile_cache
+from search_index import users_index, groups_index
+from social_graph import social_graph
+
+
+SNAPSHOTS = (group_stats, community_index, profile_cache, users_index, groups_index, social_graph)
+
+# Metadata names (see schema.py, profile_cache.py and community_index.py)
+DEPARTMENT = 8667
+JOB = 1535
+TAGS = 119
+AUDIENCE = 35557
+WORK = 48642
+EDUCATION = 63856
+
+# Entity subtypes
+FILE = 1
+BLOG = 5
+DISCUSSION = 7
+COMMENT = 64
+BIO_ENTRY = 99
+
+
+def populate(session):
+    """
+    users 1-5, groups 100 (members 1, 2, 3) and 101 (members 3, 4),
+    friends 1 -> 2, 1 -> 3, 2 -> 1 and 3 -> 4, content 200-203 in the
+    groups, a comment on 200, and departments, jobs and bios for 1 and 2
+    """
+    E, U, G, O = models.Entities, models.Users, models.Groups, models.ObjectsEntity
+    R, MD, MS = models.Relationships, models.Metadata, models.Metastrings
+
+    for guid in range(1, 6):
+        session.add(U(guid=guid, name='User {}'.format(guid), username='user{}'.format(guid),
+                      last_action=100 + guid))
+        session.add(E(guid=guid, type='user', subtype=0, owner_guid=guid, container_guid=guid,
+                      time_created=100 + guid, time_updated=100 + guid))
+
+    for guid, name, description in [(100, 'Data Science', 'Machine learning and statistics'),
+                                    (101, 'Finance Network', 'Budgets and science funding')]:
+        session.add(G(guid=guid, name=name, description=description))
+        session.add(E(guid=guid, type='group', subtype=0, owner_guid=1, container_guid=1,
+                      time_created=50, time_updated=50))
+
+    relationships = [(user, group, 'member') for user, group in [(1, 100), (2, 100), (3, 100), (3, 101), (4, 101)]]
+    relationships += [(one, two, 'friend') for one, two in [(1, 2), (1, 3), (2, 1), (3, 4)]]
+    for id, (one, two, relationship) in enumerate(relationships, 1):
+        session.add(R(id=id, guid_one=one, guid_two=two, relationship=relationship, time_created=10))
+
+    for guid, group, subtype, owner in [(200, 100, BLOG, 1), (201, 100, DISCUSSION, 2),
+                                        (202, 101, FILE, 3), (203, 100, FILE, 1)]:
+        session.add(E(guid=guid, type='object', subtype=subtype, owner_guid=owner, container_guid=group,
+                      time_created=60, time_updated=60))
+        session.add(O(guid=guid, title='Title {}'.format(guid), description='Description {}'.format(guid)))
+    session.add(E(guid=300, type='object', subtype=COMMENT, owner_guid=4, container_guid=200,
+                  time_created=70, time_updated=70))
+    session.add(O(guid=300, title='', description='Nice post'))
+
+    for guid, title, description in [(500, 'Analyst at X', 'Worked'), (501, 'University', 'Studied'),
+                                     (502, 'Analyst at Y', 'Worked more')]:
+        session.add(E(guid=guid, type='object', subtype=BIO_ENTRY, owner_guid=1, container_guid=1,
+                      time_created=90, time_updated=90))
+        session.add(O(guid=guid, title=title, description=description))
+
+    strings = {1: 'Finance', 2: 'Analyst', 3: 'statistics', 4: 'Science', 5: '500', 6: '501', 7: '502'}
+    for id, string in strings.items():
+        session.add(MS(id=id, string=string))
+
+    metadata = [(1, DEPARTMENT, 1), (1, JOB, 2), (2, DEPARTMENT, 1), (200, TAGS, 3), (200, AUDIENCE, 4),
+                (202, AUDIENCE, 4), (1, WORK, 5), (1, EDUCATION, 6), (2, WORK, 7)]
+    for id, (guid, name_id, value_id) in enumerate(metadata, 1):
+        session.add(MD(id=id, entity_guid=guid, name_id=name_id, value_id=value_id, owner_guid=1,
+                       access_id=2, time_created=80))
+
+    session.commit()
+
+
+@pytest.fixture
+def db():
+    """ The session, on a database populated from scratch, with every snapshot to be built again """
+    engine = models.engines.primary
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    populate(db_session)
+    for snapshot in SNAPSHOTS:
+        snapshot.watermark = None
+        snapshot.last_refresh = snapshot.last_rebuild = 0
+    yield db_session
+    db_session.remove()
+
+
+@pytest.fixture
+def statements(db):
+    """ Every statement run on the database from here on """
+    ran = []
+    def record(conn, cursor, statement, *args):
+        ran.append(statement)
+    engine = models.engines.primary
+    event.listen(engine, 'before_cursor_execute', record)
+    yield ran
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def on(table, statements):
+    """ The statements that read from table """
+    return [statement for statement in statements if 'FROM ' + table in statement]
+
+
+class ReportingService:
+    """
+    Stand-in for the Reporting API service (reports().batchGet(body=...).execute())
+
+    rows:      (pagePath, pageTitle, pageviews) for the whole site. A report
+               gets the ones matching any of its filter expressions, most
+               viewed first
+    page_size: rows per page of a report, the rest behind nextPageToken
+    """
+    def __init__(self, rows, page_size=None):
+        self.rows = rows
+        self.page_size = page_size
+        # The body of every batchGet
+        self.calls = []
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body):
+        self.calls.append(body)
+        return _Response(self, body)
+
+    def report(self, request):
+        expressions = [f['expressions'][0] for clause in request.get('dimensionFilterClauses', [])
+                       for f in clause['filters']]
+        rows = [row for row in self.rows if any(re.search(expression, row[0]) for expression in expressions)]
+        rows.sort(key=lambda row: -row[2])
+
+        start = int(request.get('pageToken', 0))
+        end = len(rows) if self.page_size is None else start + self.page_size
+        report = {'data': {'rows': [{'dimensions': [path, title], 'metrics': [{'values': [str(views)]}]}
+                                    for path, title, views in rows[start:end]]}}
+        if end < len(rows):
+            report['nextPageToken'] = str(end)
+        return report
+
+
+class _Response:
+    def __init__(self, service, body):
+        self.service = service
+        self.body = body
+
+    def execute(self):
+        return {'reports': [self.service.report(request) for request in self.body['reportRequests']]}
+
+
+PAGEVIEWS = [
+    ('/groups/profile/100/data-science', 'Data Science', 120),
+    ('/groups/profile/100/data-science?tab=members', 'Data Science', 30),
+    ('/groups/profile/101/finance-network', 'Finance Network', 45),
+    ('/blog/view/200/title', 'Title 200', 12),
+    ('/blog/view/5200/other', 'Other', 999),
+]
+
+
+@pytest.fixture
+def analytics():
+    """ analytics_client answering from PAGEVIEWS through a ReportingService """
+    service = ReportingService(PAGEVIEWS)
+    analytics_client.use_service(service)
+    yield service
+    analytics_client.use_service(None)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if models.engines.loaded:
+        models.engines.primary.dispose()
+    shutil.rmtree(_DB_DIR, ignore_errors=True)
@@ -0,0 +1,58 @@
+import analytics_client
+from loaders import get_loaders
+from schema import schema
+
+
+def test_fetch_pageviews_takes_the_top_row_of_each_guid(analytics):
+    assert analytics_client.fetch_pageviews([100, 101, 200, 404]) == [120, 45, 12, 0]
+
+
+def test_fetch_pageviews_doesnt_match_longer_guids(analytics):
+    # /blog/view/5200/ has the most views of all, but isn't 200
+    assert analytics_client.fetch_pageviews([200]) == [12]
+
+
+def test_fetch_pageviews_packs_guids_into_one_call(analytics):
+    analytics_client.fetch_pageviews(list(range(100, 140)))
+    assert len(analytics.calls) == 1
+
+
+def test_fetch_pageviews_is_cached(analytics):
+    analytics_client.fetch_pageviews([100, 101])
+    assert analytics_client.fetch_pageviews([101, 100]) == [45, 120]
+    assert len(analytics.calls) == 1
+
+    # Only what isn't cached yet is asked for
+    analytics_client.fetch_pageviews([100, 200])
+    assert len(analytics.calls) == 2
+    filters = analytics.calls[1]['reportRequests'][0]['dimensionFilterClauses'][0]['filters']
+    assert [f['expressions'] for f in filters] == [['/(200)([/?]|$)']]
+
+
+def test_fetch_pageviews_splits_into_chunks(analytics, monkeypatch):
+    monkeypatch.setattr(analytics_client, 'CHUNK_SIZE', 2)
+    assert analytics_client.fetch_pageviews([100, 101, 200]) == [120, 45, 12]
+    assert len(analytics.calls) == 2
+
+
+def test_use_service_drops_the_cache(analytics):
+    analytics_client.fetch_pageviews([100])
+    analytics_client.use_service(analytics)
+    analytics_client.fetch_pageviews([100])
+    assert len(analytics.calls) == 2
+
+
+def test_pageviews_of_a_response_are_fetched_together(db, analytics):
+    result = schema.execute('{ groups { edges { node { guid pageviews } } } }', context_value={})
+    assert not result.errors
+    views = {edge['node']['guid']: edge['node']['pageviews'] for edge in result.data['groups']['edges']}
+    assert views == {'100': 120, '101': 45}
+    assert len(analytics.calls) == 1
+
+
+def test_pageviews_loader_caches_per_request(db, analytics):
+    context = {}
+    loader = get_loaders(context).pageviews
+    assert loader.load(100).get() == 120
+    assert loader.load(100).get() == 120
+    assert len(analytics.calls) == 1
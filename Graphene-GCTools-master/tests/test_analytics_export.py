@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from analytics_export import ParquetExport
+
+
+@pytest.fixture
+def export(tmp_path):
+    return ParquetExport(str(tmp_path))
+
+
+def test_round_trip(export):
+    df = pd.DataFrame({
+        'guid': [100, 101],
+        'name': ['Data Science', 'Finance Network'],
+        'tags': [['statistics', 'ml'], []],
+        'owner': [{'guid': 1, 'name': 'User 1'}, {'guid': 2, 'name': 'User 2'}],
+    })
+    export.write('groups', df, '20180101')
+
+    back = export.read('groups')
+    assert back['guid'].tolist() == [100, 101]
+    assert isinstance(back['name'].dtype, pd.CategoricalDtype)
+    assert back['name'].tolist() == ['Data Science', 'Finance Network']
+    assert [list(tags) for tags in back['tags']] == [['statistics', 'ml'], []]
+    assert back['owner'].tolist() == [{'guid': 1, 'name': 'User 1'}, {'guid': 2, 'name': 'User 2'}]
+    assert back['snapshot'].tolist() == ['20180101', '20180101']
+
+
+def test_nullable_numbers_across_days(export):
+    # The same column comes out of pandas as int64, float64 (a None in it) and all None
+    export.write('groups', pd.DataFrame({'guid': [1, 2], 'members': [10, 20]}), '20180101')
+    export.write('groups', pd.DataFrame({'guid': [3, 4], 'members': [30, None]}), '20180102')
+    export.write('groups', pd.DataFrame({'guid': [5], 'members': [None]}), '20180103')
+    export.write('groups', pd.DataFrame({'guid': [6], 'members': [1.5]}), '20180104')
+
+    back = export.read('groups')
+    assert back['guid'].tolist() == [1, 2, 3, 4, 5, 6]
+    members = back['members'].tolist()
+    assert members[:3] == [10, 20, 30]
+    assert np.isnan(members[3]) and np.isnan(members[4])
+    assert members[5] == 1.5
+
+
+def test_nullable_strings_across_days(export):
+    many = ['name {}'.format(i) for i in range(300)]
+    export.write('groups', pd.DataFrame({'name': ['a', 'b']}), '20180101')
+    export.write('groups', pd.DataFrame({'name': [None, None]}), '20180102')
+    # More distinct values than an int8 dictionary index holds
+    export.write('groups', pd.DataFrame({'name': many}), '20180103')
+
+    back = export.read('groups')
+    names = back['name'].tolist()
+    assert names[:2] == ['a', 'b']
+    assert pd.isna(names[2]) and pd.isna(names[3])
+    assert names[4:] == many
+
+
+def test_columns_only_some_days_have_are_null_for_the_others(export):
+    export.write('groups', pd.DataFrame({'guid': [1]}), '20180101')
+    export.write('groups', pd.DataFrame({'guid': [2], 'members': [5]}), '20180102')
+
+    back = export.read('groups')
+    assert back['guid'].tolist() == [1, 2]
+    assert pd.isna(back['members'][0]) and back['members'][1] == 5
+
+
+def test_days_and_columns(export):
+    for day in ('20180101', '20180102', '20180103'):
+        export.write('groups', pd.DataFrame({'guid': [int(day[-1])], 'name': [day]}), day)
+
+    assert export.days('groups') == ['20180101', '20180102', '20180103']
+    assert export.days('nothing') == []
+    assert export.read('nothing') is None
+
+    table = export.read_table('groups', '20180102', '20180103', columns=['guid'])
+    assert table.column_names == ['guid', 'snapshot']
+    assert table.column('guid').to_pylist() == [2, 3]
+
+
+def test_write_replaces_the_day(export):
+    export.write('groups', pd.DataFrame({'guid': [1]}), '20180101')
+    export.write('groups', pd.DataFrame({'guid': [2]}), '20180101')
+    assert export.read('groups')['guid'].tolist() == [2]
@@ -0,0 +1,123 @@
+import json
+
+from graphql.execution import ExecutionResult
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from analytics_helpers import extract_list, find, len_of_nested_list, list_value_counts, split_nested_dict, \
+    stream_frame, to_frame, to_json
+
+
+def groups():
+    return pd.DataFrame({
+        'guid': [100, 101, 102],
+        'owner': [{'guid': 1, 'name': 'User 1'}, {'guid': 2, 'name': 'User 2'}, {'guid': 3}],
+        'tags': [[{'string': 'ml'}, {'string': 'stats'}, {'string': 'ml'}], [{'string': 'budget'}], []],
+        'scores': [[1, 2], [3, 4.5], [5]],
+    }, index=[10, 11, 12])
+
+
+def test_split_nested_dict():
+    df = groups()
+    owners = split_nested_dict(df, 'owner')
+    assert owners.columns.tolist() == ['guid', 'name']
+    assert owners.index.tolist() == [10, 11, 12]
+    assert owners['name'].tolist()[:2] == ['User 1', 'User 2']
+    # Used to be a KeyError
+    assert pd.isna(owners['name'][12])
+
+    both = split_nested_dict(df, 'owner', concat=True, drop=True)
+    assert both.columns.tolist() == ['guid', 'tags', 'scores', 'guid', 'name']
+
+
+def test_split_nested_dict_keeps_one_dtype_for_every_column():
+    df = pd.DataFrame({'counts': [{'members': 3, 'active': True}, {'members': 2, 'active': False}]})
+    counts = split_nested_dict(df, 'counts')
+    assert counts['members'].tolist() == [3, 2]
+    assert counts['active'].tolist() == [1, 0]
+    assert counts['members'].dtype == counts['active'].dtype == np.int64
+
+    single = split_nested_dict(pd.DataFrame({'d': [{'a': 1}, {'a': 2}]}), 'd')
+    assert single['a'].tolist() == [1, 2]
+
+
+def test_extract_list():
+    df = groups()
+    tags = extract_list(df, 'tags', 'string')
+    assert tags.index.tolist() == [10, 11, 12]
+    assert tags.loc[10].tolist() == ['ml', 'stats', 'ml']
+    assert tags.loc[11, 0] == 'budget'
+    assert tags.loc[11, [1, 2]].isna().all() and tags.loc[12].isna().all()
+
+    # Short or mixed rows of numbers come out as floats, padded with NaN
+    scores = extract_list(df, 'scores')
+    pdt.assert_frame_equal(scores, pd.DataFrame([[1.0, 2.0], [3.0, 4.5], [5.0, np.nan]], index=[10, 11, 12]))
+
+    ints = extract_list(pd.DataFrame({'x': [[1, 2], [3, 4]]}), 'x')
+    assert ints.dtypes.tolist() == [np.int64, np.int64]
+
+    assert extract_list(df, 'tags', 'string', concat=True).columns.tolist() == \
+        ['guid', 'owner', 'tags', 'scores', 0, 1, 2]
+    assert extract_list(pd.DataFrame({'x': [[], []]}), 'x').shape == (2, 0)
+
+
+def test_list_value_counts():
+    df = groups()
+    counts = list_value_counts(df, 'tags', 'string')
+    pdt.assert_frame_equal(counts, pd.DataFrame(
+        [[0.0, 2.0, 1.0], [1.0, 0.0, 0.0], [0.0, 0.0, 0.0]], index=[10, 11, 12], columns=['budget', 'ml', 'stats']))
+
+    same = pd.DataFrame({'tags': [[{'string': 'a'}], [{'string': 'a'}]]})
+    counts = list_value_counts(same, 'tags', 'string')
+    assert counts['a'].tolist() == [1, 1]
+    assert counts['a'].dtype == np.int64
+
+    assert list_value_counts(df, 'tags', 'string', concat=True).columns.tolist()[-3:] == ['budget', 'ml', 'stats']
+
+
+def test_len_of_nested_list():
+    assert len_of_nested_list(groups(), 'tags').tolist() == [3, 1, 0]
+
+
+RESPONSE = {'data': {'groups': {'edges': [
+    {'node': {'guid': 100, 'name': 'Data Science', 'owner': {'email': 'a@b.c'},
+              'members': [{'guid': 1}, {'guid': 2}], 'score': 1.5}},
+    {'node': {'guid': 101, 'name': 'Finance Network', 'owner': None, 'members': [], 'score': None}},
+]}}}
+COLUMNS = ['node.guid', 'node.name', 'node.owner.email', 'node.members.guid', 'node.score']
+
+
+def test_to_frame():
+    df = to_frame(RESPONSE, 'groups.edges', COLUMNS)
+    assert df.columns.tolist() == COLUMNS
+    assert df['node.guid'].tolist() == [100, 101]
+    assert df['node.owner.email'].tolist()[0] == 'a@b.c' and pd.isna(df['node.owner.email'][1])
+    # A list along the way gives a list
+    assert df['node.members.guid'].tolist() == [[1, 2], []]
+    assert df['node.score'].tolist()[0] == 1.5
+
+    # Rows under a list, and a whole ExecutionResult
+    result = ExecutionResult(data=RESPONSE['data'])
+    members = to_frame(result, 'groups.edges.node.members', ['guid'])
+    assert members['guid'].tolist() == [1, 2]
+    assert to_frame({'data': {'groups': None}}, 'groups.edges', ['node.guid']).shape == (0, 1)
+
+
+def test_to_frame_gets_what_find_does():
+    df = to_frame(RESPONSE, 'groups.edges', ['node.name'])
+    assert df['node.name'].tolist() == list(find('name', to_json(ExecutionResult(data=RESPONSE['data']))))
+
+
+def test_stream_frame(tmp_path):
+    pytest.importorskip('ijson')
+    path = tmp_path / 'response.json'
+    path.write_text(json.dumps(RESPONSE))
+
+    streamed = stream_frame(str(path), 'groups.edges', COLUMNS)
+    pdt.assert_frame_equal(streamed, to_frame(RESPONSE, 'groups.edges', COLUMNS))
+
+    with open(str(path), 'rb') as f:
+        chunks = list(stream_frame(f, 'groups.edges', ['node.guid'], chunksize=1))
+    assert [chunk['node.guid'].tolist() for chunk in chunks] == [[100], [101]]
@@ -0,0 +1,112 @@
+import datetime
+import re
+
+import pytest
+
+from analytics_store import AnalyticsStore, day_range, day_runs, filter_key
+from gcga import gcga
+
+
+# (ga:date, pagePath, pageTitle, pageviews)
+DAILY = [
+    ('20180101', '/groups/profile/100/data-science', 'Data Science', 10),
+    ('20180102', '/groups/profile/100/data-science', 'Data Science', 20),
+    ('20180102', '/groups/profile/100/data-science?tab=members', 'Data Science', 5),
+    ('20180105', '/groups/profile/100/data-science', 'Data Science', 30),
+    ('20180109', '/groups/profile/100/data-science', 'Data Science', 40),
+    ('20180102', '/groups/profile/101/finance-network', 'Finance Network', 99),
+]
+
+
+class DailyService:
+    """ Reporting API stand-in for the per day reports the store is filled from """
+    def __init__(self, rows):
+        self.rows = rows
+        # (startDate, endDate) of every report asked for
+        self.ranges = []
+
+    def reports(self):
+        return self
+
+    def batchGet(self, body):
+        self.body = body
+        return self
+
+    def execute(self):
+        return {'reports': [self.report(request) for request in self.body['reportRequests']]}
+
+    def report(self, request):
+        date_range = request['dateRanges'][0]
+        self.ranges.append((date_range['startDate'], date_range['endDate']))
+        first, last = (date.replace('-', '') for date in (date_range['startDate'], date_range['endDate']))
+        expressions = [f['expressions'][0] for clause in request['dimensionFilterClauses'] for f in clause['filters']]
+        return {'data': {'rows': [
+            {'dimensions': [day, path, title], 'metrics': [{'values': [str(views)]}]}
+            for day, path, title, views in self.rows
+            if first <= day <= last and any(re.search(expression, path) for expression in expressions)
+        ]}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AnalyticsStore(str(tmp_path / 'analytics.sqlite'))
+
+
+def test_days():
+    assert day_range(datetime.date(2017, 12, 30), datetime.date(2018, 1, 2)) == \
+        ['20171230', '20171231', '20180101', '20180102']
+    assert day_range(datetime.date(2018, 1, 2), datetime.date(2018, 1, 1)) == []
+    assert day_runs(['20180101', '20180102', '20180105', '20180228', '20180301']) == [
+        (datetime.date(2018, 1, 1), datetime.date(2018, 1, 2)),
+        (datetime.date(2018, 1, 5), datetime.date(2018, 1, 5)),
+        (datetime.date(2018, 2, 28), datetime.date(2018, 3, 1)),
+    ]
+    assert filter_key(('/100/',)) == filter_key(['/100/']) != filter_key(['/101/'])
+
+
+def test_days_to_fetch(store):
+    old = ['20180101', '20180102']
+    assert store.days_to_fetch('gcconnex', 'key', old) == old
+    store.write('gcconnex', 'key', old, [('20180101', '/a', 'A', 1)])
+    assert store.days_to_fetch('gcconnex', 'key', old + ['20180103']) == ['20180103']
+    # Other filters and platforms are partitions of their own
+    assert store.days_to_fetch('gccollab', 'key', old) == old
+    assert store.days_to_fetch('gcconnex', 'other', old) == old
+    assert store.rows('gcconnex', 'key', '20180101', '20180102') == [('20180101', '/a', 'A', 1)]
+
+
+def test_recent_days_are_fetched_again(tmp_path):
+    store = AnalyticsStore(str(tmp_path / 'analytics.sqlite'), mutable_days=2, mutable_ttl=-1)
+    today = datetime.date.today()
+    days = day_range(today - datetime.timedelta(days=5), today)
+    store.write('gcconnex', 'key', days, [])
+    assert store.days_to_fetch('gcconnex', 'key', days) == days[-3:]
+
+
+def test_write_replaces_the_days(store):
+    store.write('gcconnex', 'key', ['20180101'], [('20180101', '/a', 'A', 1), ('20180101', '/b', 'B', 2)])
+    store.write('gcconnex', 'key', ['20180101'], [('20180101', '/a', 'A', 3)])
+    assert store.rows('gcconnex', 'key', '20180101', '20180101') == [('20180101', '/a', 'A', 3)]
+
+
+def test_pageviews_only_fetch_the_missing_days(store):
+    service = DailyService(DAILY)
+    ga = gcga(analytics=service, store=store)
+
+    week = ga.pageviews('https://gcconnex.gc.ca/groups/profile/100/', '2018-01-01', '2018-01-07')
+    # Weekdays only, every path of the group added up
+    assert week == {'dates': ['20180101', '20180102', '20180103', '20180104', '20180105'],
+                    'pageviews': ['10', '25', '0', '0', '30']}
+    assert service.ranges == [('2018-01-01', '2018-01-07')]
+
+    assert ga.pageviews('https://gcconnex.gc.ca/groups/profile/100/', '2018-01-01', '2018-01-07') == week
+    assert ga.pageviews('https://gcconnex.gc.ca/groups/profile/100/', '2018-01-03', '2018-01-10')['pageviews'] == \
+        ['0', '0', '30', '0', '40', '0']
+    assert service.ranges == [('2018-01-01', '2018-01-07'), ('2018-01-08', '2018-01-10')]
+
+
+def test_content_views_from_the_store_match_the_report(store):
+    ga = gcga(analytics=DailyService(DAILY), store=store)
+    views = ga.content_views('/groups/profile/100/', '2018-01-01', '2018-01-10')
+    assert views == {'urls': ['groups', 'groups'], 'pageviews': ['100', '5'],
+                     'titles': ['Data Science', 'Data Science']}
@@ -0,0 +1,116 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import async_app
+from backend import GCToolsBackend
+import database
+from models import db_session
+from response_cache import ResponseCache
+from schema import schema
+
+
+QUERY = '''{
+  user(first: 5) { edges { node { guid department colleagues { guid } groupsJoined { guid membersCount } } } }
+  groups { edges { node { guid pageviews membersCount } } }
+}'''
+
+
+@pytest.fixture
+def statements():
+    """ The thread every statement ran in """
+    threads = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        threads.append(threading.current_thread())
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    yield threads
+    event.remove(Engine, 'before_cursor_execute', record)
+
+
+def post(query, backend=None):
+    """ Sends query to a fresh async_app, returns the JSON and the event loop's thread """
+    async def run():
+        handler = async_app.GraphQLHandler(schema, backend or GCToolsBackend(response_cache=ResponseCache()))
+        app = async_app.web.Application()
+        app.router.add_route('POST', '/graphql', handler.handle)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post('/graphql', json={'query': query})
+            return await response.json(), threading.current_thread()
+
+    return asyncio.run(run())
+
+
+def test_same_answer_as_the_sync_schema(db, analytics):
+    expected = schema.execute(QUERY, context_value={})
+    assert not expected.errors
+
+    result, _ = post(QUERY)
+    assert 'errors' not in result
+    assert result['data'] == expected.data
+
+
+def test_no_sql_runs_on_the_event_loop(db, analytics, statements):
+    # Nothing built yet: the snapshots and the response cache's watermark all need MySQL
+    result, loop_thread = post(QUERY)
+    assert 'errors' not in result
+    assert statements
+    assert loop_thread not in statements
+
+
+def test_sessions_share_a_replica_and_are_handed_back(db, analytics, monkeypatch):
+    sessions = []
+    init = database.RoutingSession.__init__
+
+    def counting_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        sessions.append(self)
+
+    monkeypatch.setattr(database.RoutingSession, '__init__', counting_init)
+    before = dict(db_session.registry.registry)
+
+    result, _ = post(QUERY)
+    assert 'errors' not in result
+    assert 1 <= len(sessions) <= async_app.MAX_CONCURRENCY
+    assert len({session._turn for session in sessions}) == 1
+    # And they were handed back once the request was answered
+    assert db_session.registry.registry == before
+
+
+def test_blocking_calls_overlap_up_to_the_limit(db):
+    lock = threading.Lock()
+    running = []
+    most = []
+
+    def slow():
+        # Each call has a session of its own
+        session = db_session()
+        with lock:
+            running.append(session)
+            most.append(len(running))
+        time.sleep(0.1)
+        with lock:
+            running.remove(session)
+        return session
+
+    async def run():
+        runner = async_app.AsyncRunner(ThreadPoolExecutor(max_workers=4), max_concurrency=2)
+        sessions = await asyncio.gather(*(runner._blocking(slow, ()) for _ in range(5)))
+        runner.close()
+        return sessions
+
+    before = dict(db_session.registry.registry)
+    sessions = asyncio.run(run())
+    assert max(most) == 2
+    assert len(set(sessions)) == 2
+    assert db_session.registry.registry == before
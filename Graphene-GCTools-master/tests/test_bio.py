@@ -0,0 +1,44 @@
+from schema import schema
+
+from conftest import on
+
+
+def bios(arguments=''):
+    query = '{ allUsers(first: 5) { edges { node { guid bio%s { spec guid title } } } } }' % arguments
+    result = schema.execute(query, context_value={})
+    assert not result.errors, result.errors
+    return {int(edge['node']['guid']): edge['node']['bio'] for edge in result.data['allUsers']['edges']}
+
+
+def test_every_spec(db):
+    found = bios()
+    assert found[1] == [{'spec': 'work', 'guid': 500, 'title': 'Analyst at X'},
+                        {'spec': 'education', 'guid': 501, 'title': 'University'}]
+    assert found[2] == [{'spec': 'work', 'guid': 502, 'title': 'Analyst at Y'}]
+    assert found[3] == []
+
+
+def test_one_spec(db):
+    found = bios('(spec: "education")')
+    assert found[1] == [{'spec': 'education', 'guid': 501, 'title': 'University'}]
+    assert found[2] == []
+
+
+def test_contains(db):
+    # Title or description, whole words or their start, any case
+    found = bios('(spec: "work", contains: "analyst at")')
+    assert [entry['guid'] for entry in found[1] + found[2]] == [500, 502]
+    found = bios('(contains: "more")')
+    assert [entry['guid'] for entry in found[1] + found[2]] == [502]
+    assert bios('(contains: "nobody")')[1] == []
+
+
+def test_unknown_spec(db):
+    result = schema.execute('{ allUsers(first: 1) { edges { node { bio(spec: "hobbies") { guid } } } } }',
+                            context_value={})
+    assert "This isn't a proper type" in str(result.errors[0])
+
+
+def test_every_user_in_one_query(statements):
+    bios()
+    assert len(on('elggmetadata', statements)) == 1
@@ -0,0 +1,87 @@
+import pytest
+
+import models
+from schema import schema
+from community_index import community_index
+
+from conftest import AUDIENCE, on
+
+
+COMMUNITIES = '''query ($first: Int, $after: String, $last: Int, $before: String) {
+  communities {
+    edges { node { string groupsCount
+      groups(first: $first, after: $after, last: $last, before: $before) {
+        edges { cursor node { guid name } }
+        pageInfo { hasNextPage hasPreviousPage }
+      }
+    } }
+  }
+}'''
+
+
+@pytest.fixture
+def policy(db):
+    """ A second community, 'Policy' (8), with content in group 100 only """
+    db.add(models.Metastrings(id=8, string='Policy'))
+    db.add(models.Metadata(id=100, entity_guid=201, name_id=AUDIENCE, value_id=8, owner_guid=1,
+                           access_id=2, time_created=80))
+    db.commit()
+    return db
+
+
+def communities(**variables):
+    result = schema.execute(COMMUNITIES, variable_values=variables, context_value={})
+    assert not result.errors, result.errors
+    return {edge['node']['string']: edge['node'] for edge in result.data['communities']['edges']}
+
+
+def guids(community):
+    return [int(edge['node']['guid']) for edge in community['groups']['edges']]
+
+
+def test_groups_of_each_community(policy):
+    assert community_index.groups(4) == [100, 101]
+    assert community_index.groups(8) == [100]
+    assert community_index.count(9) == 0
+
+    found = communities()
+    assert guids(found['Science']) == [100, 101]
+    assert found['Science']['groupsCount'] == 2
+    assert guids(found['Policy']) == [100]
+    assert found['Policy']['groups']['edges'][0]['node']['name'] == 'Data Science'
+
+
+def test_one_query_for_the_groups_of_every_community(policy, statements):
+    community_index.keep_fresh()
+    del statements[:]
+
+    communities()
+    assert len(on('elgggroups_entity', statements)) == 1
+
+
+def test_paging(policy):
+    science = communities(first=1)['Science']
+    assert guids(science) == [100]
+    assert science['groups']['pageInfo'] == {'hasNextPage': True, 'hasPreviousPage': False}
+
+    after = science['groups']['edges'][-1]['cursor']
+    science = communities(first=1, after=after)['Science']
+    assert guids(science) == [101]
+    assert science['groups']['pageInfo'] == {'hasNextPage': False, 'hasPreviousPage': True}
+
+    science = communities(last=1)['Science']
+    assert guids(science) == [101]
+    assert science['groups']['pageInfo']['hasPreviousPage']
+
+    before = science['groups']['edges'][0]['cursor']
+    assert guids(communities(last=5, before=before)['Science']) == [100]
+
+
+def test_deleted_groups_are_left_out(policy):
+    community_index.keep_fresh()
+    policy.query(models.Groups).filter(models.Groups.guid == 100).delete()
+    policy.commit()
+
+    found = communities()
+    assert guids(found['Science']) == [101]
+    assert guids(found['Policy']) == []
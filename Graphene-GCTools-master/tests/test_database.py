@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from sqlalchemy import Column, Integer, String
+from sqlalchemy.ext.declarative import declarative_base
+
+import database
+from database import DEFAULTS, Engines, PoolMetrics, RoutingSession, TimedQueuePool, load_config, pool_stats
+
+
+Base = declarative_base()
+
+
+class Note(Base):
+    __tablename__ = 'notes'
+    id = Column(Integer, primary_key=True)
+    text = Column(String(20))
+
+
+def test_defaults():
+    assert load_config({}) == DEFAULTS
+
+
+def test_environment_over_the_file(tmp_path):
+    path = tmp_path / 'db.json'
+    path.write_text(json.dumps({'url': 'sqlite:///file.db', 'pool_size': 20, 'replicas': ['sqlite:///r.db']}))
+    config = load_config({'GCTOOLS_DB_CONFIG': str(path), 'GCTOOLS_DB_POOL_SIZE': '30',
+                          'GCTOOLS_DB_PRE_PING': 'off', 'GCTOOLS_DB_REPLICAS': 'sqlite:///a.db, sqlite:///b.db,'})
+    assert config['url'] == 'sqlite:///file.db'
+    assert config['pool_size'] == 30
+    assert config['pre_ping'] is False
+    assert config['replicas'] == ['sqlite:///a.db', 'sqlite:///b.db']
+    assert config['max_overflow'] == DEFAULTS['max_overflow']
+
+
+def test_unknown_settings_in_the_file(tmp_path):
+    path = tmp_path / 'db.json'
+    path.write_text(json.dumps({'pool_sise': 20}))
+    with pytest.raises(ValueError, match='pool_sise'):
+        load_config({'GCTOOLS_DB_CONFIG': str(path)})
+
+
+def test_pool_metrics(monkeypatch):
+    monkeypatch.setattr(database, 'SLOW_CHECKOUT', 0.5)
+    metrics = PoolMetrics()
+    assert metrics.stats()['average_wait'] == 0.0
+    for wait in (0.1, 0.3, 1.0):
+        metrics.record(wait)
+    stats = metrics.stats()
+    assert stats['checkouts'] == 3
+    assert stats['average_wait'] == pytest.approx(1.4 / 3)
+    assert stats['max_wait'] == 1.0
+    assert stats['slow'] == 1
+
+
+def configure(monkeypatch, environ):
+    """ Engines made from now on read their settings from environ only """
+    monkeypatch.setattr(database, 'load_config', lambda: load_config(environ))
+
+
+@pytest.fixture
+def engines(tmp_path, monkeypatch):
+    """ A primary and a replica, whose notes say which one they are """
+    made = []
+    def make_primary(config):
+        made.append(config)
+        return database.make_engine('sqlite:///' + str(tmp_path / 'primary.db'), config)
+
+    configure(monkeypatch, {'GCTOOLS_DB_REPLICAS': 'sqlite:///' + str(tmp_path / 'replica.db'),
+                            'GCTOOLS_DB_POOL_SIZE': '2'})
+    engines = Engines(make_primary)
+    assert not engines.loaded
+    for name, engine in engines.all().items():
+        Base.metadata.create_all(engine)
+        engine.execute(Note.__table__.insert(), id=1, text=name)
+    engines.made = made
+    yield engines
+    for engine in engines.all().values():
+        engine.dispose()
+
+
+def test_engines_are_made_once(engines):
+    assert engines.loaded
+    assert len(engines.made) == 1
+    assert engines.primary.pool.size() == 2
+    assert isinstance(engines.primary.pool, TimedQueuePool)
+    assert list(engines.all()) == ['primary', 'replica1']
+
+
+def test_reads_go_to_the_replica_and_writes_to_the_primary(engines):
+    session = RoutingSession(engines)
+    assert session.query(Note).get(1).text == 'replica1'
+
+    session.add(Note(id=2, text='new'))
+    session.commit()
+    assert engines.primary.execute('SELECT text FROM notes WHERE id = 2').scalar() == 'new'
+    assert engines.replicas[0].execute('SELECT count(*) FROM notes').scalar() == 1
+    session.close()
+
+
+def test_without_replicas_everything_goes_to_the_primary(tmp_path, monkeypatch):
+    configure(monkeypatch, {})
+    engines = Engines(lambda config: database.make_engine('sqlite:///' + str(tmp_path / 'only.db'), config))
+    assert RoutingSession(engines).get_bind() is engines.primary
+    engines.primary.dispose()
+
+
+def test_pool_stats(engines):
+    session = RoutingSession(engines)
+    session.query(Note).all()
+    session.close()
+    stats = pool_stats(engines)
+    assert set(stats) == {'primary', 'replica1'}
+    assert stats['replica1']['checkouts'] >= 1
+    assert stats['primary']['size'] == 2
+    assert stats['replica1']['checked_out'] == 0
+
+    # dispose() makes a new pool, the numbers stay
+    checkouts = stats['replica1']['checkouts']
+    engines.replicas[0].dispose()
+    assert pool_stats(engines)['replica1']['checkouts'] == checkouts
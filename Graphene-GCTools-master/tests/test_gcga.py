@@ -0,0 +1,128 @@
+import pandas as pd
+import pytest
+
+from gcga import gcga, _get_filetype, _get_query
+
+from conftest import ReportingService, PAGEVIEWS
+
+
+@pytest.fixture
+def service():
+    return ReportingService(PAGEVIEWS)
+
+
+@pytest.fixture
+def ga(service):
+    return gcga(analytics=service)
+
+
+def test_bulk_pageviews(ga, service):
+    views = ga.bulk_pageviews([100, 101, 200, 404])
+    assert views[100] == {'urls': ['groups', 'groups'], 'pageviews': ['120', '30'],
+                          'titles': ['Data Science', 'Data Science']}
+    assert views[101]['pageviews'] == ['45']
+    # /blog/view/5200/ isn't 200
+    assert views[200] == {'urls': ['blog'], 'pageviews': ['12'], 'titles': ['Title 200']}
+    assert views[404] == {'urls': [], 'pageviews': [], 'titles': []}
+    assert len(service.calls) == 1
+
+
+def test_bulk_pageviews_is_the_same_as_content_views_one_at_a_time(ga):
+    views = ga.bulk_pageviews([100, 101])
+    for guid in (100, 101):
+        assert views[guid] == ga.content_views('/{}/'.format(guid))
+
+
+def test_guids_are_packed_into_few_calls(ga, service):
+    guids = list(range(10000, 10500))
+    packed = ga._pack_guids([str(guid) for guid in guids])
+    expressions = [expression for request in packed for expression in request]
+    assert all(len(expression) <= gcga._MAX_EXPRESSION_LENGTH for expression in expressions)
+    assert all(len(request) <= gcga._MAX_FILTERS_PER_CLAUSE for request in packed)
+    # Every guid is in exactly one of them
+    assert sorted(sum((expression[2:-9].split('|') for expression in expressions), [])) == \
+        [str(guid) for guid in guids]
+
+    ga.bulk_pageviews(guids)
+    assert len(service.calls) == -(-len(packed) // gcga._MAX_REQUESTS_PER_BATCH)
+    assert all(len(call['reportRequests']) <= gcga._MAX_REQUESTS_PER_BATCH for call in service.calls)
+
+
+def test_bulk_pageviews_without_any_rows(ga):
+    assert ga.bulk_pageviews([404, 405]) == {404: {'urls': [], 'pageviews': [], 'titles': []},
+                                             405: {'urls': [], 'pageviews': [], 'titles': []}}
+
+
+def test_reports_follow_next_page_token():
+    service = ReportingService(PAGEVIEWS, page_size=2)
+    ga = gcga(analytics=service)
+    rows = list(ga.report_rows('30daysAgo', 'today', 'ga:pageviews', 'ga:pagePath', ['/']))
+    assert [int(value) for _, value in rows] == [999, 120, 45, 30, 12]
+    assert [call['reportRequests'][0].get('pageToken') for call in service.calls] == [None, '2', '4']
+
+
+def test_report_pages_are_only_fetched_as_they_are_needed():
+    service = ReportingService(PAGEVIEWS, page_size=2)
+    rows = gcga(analytics=service).report_rows('30daysAgo', 'today', 'ga:pageviews', 'ga:pagePath', ['/'])
+    next(rows)
+    next(rows)
+    assert len(service.calls) == 1
+    next(rows)
+    assert len(service.calls) == 2
+
+
+def test_every_page_of_a_batch_comes_back_to_its_request():
+    service = ReportingService(PAGEVIEWS, page_size=1)
+    ga = gcga(analytics=service)
+    views = ga.batch_content_views(['/groups/', '/blog/'])
+    assert views[0]['pageviews'] == ['120', '45', '30']
+    assert views[1]['pageviews'] == ['999', '12']
+    # Both requests go in each call until they run out
+    assert len(service.calls[0]['reportRequests']) == 2
+
+
+def test_typed_frames():
+    service = ReportingService(PAGEVIEWS + [('/groups/profile/102/x', 'Data Science', 7)], page_size=2)
+    ga = gcga(analytics=service)
+    request = ga._content_views_request('/groups/', '30daysAgo', 'today')
+    df = ga._report_into_df(request, double_dimension=True, typed=True)
+    assert str(df['metric'].dtype) == 'int64'
+    assert df['metric'].tolist() == [120, 45, 30, 7]
+    assert df['dimension2'].dtype == 'category'
+    assert list(df['dimension2'].cat.categories) == ['Data Science', 'Finance Network']
+    assert df['dimension2'].tolist() == ['Data Science', 'Finance Network', 'Data Science', 'Data Science']
+
+    untyped = ga._report_into_df(request, double_dimension=True)
+    assert untyped['metric'].tolist() == ['120', '45', '30', '7']
+    assert untyped['dimension'].tolist() == df['dimension'].astype(str).tolist()
+
+
+SEARCHES = ['/search?q=data+science&lang=en', '/search?q=&lang=en', '/search?q=abc', '/search',
+            '/search&lang=en?q=abc', '/search?q=a=b&c', '', '/search?q=é+à&x']
+URLS = ['/blog/view/1/title', '/groups/profile/100', '/file', 'nopath', '', 'a/b', '/', '//x']
+
+
+@pytest.fixture(params=['pyarrow', 'row by row'])
+def kernels(request, monkeypatch):
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr('gcga.pa', None)
+
+
+def test_search_terms(kernels):
+    terms = gcga._search_terms(pd.Series(SEARCHES, index=range(10, 18)))
+    assert terms.tolist() == [_get_query(url).replace('+', ' ') for url in SEARCHES]
+    assert terms.tolist()[:5] == ['data science', 'EMPTY', 'query malformed', 'query malformed', 'EMPTY']
+    assert terms.index.tolist() == list(range(10, 18))
+
+
+def test_filetypes(kernels):
+    filetypes = gcga._filetypes(pd.Series(URLS))
+    assert filetypes.tolist() == [_get_filetype(url) for url in URLS]
+    assert filetypes.tolist()[:3] == ['blog', 'groups', 'fil']
+
+
+def test_format_dates():
+    dates = pd.Series(pd.to_datetime(['2018-01-02', '2018-12-31', '1999-10-09']))
+    assert gcga._format_dates(dates).tolist() == dates.dt.strftime('%Y%m%d').tolist()
@@ -0,0 +1,60 @@
+import time
+
+import models
+from group_stats import group_stats
+from schema import schema
+
+from conftest import BLOG, DISCUSSION, FILE, on
+
+
+COUNTS = '{ groups { edges { node { guid membersCount discussionsCount blogsCount filesCount } } } }'
+
+
+def test_counts(db):
+    assert group_stats.get(100) == {'members_count': 3, 'discussions_count': 1, 'blogs_count': 1, 'files_count': 1}
+    assert group_stats.get(101) == {'members_count': 2, 'discussions_count': 0, 'blogs_count': 0, 'files_count': 1}
+    assert group_stats.get(9999) == {'members_count': 0, 'discussions_count': 0, 'blogs_count': 0, 'files_count': 0}
+
+
+def test_listing_groups_with_their_counts_is_one_query(statements):
+    group_stats.keep_fresh()
+    del statements[:]
+
+    result = schema.execute(COUNTS, context_value={})
+    assert not result.errors, result.errors
+    counts = {edge['node']['guid']: edge['node'] for edge in result.data['groups']['edges']}
+    assert counts['100']['membersCount'] == 3
+    assert counts['101']['filesCount'] == 1
+    assert len(statements) == 1
+    assert on('elgggroups_entity', statements)
+
+
+def test_touched_groups_are_recounted(db):
+    group_stats.keep_fresh()
+    now = int(time.time())
+    db.add(models.Relationships(id=1000, guid_one=5, guid_two=101, relationship='member', time_created=now))
+    db.add(models.Entities(guid=204, type='object', subtype=BLOG, owner_guid=4, container_guid=101,
+                           time_created=now, time_updated=now))
+    # Moved out of 100 into 101
+    db.query(models.Entities).filter(models.Entities.guid == 201).update({'container_guid': 101, 'time_updated': now})
+    # Gone from 101, which was touched anyway, so it is caught right away
+    db.query(models.Entities).filter(models.Entities.guid == 202).delete()
+    db.commit()
+    group_stats.update(now - 1, now + 1)
+
+    assert group_stats.get(101) == {'members_count': 3, 'discussions_count': 1, 'blogs_count': 1, 'files_count': 0}
+    # Nothing points back at the group 201 left, that waits for the rebuild
+    assert group_stats.get(100)['discussions_count'] == 1
+    group_stats.refresh(rebuild=True)
+    assert group_stats.get(100) == {'members_count': 3, 'discussions_count': 0, 'blogs_count': 1, 'files_count': 1}
+
+
+def test_only_content_in_groups_is_counted(db):
+    db.add(models.Entities(guid=205, type='object', subtype=FILE, owner_guid=1, container_guid=1,
+                           time_created=60, time_updated=60))
+    db.add(models.Entities(guid=206, type='object', subtype=DISCUSSION, owner_guid=1, container_guid=5,
+                           time_created=60, time_updated=60))
+    db.commit()
+
+    assert group_stats.get(1) == {'members_count': 0, 'discussions_count': 0, 'blogs_count': 0, 'files_count': 0}
+    assert group_stats.get(100)['files_count'] == 1
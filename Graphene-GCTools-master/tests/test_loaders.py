@@ -0,0 +1,97 @@
+from loaders import GroupedLoader, Loaders, chunks, get_loaders
+from schema import schema
+from social_graph import social_graph
+
+from conftest import on
+
+
+GROUPS = '''{ groups { edges { node {
+  guid
+  members { guid timeCreated }
+  content(subtype: [1, 5, 7]) {
+    guid title description
+    author { guid }
+    comments { description author { guid } }
+    tags { string }
+    audience { string }
+  }
+} } } }'''
+
+
+class Squares(GroupedLoader):
+    """ Keys up to 10 and their squares, each one twice when many """
+    def __init__(self, many):
+        super(Squares, self).__init__()
+        self.many = many
+        self.batches = []
+
+    def fetch(self, keys):
+        self.batches.append(list(keys))
+        for key in keys:
+            if key <= 10:
+                yield key, key * key
+                if self.many:
+                    yield key, -key * key
+
+
+def run(query):
+    result = schema.execute(query, context_value={})
+    assert not result.errors, result.errors
+    return result.data
+
+
+def test_results_come_back_in_the_order_asked_for():
+    single = Squares(many=False)
+    assert single.load_many([3, 11, 2]).get() == [9, None, 4]
+
+    many = Squares(many=True)
+    assert many.load_many([2, 11]).get() == [[4, -4], []]
+
+
+def test_keys_are_only_fetched_once():
+    loader = Squares(many=False)
+    loader.load(2).get()
+    assert loader.load_many([2, 3]).get() == [4, 9]
+    assert loader.batches == [[2], [3]]
+
+
+def test_chunks():
+    assert list(chunks(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunks([])) == []
+
+
+def test_one_set_of_loaders_per_request():
+    context = {}
+    assert get_loaders(context) is get_loaders(context)
+    assert get_loaders({}) is not get_loaders(context)
+
+    class Request:
+        pass
+    request = Request()
+    assert isinstance(get_loaders(request), Loaders)
+    assert get_loaders(request) is get_loaders(request)
+
+
+def test_every_group_asking_for_the_same_thing_is_one_query(statements):
+    social_graph.refresh()
+    del statements[:]
+
+    data = run(GROUPS)
+    groups = {int(edge['node']['guid']): edge['node'] for edge in data['groups']['edges']}
+    assert sorted(int(member['guid']) for member in groups[100]['members']) == [1, 2, 3]
+    assert groups[100]['members'][0]['timeCreated'] == 101
+
+    content = {int(item['guid']): item for group in groups.values() for item in group['content']}
+    assert sorted(content) == [200, 201, 202, 203]
+    assert content[200]['title'] == 'Title 200'
+    assert content[200]['author'] == {'guid': '1'}
+    assert content[200]['comments'] == [{'description': 'Nice post', 'author': {'guid': '4'}}]
+    assert content[200]['tags'] == [{'string': 'statistics'}]
+    assert content[202]['audience'] == [{'string': 'Science'}]
+
+    # The page of groups, then one batch for each loader under them: users (members
+    # and authors together), their entities, content, titles, comments, comment
+    # authors, tags and audience. However many groups there are
+    assert len(statements) == 9
+    assert len(on('elgggroups_entity', statements)) == 1
+    assert len(on('elggusers_entity', statements)) == 1
@@ -0,0 +1,88 @@
+import models
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor, page_size
+from schema import schema
+
+from conftest import on
+
+
+USERS = '''query ($first: Int, $after: String, $last: Int, $before: String) {
+  user(first: $first, after: $after, last: $last, before: $before) {
+    edges { cursor node { guid } }
+    pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+  }
+}'''
+
+
+def users(**variables):
+    result = schema.execute(USERS, variable_values=variables, context_value={})
+    assert not result.errors, result.errors
+    connection = result.data['user']
+    return [int(edge['node']['guid']) for edge in connection['edges']], connection['pageInfo']
+
+
+def test_cursors():
+    assert decode_cursor(encode_cursor(42)) == 42
+    # Not ours: graphene's own offset cursors, garbage, and search positions
+    assert decode_cursor('YXJyYXljb25uZWN0aW9uOjA=') is None
+    assert decode_cursor('%%%') is None
+    assert decode_cursor(encode_cursor(3, 'rank:')) is None
+
+
+def test_page_size():
+    assert page_size(None) == DEFAULT_PAGE_SIZE
+    assert page_size(5) == 5
+    assert page_size(-1) == 0
+    assert page_size(10 ** 6) == MAX_PAGE_SIZE
+
+
+def test_forwards(db):
+    guids, page = users(first=2)
+    assert guids == [1, 2]
+    assert page['hasNextPage'] and not page['hasPreviousPage']
+
+    guids, page = users(first=2, after=page['endCursor'])
+    assert guids == [3, 4]
+    assert page['hasNextPage'] and page['hasPreviousPage']
+
+    guids, page = users(first=2, after=page['endCursor'])
+    assert guids == [5]
+    assert not page['hasNextPage']
+
+
+def test_backwards(db):
+    guids, page = users(last=2)
+    assert guids == [4, 5]
+    assert page['hasPreviousPage'] and not page['hasNextPage']
+
+    guids, page = users(last=2, before=page['startCursor'])
+    assert guids == [2, 3]
+    guids, page = users(last=2, before=page['startCursor'])
+    assert guids == [1]
+    assert not page['hasPreviousPage']
+
+
+def test_pages_dont_shift_when_rows_are_added_before_them(db):
+    _, page = users(first=2)
+    db.add(models.Users(guid=0, name='User 0', username='user0', last_action=100))
+    db.commit()
+    guids, _ = users(first=2, after=page['endCursor'])
+    assert guids == [3, 4]
+
+
+def test_pages_start_after_the_key(statements):
+    _, page = users(first=2)
+    users(first=2, after=page['endCursor'])
+    pages = on('elggusers_entity', statements)
+    assert len(pages) == 2
+    # Rather than skipping the rows of the pages before it
+    assert 'elggusers_entity.guid > ?' in pages[1]
+    assert 'ORDER BY elggusers_entity.guid' in pages[1]
+
+
+def test_groups_and_communities_page_the_same_way(db):
+    result = schema.execute('{ groups(first: 1) { edges { node { guid } } pageInfo { endCursor } } '
+                            'communities(first: 5) { edges { node { string } } } }', context_value={})
+    assert not result.errors, result.errors
+    assert [edge['node']['guid'] for edge in result.data['groups']['edges']] == ['100']
+    assert decode_cursor(result.data['groups']['pageInfo']['endCursor']) == 100
+    assert [edge['node']['string'] for edge in result.data['communities']['edges']] == ['Science']
@@ -0,0 +1,128 @@
+import json
+
+from flask import Flask
+import pytest
+
+import backend as backend_module
+from backend import GCToolsBackend
+from persisted_queries import PersistedQueries, PersistedQueryView, query_hash
+from schema import schema
+
+
+QUERY = '{ group(guid: 100) { name } }'
+DATA = {'group': {'name': 'Data Science'}}
+
+
+def make_client(persisted_queries):
+    app = Flask(__name__)
+    app.add_url_rule('/graphql', view_func=PersistedQueryView.as_view(
+        'graphql', schema=schema, backend=GCToolsBackend(), persisted_queries=persisted_queries))
+    return app.test_client()
+
+
+@pytest.fixture
+def client(db):
+    return make_client(PersistedQueries())
+
+
+def persisted(sha):
+    return {'persistedQuery': {'version': 1, 'sha256Hash': sha}}
+
+
+def messages(response):
+    return [error['message'] for error in response.get_json().get('errors', [])]
+
+
+def test_automatic_persisted_queries(client):
+    sha = query_hash(QUERY)
+    response = client.post('/graphql', json={'extensions': persisted(sha)})
+    assert messages(response) == ['PersistedQueryNotFound']
+
+    response = client.post('/graphql', json={'query': QUERY, 'extensions': persisted(sha)})
+    assert response.get_json()['data'] == DATA
+
+    response = client.post('/graphql', json={'extensions': persisted(sha)})
+    assert response.get_json()['data'] == DATA
+    # And as GET parameters
+    response = client.get('/graphql', query_string={'extensions': json.dumps(persisted(sha))})
+    assert response.get_json()['data'] == DATA
+
+
+def test_hash_has_to_match_the_query(client):
+    response = client.post('/graphql', json={'query': QUERY, 'extensions': persisted('0' * 64)})
+    assert response.status_code == 400
+    assert messages(response) == ['provided sha does not match query']
+
+    response = client.get('/graphql', query_string={'extensions': '{not json'})
+    assert response.status_code == 400
+
+
+def test_registered_queries(db, tmp_path):
+    path = tmp_path / 'queries.json'
+    path.write_text(json.dumps({query_hash(QUERY): QUERY}))
+    client = make_client(PersistedQueries(str(path), automatic=False))
+
+    response = client.post('/graphql', json={'extensions': persisted(query_hash(QUERY))})
+    assert response.get_json()['data'] == DATA
+
+    other = '{ group(guid: 101) { name } }'
+    client.post('/graphql', json={'query': other, 'extensions': persisted(query_hash(other))})
+    response = client.post('/graphql', json={'extensions': persisted(query_hash(other))})
+    assert messages(response) == ['PersistedQueryNotSupported']
+
+
+def test_registered_queries_are_checked(tmp_path):
+    path = tmp_path / 'queries.json'
+    path.write_text(json.dumps({'0' * 64: QUERY}))
+    with pytest.raises(ValueError):
+        PersistedQueries(str(path))
+
+
+def test_requests_without_a_hash_go_through(client):
+    assert client.post('/graphql', json={'query': QUERY}).get_json()['data'] == DATA
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    """ The query strings parsed by the backend """
+    parsed = []
+    original = backend_module.parse
+    def parse(source):
+        parsed.append(source)
+        return original(source)
+    monkeypatch.setattr(backend_module, 'parse', parse)
+    return parsed
+
+
+def test_documents_are_parsed_and_validated_once(db, parses, monkeypatch):
+    validated = []
+    validate = backend_module.validate
+    monkeypatch.setattr(backend_module, 'validate', lambda *args: validated.append(1) or validate(*args))
+    backend = GCToolsBackend()
+
+    for _ in range(3):
+        result = schema.execute(QUERY, backend=backend, context_value={})
+        assert result.data == DATA
+    assert len(parses) == 1
+    assert len(validated) == 1
+
+
+def test_invalid_documents_keep_their_errors(db, parses):
+    backend = GCToolsBackend()
+    for _ in range(2):
+        result = schema.execute('{ group(guid: 100) { nope } }', backend=backend, context_value={})
+        assert result.invalid
+        assert 'nope' in str(result.errors[0])
+    assert len(parses) == 1
+
+    # Syntax errors never make a document, so nothing is kept
+    for _ in range(2):
+        assert schema.execute('{ group(', backend=backend, context_value={}).errors
+    assert len(parses) == 3
+
+
+def test_without_a_document_cache(db, parses):
+    backend = GCToolsBackend(document_cache_size=0)
+    schema.execute(QUERY, backend=backend, context_value={})
+    schema.execute(QUERY, backend=backend, context_value={})
+    assert len(parses) == 2
@@ -0,0 +1,56 @@
+import time
+
+import models
+from profile_cache import ProfileTable, profile_cache
+from schema import schema
+
+from conftest import DEPARTMENT, JOB, on
+
+
+def test_department_and_job(db):
+    assert profile_cache.get(1, 'department') == 'Finance'
+    assert profile_cache.get(1, 'job') == 'Analyst'
+    assert profile_cache.get(2, 'department') == 'Finance'
+    assert profile_cache.get(2, 'job') is None
+    assert profile_cache.get(9999, 'department') is None
+
+
+def test_strings_are_kept_once():
+    table = ProfileTable()
+    table.set(1, {'department': 'Finance', 'job': 'Analyst'})
+    table.set(2, {'department': 'Finance'})
+    table.set(1, {'department': 'Finance', 'job': 'Manager'})
+    assert table.strings == ['Finance', 'Analyst', 'Manager']
+    assert table.get(1, 'job') == 'Manager'
+    assert table.get(2, 'job') is None
+
+
+def test_users_with_their_profile_is_one_query(statements):
+    profile_cache.keep_fresh()
+    del statements[:]
+
+    result = schema.execute('{ allUsers(first: 5) { edges { node { guid department job } } } }',
+                            context_value={})
+    assert not result.errors, result.errors
+    users = {edge['node']['guid']: edge['node'] for edge in result.data['allUsers']['edges']}
+    assert users['1'] == {'guid': '1', 'department': 'Finance', 'job': 'Analyst'}
+    assert users['3'] == {'guid': '3', 'department': None, 'job': None}
+    assert not on('elggmetadata', statements)
+
+
+def test_edited_profiles_are_picked_up(db):
+    profile_cache.keep_fresh()
+    now = int(time.time())
+    # Editing a profile deletes the old value and adds the new one
+    db.query(models.Metadata).filter(models.Metadata.entity_guid == 1).delete()
+    db.add(models.Metadata(id=100, entity_guid=1, name_id=JOB, value_id=3, owner_guid=1, access_id=2,
+                           time_created=now))
+    db.add(models.Metadata(id=101, entity_guid=3, name_id=DEPARTMENT, value_id=4, owner_guid=3, access_id=2,
+                           time_created=now))
+    db.commit()
+    profile_cache.update(now - 1, now + 1)
+
+    assert profile_cache.get(1, 'department') is None
+    assert profile_cache.get(1, 'job') == 'statistics'
+    assert profile_cache.get(3, 'department') == 'Science'
+    assert profile_cache.get(2, 'department') == 'Finance'
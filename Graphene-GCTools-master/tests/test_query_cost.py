@@ -0,0 +1,101 @@
+from graphql import parse
+import pytest
+
+from backend import GCToolsBackend
+import pagination
+import query_cost
+from schema import schema
+
+
+def analyse(query, variables=None):
+    return query_cost.CostAnalysis(schema, parse(query), variables=variables)
+
+
+def test_scalars_are_free_and_objects_cost_one():
+    assert analyse('{ group(guid: 100) { guid name } }').cost == 1
+
+
+def test_lists_multiply_what_is_under_them():
+    # 20 groups (Query.groups without first), each with 50 members.
+    # The connection, its edges and their nodes are one each
+    analysis = analyse('{ groups { edges { node { members { guid } } } } }')
+    assert analysis.cost == 20 * (1 + 1 + 1 + 50 * 1)
+
+
+def test_first_comes_from_variables():
+    query = 'query ($n: Int) { groups(first: $n) { edges { node { guid } } } }'
+    assert analyse(query, {'n': 5}).cost == 5 * (1 + 1 + 1)
+
+
+def test_first_is_priced_at_most_a_page():
+    assert analyse('{ groups(first: 100000) { edges { node { guid } } } }').cost == \
+        pagination.MAX_PAGE_SIZE * (1 + 1 + 1)
+
+
+@pytest.mark.parametrize('cheap', ['a: user(first: -5000) { edges { node { guid } } }',
+                                   'a: user(last: $n) { edges { node { guid } } }',
+                                   'a: group(guid: 100) { similarGroups(limit: -100000) { guid } }'])
+def test_negative_sizes_cost_nothing_off_the_rest(cheap):
+    expensive = 'b: groups(first: 100) { edges { node { members { groupsJoined { members { guid } } } } } }'
+    analysis = analyse('query ($n: Int) { %s %s }' % (cheap, expensive), {'n': -5000})
+    assert analysis.cost >= analyse('{ %s }' % expensive).cost
+    assert query_cost.check_cost(analysis)
+
+
+def test_depth():
+    assert analyse('{ group(guid: 100) { members { colleagues { guid } } } }').depth == 4
+
+
+def test_introspection_is_free():
+    assert analyse('{ __schema { types { name fields { name } } } }').cost == 0
+
+
+@pytest.mark.parametrize('query', [
+    '{ allUsers { edges { node { guid } } } }',
+    '{ allEntities { edges { node { guid } } } }',
+    'query ($n: Int) { allUsers(first: $n) { edges { node { guid } } } }',
+])
+def test_all_fields_need_first_or_last(query):
+    errors = query_cost.check_cost(analyse(query))
+    assert len(errors) == 1
+    assert 'needs first or last' in errors[0].message
+
+
+def test_all_fields_with_first_fit_the_budget():
+    analysis = analyse('{ allEntities(first: 100000) { edges { node { guid } } } }')
+    assert analysis.cost <= query_cost.MAX_COST
+    assert query_cost.check_cost(analysis) == []
+
+
+def test_over_budget_queries_never_run(db, monkeypatch):
+    def boom(*args, **kwargs):
+        raise AssertionError('executed')
+
+    monkeypatch.setattr('backend.execute', boom)
+    result = schema.execute('{ groups(first: 100) { edges { node { members { colleagues { guid } } } } } }',
+                            backend=GCToolsBackend(), context_value={})
+    assert result.invalid
+    assert 'maximum is {}'.format(query_cost.MAX_COST) in result.errors[0].message
+    assert result.extensions['cost']['requested'] > query_cost.MAX_COST
+
+
+def test_too_deep_queries_are_rejected(db):
+    result = schema.execute('{ group(guid: 100) { members { colleagues { groupsJoined { guid } } } } }',
+                            backend=GCToolsBackend(max_cost=None, max_depth=2), context_value={})
+    assert result.invalid
+    assert 'nested 5 levels deep' in result.errors[0].message
+
+
+def test_all_fields_without_first_are_refused_at_runtime_too(db):
+    result = schema.execute('{ allUsers { edges { node { guid } } } }', context_value={})
+    assert result.errors
+    assert 'needs first or last' in str(result.errors[0])
+
+
+def test_all_fields_return_at_most_a_page(db, monkeypatch):
+    monkeypatch.setattr(pagination, 'MAX_PAGE_SIZE', 2)
+    result = schema.execute('{ allUsers(first: 50) { edges { node { guid } } pageInfo { hasNextPage } } }',
+                            context_value={})
+    assert not result.errors
+    assert [edge['node']['guid'] for edge in result.data['allUsers']['edges']] == ['1', '2']
+    assert result.data['allUsers']['pageInfo']['hasNextPage']
@@ -0,0 +1,176 @@
+import time
+
+import pytest
+
+import app as flask_app
+from backend import GCToolsBackend
+import models
+import response_cache
+from profile_cache import profile_cache
+from response_cache import ResponseCache
+from schema import schema
+from social_graph import social_graph
+import snapshots
+
+import conftest
+from conftest import DEPARTMENT
+
+
+GROUPS = '{ groups { edges { node { guid name } } } }'
+
+
+class Context(dict):
+    """ What the backend looks at in a flask request """
+    def __init__(self, headers=None):
+        super(Context, self).__init__()
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def backend(db):
+    # Looks at the watermark on every request
+    return GCToolsBackend(response_cache=ResponseCache(check_interval=0))
+
+
+def run(backend, query, context=None, **kwargs):
+    result = schema.execute(query, backend=backend, context_value=context if context is not None else Context(),
+                            **kwargs)
+    assert not result.errors, result.errors
+    return result
+
+
+def hit(result):
+    return result.extensions.get('cache', {}).get('hit')
+
+
+def test_off_unless_configured():
+    assert response_cache.from_environ({}) is None
+    assert response_cache.from_environ({'GCTOOLS_RESPONSE_CACHE': '0'}) is None
+
+    cache = response_cache.from_environ({'GCTOOLS_RESPONSE_CACHE': '1', 'GCTOOLS_RESPONSE_CACHE_SIZE': '10',
+                                         'GCTOOLS_RESPONSE_CACHE_TTL': '30'})
+    assert cache.cache.maxsize == 10
+    assert cache.cache.ttl == 30
+
+
+def test_the_apps_dont_cache_by_default(db):
+    client = flask_app.app.test_client()
+    for _ in range(2):
+        body = client.post('/graphql', json={'query': GROUPS}).get_json()
+        assert 'cache' not in body['extensions']
+
+
+def test_the_same_query_is_served_from_the_cache(backend):
+    first = run(backend, GROUPS)
+    assert hit(first) is False
+    # However it is typed
+    second = run(backend, '''
+        # the groups again
+        {groups {edges {node {guid
+                              name}}}}''')
+    assert hit(second) is True
+    assert second.data == first.data
+
+
+def test_variables_are_part_of_the_key(backend):
+    query = 'query ($guid: Int) { group(guid: $guid) { name } }'
+    run(backend, query, variable_values={'guid': 100})
+    result = run(backend, query, variable_values={'guid': 101})
+    assert hit(result) is False
+    assert result.data == {'group': {'name': 'Finance Network'}}
+
+
+def test_writes_make_entries_stale(backend, db):
+    run(backend, GROUPS)
+    # Joining a group only inserts a relationship
+    db.add(models.Relationships(id=1000, guid_one=5, guid_two=101, relationship='member', time_created=10))
+    db.commit()
+    assert hit(run(backend, GROUPS)) is False
+    assert hit(run(backend, GROUPS)) is True
+
+
+def catch_up(snapshot, monkeypatch):
+    """ The snapshot's next refresh, right now and up to the current second """
+    monkeypatch.setattr(snapshot, 'lag', 0)
+    snapshot.last_refresh = 0
+    snapshot.refresh()
+
+
+def test_answers_from_snapshots_that_are_behind_dont_stay(backend, db, monkeypatch):
+    query = '{ group(guid: 101) { members { guid } } }'
+    run(backend, query)
+    db.add(models.Relationships(id=1000, guid_one=5, guid_two=101, relationship='member',
+                                time_created=int(time.time())))
+    db.commit()
+
+    # The watermark moved, but the social graph hasn't caught up yet
+    result = run(backend, query)
+    assert hit(result) is False
+    assert result.data == {'group': {'members': [{'guid': '3'}, {'guid': '4'}]}}
+
+    generation = snapshots.generation()
+    catch_up(social_graph, monkeypatch)
+    assert snapshots.generation() > generation
+    result = run(backend, query)
+    assert hit(result) is False
+    assert result.data == {'group': {'members': [{'guid': '3'}, {'guid': '4'}, {'guid': '5'}]}}
+    assert hit(run(backend, query)) is True
+
+
+def test_profile_edits_make_entries_stale(backend, db, monkeypatch):
+    query = '{ user(first: 1) { edges { node { department } } } }'
+    profile_cache.keep_fresh()
+    run(backend, query)
+    assert hit(run(backend, query)) is True
+    # Only metadata, which the database part of the watermark doesn't look at
+    db.query(models.Metadata).filter(models.Metadata.entity_guid == 1, models.Metadata.name_id == DEPARTMENT).\
+        update({'value_id': 4, 'time_created': int(time.time())})
+    db.commit()
+
+    catch_up(profile_cache, monkeypatch)
+    result = run(backend, query)
+    assert hit(result) is False
+    assert result.data['user']['edges'][0]['node']['department'] == 'Science'
+
+
+def test_refreshes_with_nothing_new_keep_entries(backend, monkeypatch):
+    for snapshot in conftest.SNAPSHOTS:
+        snapshot.keep_fresh()
+    run(backend, GROUPS)
+    generation = snapshots.generation()
+    for snapshot in conftest.SNAPSHOTS:
+        catch_up(snapshot, monkeypatch)
+    assert snapshots.generation() == generation
+    assert hit(run(backend, GROUPS)) is True
+
+
+def test_cache_hits_start_the_refreshes(backend, monkeypatch):
+    run(backend, GROUPS)
+    started = []
+    monkeypatch.setattr(snapshots, 'keep_all_fresh', lambda: started.append(1))
+    assert hit(run(backend, GROUPS)) is True
+    assert started
+
+
+def test_no_cache_header_skips_the_cache(backend):
+    run(backend, GROUPS)
+    result = run(backend, GROUPS, Context({'Cache-Control': 'no-cache'}))
+    assert 'cache' not in result.extensions
+
+
+def test_pageviews_are_never_cached(backend, analytics):
+    for query in ('{ group(guid: 100) { name pageviews } }',
+                  '{ group(guid: 100) { ... on Page { pageviews } } }'):
+        for _ in range(2):
+            result = run(backend, query)
+            assert 'cache' not in result.extensions
+    # So every request asked the analytics API, or its own short cache
+    assert result.data == {'group': {'pageviews': 120}}
+
+
+def test_errors_are_not_cached(backend):
+    query = '{ allUsers { edges { node { guid } } } }'
+    for _ in range(2):
+        result = schema.execute(query, backend=backend, context_value=Context())
+        assert result.errors
+        assert 'cache' not in (result.extensions or {})
@@ -0,0 +1,118 @@
+import time
+
+import pytest
+
+import models
+from schema import schema
+from search_index import tokenize, matches, groups_index, users_index
+
+
+GROUPS = '''query ($name: String, $first: Int, $after: String, $last: Int, $before: String) {
+  groups(name: $name, first: $first, after: $after, last: $last, before: $before) {
+    edges { cursor node { guid } }
+    pageInfo { hasNextPage hasPreviousPage }
+  }
+}'''
+
+
+@pytest.fixture
+def science(db):
+    """ A third group about science, with a lower guid and only a description match """
+    db.add(models.Groups(guid=99, name='Lab Notes', description='Open science'))
+    db.add(models.Entities(guid=99, type='group', subtype=0, owner_guid=1, container_guid=1,
+                           time_created=50, time_updated=50))
+    db.commit()
+    return db
+
+
+def groups(**variables):
+    result = schema.execute(GROUPS, variable_values=variables, context_value={})
+    assert not result.errors, result.errors
+    connection = result.data['groups']
+    return [int(edge['node']['guid']) for edge in connection['edges']], connection
+
+
+def test_tokenize():
+    assert tokenize('<b>Économie</b> &amp; Data-Science 2018') == ['economie', 'data', 'science', '2018']
+    assert tokenize(None) == []
+
+
+def test_matches():
+    assert matches('jo smi', 'John Smith')
+    assert matches('smith', 'John', 'Smith')
+    assert not matches('john smith', 'John Doe')
+
+
+def test_name_matches_rank_before_description_matches(science):
+    assert groups_index.search('science') == [100, 99, 101]
+
+
+def test_exact_words_rank_before_prefixes(db):
+    assert users_index.search('user1') == [1]
+    assert users_index.search('user') == [1, 2, 3, 4, 5]
+    assert groups_index.search('fin') == [101]
+    assert groups_index.search('nothing like it') == []
+
+
+def test_searches_are_paged_in_rank_order(science):
+    guids, connection = groups(name='science')
+    assert guids == [100, 99, 101]
+    assert not connection['pageInfo']['hasNextPage']
+
+    guids, connection = groups(name='science', first=2)
+    assert guids == [100, 99]
+    assert connection['pageInfo']['hasNextPage']
+    assert not connection['pageInfo']['hasPreviousPage']
+
+    after = connection['edges'][-1]['cursor']
+    guids, connection = groups(name='science', first=2, after=after)
+    assert guids == [101]
+    assert not connection['pageInfo']['hasNextPage']
+    assert connection['pageInfo']['hasPreviousPage']
+
+
+def test_searches_page_backwards(science):
+    guids, connection = groups(name='science', last=1)
+    assert guids == [101]
+    assert connection['pageInfo']['hasPreviousPage']
+
+    before = connection['edges'][0]['cursor']
+    guids, _ = groups(name='science', last=5, before=before)
+    assert guids == [100, 99]
+
+
+def test_without_a_name_groups_are_paged_by_guid(science):
+    guids, _ = groups()
+    assert guids == [99, 100, 101]
+
+
+def test_group_by_name_is_the_best_match(science):
+    result = schema.execute('{ group(name: "science") { guid } }', context_value={})
+    assert result.data['group']['guid'] == '100'
+
+
+def test_group_name_wins_over_guid(science):
+    result = schema.execute('{ group(guid: 101, name: "science") { guid } }', context_value={})
+    assert result.data['group']['guid'] == '100'
+
+
+def test_updates_are_picked_up(db):
+    assert groups_index.search('astronomy') == []
+
+    db.query(models.Groups).filter(models.Groups.guid == 101).update({'name': 'Astronomy Club'})
+    db.query(models.Entities).filter(models.Entities.guid == 101).update({'time_updated': int(time.time())})
+    db.commit()
+    groups_index.update(groups_index.watermark - 10, int(time.time()))
+
+    assert groups_index.search('astronomy') == [101]
+    assert groups_index.search('finance') == []
+
+
+def test_deleted_rows_are_left_out_of_the_page(science):
+    groups_index.keep_fresh()
+    db = science
+    db.query(models.Groups).filter(models.Groups.guid == 99).delete()
+    db.commit()
+
+    guids, _ = groups(name='science')
+    assert guids == [100, 101]
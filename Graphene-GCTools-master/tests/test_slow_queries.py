@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import app as flask_app
+from models import db_session
+import slow_queries
+from social_graph import social_graph
+
+
+@pytest.fixture
+def slow_log(db, tmp_path):
+    """ The file of a log of every statement, explaining none """
+    social_graph.refresh()
+    path = tmp_path / 'slow.log'
+    log = slow_queries.SlowQueryLog(str(path), threshold=0, explain_rate=0).install()
+    yield path
+    log.uninstall()
+    log.handler.close()
+
+
+def entries(path):
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def post(query):
+    response = flask_app.app.test_client().post('/graphql', json={'query': query},
+                                                headers={'Cache-Control': 'no-cache'})
+    assert 'errors' not in response.get_json()
+
+
+def test_statements_are_logged_with_the_field_that_ran_them(slow_log):
+    post('{ groups { edges { node { guid } } } }')
+    logged = [entry for entry in entries(slow_log) if 'elgggroups_entity' in entry['statement']]
+    assert [entry['path'] for entry in logged] == ['groups']
+    assert logged[0]['duration'] >= 0
+    assert logged[0]['engine'].startswith('sqlite:///')
+
+
+def test_loader_batches_have_the_path_of_a_field_that_asked(slow_log):
+    post('{ groups { edges { node { guid members { guid } } } } }')
+    members = [entry for entry in entries(slow_log) if 'elggusers_entity' in entry['statement']]
+    # One batch for the members of both groups
+    assert len(members) == 1
+    assert members[0]['path'] == 'groups.edges.0.node.members'
+
+
+def test_no_path_outside_of_a_request(slow_log):
+    db_session.execute('SELECT 1').fetchall()
+    assert entries(slow_log)[-1]['path'] is None
+
+
+def test_fast_statements_are_left_out(db, tmp_path):
+    log = slow_queries.SlowQueryLog(str(tmp_path / 'slow.log'), threshold=60).install()
+    try:
+        db_session.execute('SELECT 1').fetchall()
+    finally:
+        log.uninstall()
+    assert not (tmp_path / 'slow.log').exists()
+
+
+def test_selects_get_explained(db, tmp_path):
+    log = slow_queries.SlowQueryLog(str(tmp_path / 'slow.log'), threshold=0, explain_rate=1).install()
+    try:
+        db_session.execute('SELECT guid FROM elgggroups_entity WHERE name = :name', {'name': 'x'}).fetchall()
+        log.wait()
+    finally:
+        log.uninstall()
+        log.handler.close()
+
+    lines = [json.loads(line) for line in (tmp_path / 'slow.log').read_text().splitlines()]
+    statement = next(line for line in lines if 'statement' in line and 'elgggroups_entity' in line['statement'])
+    explained = [line for line in lines if line.get('id') == statement['id'] and 'explain' in line]
+    assert len(explained) == 1
+    assert explained[0]['explain']
+
+
+def test_install_from_environ(tmp_path):
+    assert slow_queries.install_from_environ({}) is None
+
+    log = slow_queries.install_from_environ({'GCTOOLS_SLOW_QUERY_LOG': str(tmp_path / 'slow.log'),
+                                             'GCTOOLS_SLOW_QUERY_THRESHOLD': '2.5'})
+    log.uninstall()
+    assert log.threshold == 2.5
+    assert log.explain_rate == slow_queries.EXPLAIN_RATE
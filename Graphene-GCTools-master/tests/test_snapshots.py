@@ -0,0 +1,69 @@
+import threading
+import time
+
+from snapshots import Snapshot
+
+
+class Recorder(Snapshot):
+    """ Writes down which thread built or updated it """
+    def __init__(self, *args, **kwargs):
+        super(Recorder, self).__init__(*args, **kwargs)
+        self.calls = []
+        self.fail = False
+
+    def build(self, upper):
+        self.calls.append(('build', threading.current_thread()))
+
+    def update(self, lower, upper):
+        if self.fail:
+            raise RuntimeError('database went away')
+        self.calls.append(('update', threading.current_thread()))
+
+
+def test_first_build_happens_right_away():
+    snapshot = Recorder()
+    assert not snapshot.built
+    snapshot.keep_fresh()
+    assert snapshot.built
+    assert snapshot.calls == [('build', threading.current_thread())]
+
+
+def test_nothing_happens_until_a_refresh_is_due():
+    snapshot = Recorder(refresh_interval=60)
+    snapshot.keep_fresh()
+    snapshot.keep_fresh()
+    snapshot.wait()
+    assert len(snapshot.calls) == 1
+
+
+def test_due_refreshes_run_in_the_background():
+    snapshot = Recorder(refresh_interval=0)
+    snapshot.keep_fresh()
+    # Behind the clock, so the next refresh has a window to look at
+    snapshot.watermark -= 10
+    snapshot.keep_fresh()
+    snapshot.wait()
+    assert [call for call, _ in snapshot.calls] == ['build', 'update']
+    assert snapshot.calls[1][1] is not threading.current_thread()
+
+
+def test_a_failed_refresh_waits_for_the_next_interval(caplog):
+    snapshot = Recorder(refresh_interval=60)
+    snapshot.keep_fresh()
+    snapshot.fail = True
+    snapshot.watermark -= 10
+    snapshot.last_refresh = 0
+
+    snapshot.keep_fresh()
+    snapshot.wait()
+    assert 'Refreshing Recorder failed' in caplog.text
+    assert time.time() - snapshot.last_refresh < 60
+    # And the data from before is still there to read
+    assert snapshot.built
+
+
+def test_refresh_can_be_forced():
+    snapshot = Recorder()
+    snapshot.keep_fresh()
+    snapshot.refresh(rebuild=True)
+    assert [call for call, _ in snapshot.calls] == ['build', 'build']
@@ -0,0 +1,154 @@
+import time
+
+import pytest
+
+import models
+import social_graph as graph_module
+from schema import schema
+from social_graph import Adjacency, SocialGraph
+
+from conftest import on
+
+
+@pytest.fixture
+def np():
+    graph_module._import_numpy()
+    return graph_module.np
+
+
+@pytest.fixture
+def graph(db):
+    graph = SocialGraph()
+    graph.refresh()
+    return graph
+
+
+def adjacency(np, edges):
+    sources, targets = zip(*edges) if edges else ((), ())
+    return Adjacency(np.array(sources, dtype=np.int32), np.array(targets, dtype=np.int32))
+
+
+def test_adjacency(np):
+    friends = adjacency(np, [(3, 1), (1, 3), (1, 2), (1, 3), (7, 1)])
+    assert friends.neighbours(1).tolist() == [2, 3]
+    assert friends.neighbours(2).tolist() == []
+    assert friends.neighbours(0).tolist() == []
+    assert sorted(friends.gather(np.array([1, 3, 5])).tolist()) == [1, 2, 3]
+    assert friends.degrees(np.array([1, 2, 3, 7])).tolist() == [2, 0, 1, 1]
+    assert adjacency(np, []).neighbours(1).tolist() == []
+
+
+def test_overlay(np, monkeypatch):
+    friends = adjacency(np, [(1, 2)])
+    friends = friends.add(np.array([1, 1, 4], dtype=np.int32), np.array([3, 2, 1], dtype=np.int32))
+    assert friends.pending_count == 2
+    assert friends.neighbours(1).tolist() == [2, 3]
+    assert friends.neighbours(4).tolist() == [1]
+    assert sorted(friends.gather(np.array([1, 4])).tolist()) == [1, 2, 3]
+    assert friends.degrees(np.array([1, 4])).tolist() == [2, 1]
+
+    # Past MAX_PENDING the overlay is merged into new arrays
+    monkeypatch.setattr(graph_module, 'MAX_PENDING', 2)
+    merged = friends.add(np.array([5], dtype=np.int32), np.array([1], dtype=np.int32))
+    assert merged is not friends
+    assert merged.pending == {}
+    assert merged.keys.tolist() == [1, 4, 5]
+    assert merged.neighbours(1).tolist() == [2, 3]
+
+
+def test_relationships(graph):
+    assert graph.colleagues(1) == [2, 3]
+    assert graph.colleagues(4) == []
+    assert graph.groups_joined(3) == [100, 101]
+    assert graph.members(101) == [3, 4]
+    usage = graph.memory_usage()
+    assert usage['total'] == usage['friends'] + usage['member_of'] + usage['members'] > 0
+
+
+def test_new_relationships_are_picked_up(graph, db):
+    now = int(time.time())
+    db.add(models.Relationships(id=1000, guid_one=5, guid_two=101, relationship='member', time_created=now))
+    db.add(models.Relationships(id=1001, guid_one=4, guid_two=1, relationship='friend', time_created=now))
+    db.commit()
+    graph.update(now - 1, now + 1)
+
+    assert graph.members(101) == [3, 4, 5]
+    assert graph.groups_joined(5) == [101]
+    assert graph.colleagues(4) == [1]
+
+
+def test_resolvers_only_load_the_rows(statements):
+    graph_module.social_graph.refresh()
+    del statements[:]
+
+    result = schema.execute('{ group(guid: 100) { members { guid groupsJoined { guid } colleagues { guid } } } }',
+                            context_value={})
+    assert not result.errors, result.errors
+    members = {member['guid']: member for member in result.data['group']['members']}
+    assert [group['guid'] for group in members['3']['groupsJoined']] == ['100', '101']
+    assert [user['guid'] for user in members['1']['colleagues']] == ['2', '3']
+    assert not on('elggentity_relationships', statements)
+
+
+@pytest.fixture
+def more_groups(db):
+    """ Group 102 with members 1 and 2, so it has more in common with 100 than 101 does """
+    db.add(models.Groups(guid=102, name='Policy Lab', description=''))
+    db.add(models.Groups(guid=103, name='Book Club', description=''))
+    for id, (one, two, relationship) in enumerate([(1, 102, 'member'), (2, 102, 'member'), (5, 103, 'member'),
+                                                   (4, 5, 'friend')], 1000):
+        db.add(models.Relationships(id=id, guid_one=one, guid_two=two, relationship=relationship, time_created=10))
+    db.commit()
+    graph = SocialGraph()
+    graph.refresh()
+    return graph
+
+
+def test_similar_groups(more_groups):
+    # Shared members over members of either: 2 / 3 for 102, 1 / 4 for 101
+    assert more_groups.similar_groups(100) == [102, 101]
+    assert more_groups.similar_groups(100, limit=1) == [102]
+    assert more_groups.similar_groups(101) == [100]
+    assert more_groups.similar_groups(103) == []
+    assert more_groups.similar_groups(9999) == []
+
+
+def test_suggested_colleagues(more_groups):
+    assert more_groups.suggested_colleagues(1) == [4]
+    assert more_groups.suggested_colleagues(2) == [3]
+    # 5 through 4, then 1 and 4 are already colleagues
+    assert more_groups.suggested_colleagues(3) == [5]
+    assert more_groups.suggested_colleagues(5) == []
+
+
+def test_top(np):
+    candidates = np.array([5, 3, 9, 1], dtype=np.int32)
+    scores = np.array([1.0, 2.0, 1.0, 1.0])
+    # Ties go to the lowest guid
+    assert graph_module._top(candidates, scores, 10) == [3, 1, 5, 9]
+    assert graph_module._top(candidates, scores, 2) == [3, 1]
+    assert graph_module._top(candidates, scores, 0) == []
+    assert len(graph_module._top(np.arange(500), np.ones(500), 1000)) == graph_module.MAX_LIMIT
+
+
+def test_big_groups_are_sampled_the_same_way_every_time(np, monkeypatch):
+    monkeypatch.setattr(graph_module, 'MAX_SAMPLE', 3)
+    guids = np.arange(10, dtype=np.int32)
+    sample = graph_module._sample(guids, 100)
+    assert len(sample) == 3
+    assert sample.tolist() == sorted(sample.tolist())
+    assert graph_module._sample(guids, 100).tolist() == sample.tolist()
+    # Small enough ones are left alone
+    small = guids[:3]
+    assert graph_module._sample(small, 100) is small
+
+
+def test_graph_fields(more_groups, monkeypatch):
+    monkeypatch.setattr(graph_module, 'social_graph', more_groups)
+    monkeypatch.setattr('schema.social_graph', more_groups)
+    result = schema.execute('{ group(guid: 100) { similarGroups(limit: 1) { guid } } '
+                            'user(first: 1) { edges { node { suggestedColleagues { guid } } } } }',
+                            context_value={})
+    assert not result.errors, result.errors
+    assert result.data['group']['similarGroups'] == [{'guid': '102'}]
+    assert result.data['user']['edges'][0]['node']['suggestedColleagues'] == [{'guid': '4'}]
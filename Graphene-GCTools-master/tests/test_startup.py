@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def imported_by(module):
+    """ The modules in sys.modules after importing module in a fresh interpreter """
+    result = subprocess.run(
+        [sys.executable, '-c', 'import sys, {}; print(" ".join(sys.modules))'.format(module)],
+        cwd=ROOT, env=dict(os.environ), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return set(result.stdout.split())
+
+
+def test_app_imports_without_the_heavy_modules():
+    modules = imported_by('app')
+    assert 'social_graph' in modules
+    for heavy in ('numpy', 'pandas', 'gcga'):
+        assert heavy not in modules
+
+
+def test_numpy_comes_with_the_first_build(db):
+    from social_graph import SocialGraph
+
+    graph = SocialGraph()
+    assert graph.colleagues(1) == [2, 3]
+    assert graph.members(100) == [1, 2, 3]
+    assert graph.memory_usage()['total'] > 0
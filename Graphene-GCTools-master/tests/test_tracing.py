@@ -0,0 +1,88 @@
+import pytest
+
+import app as flask_app
+from social_graph import social_graph
+import tracing
+
+
+MEMBERS = '{ groups { edges { node { guid members { guid } } } } }'
+
+
+@pytest.fixture
+def client(db):
+    # The snapshot's first build would count under whichever field asked first
+    social_graph.refresh()
+    tracing.METRICS.clear()
+    return flask_app.app.test_client()
+
+
+def traced(client, query):
+    # Straight past any response cache, so the query always runs
+    response = client.post('/graphql', json={'query': query},
+                           headers={tracing.DEBUG_HEADER: '1', 'Cache-Control': 'no-cache'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert 'errors' not in body
+    return body['extensions']['tracing']
+
+
+def test_only_sent_when_asked_for(client):
+    body = client.post('/graphql', json={'query': MEMBERS}).get_json()
+    assert 'tracing' not in body.get('extensions', {})
+
+
+def test_statements_and_fields(client):
+    trace = traced(client, MEMBERS)
+    # The page of groups, and one batch of members for both
+    assert trace['queries'] == 2
+    assert trace['fields']['Query.groups'] == dict(trace['fields']['Query.groups'], count=1, queries=1)
+    assert trace['fields']['Group.members']['count'] == 2
+    assert trace['duration'] >= trace['db_time'] > 0
+    assert sum(statement['count'] for statement in trace['statements']) == 2
+    assert 'rows' not in trace
+
+
+def test_loader_batches_count_under_the_fields_that_asked(client):
+    trace = traced(client, MEMBERS)
+    # One query for the members of both groups, under the field that loaded them
+    assert trace['fields']['Group.members']['queries'] == 1
+
+
+def test_batches_shared_by_two_fields_count_under_both(client):
+    trace = traced(client, '{ user(first: 1) { edges { node { colleagues { guid } '
+                           'suggestedColleagues { guid } } } } }')
+    assert trace['queries'] == 2
+    assert trace['fields']['Users.colleagues']['queries'] == 1
+    assert trace['fields']['Users.suggestedColleagues']['queries'] == 1
+
+
+def test_traces_add_up_in_the_histograms(client):
+    traced(client, MEMBERS)
+    traced(client, MEMBERS)
+    text = tracing.METRICS.render()
+    assert 'graphql_request_seconds_count 2' in text
+    assert 'graphql_field_queries_bucket{field="Group.members",le="1"} 2' in text
+    assert 'graphql_request_rows' not in text
+
+
+def test_metrics_are_off_without_a_token(client, monkeypatch):
+    monkeypatch.delenv(tracing.METRICS_TOKEN_ENV, raising=False)
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+def test_metrics_need_the_token(client, monkeypatch):
+    monkeypatch.setenv(tracing.METRICS_TOKEN_ENV, 's3cret')
+    traced(client, MEMBERS)
+
+    assert client.get('/metrics').status_code == 404
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 404
+    # Coming from the same machine (like through a proxy) is no longer enough
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 404
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.content_type == tracing.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert '# TYPE graphql_request_seconds histogram' in text
+    assert 'db_pool_size{engine="primary"}' in text
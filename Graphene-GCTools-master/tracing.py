@@ -0,0 +1,401 @@
+"""
+What each GraphQL request spends in the database and in each resolver.
+
+Nothing said which resolver in schema.py was the expensive one. With a
+Tracer on the backend (see backend.py), every request that gets executed is
+traced:
+
+- every SQL statement is counted and timed through SQLAlchemy's
+  before_cursor_execute/after_cursor_execute events
+- TracingMiddleware times every resolver, and counts the statements that ran
+  while it did. DataLoader batches (see loaders.py) run between resolvers:
+  the fields whose load() calls went into a batch are written down when they
+  make them (see resolving() and in_batch()), and its statements count
+  under each of those
+
+Sending the X-GCTools-Trace header (with any value) gets it all back under
+extensions.tracing:
+
+    {"duration": 0.052, "queries": 3, "db_time": 0.0341,
+     "fields": {"Query.groups": {"count": 1, "time": 0.012, "queries": 1},
+                "Group.members": {"count": 20, "time": 0.031, "queries": 1}, ...},
+     "statements": [{"statement": "SELECT ...", "count": 1, "time": 0.02}, ...]}
+
+A field with about as many queries as calls, or the same statement over and
+over, is an N+1.
+
+Every traced request also goes into the histograms in METRICS, which app.py
+and async_app.py serve on /metrics in the Prometheus text format, along with
+the numbers of the database pools. /metrics is off unless GCTOOLS_METRICS_TOKEN
+is set, and then only answers requests with an "Authorization: Bearer [TOKEN]"
+header (see metrics_allowed()): behind a proxy, every request comes from the
+same machine.
+"""
+
+
+import bisect
+import contextvars
+import hmac
+import os
+import threading
+import time
+
+from graphql.execution.middleware import MiddlewareManager
+from promise import Promise, is_thenable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import database
+
+
+DEBUG_HEADER = 'X-GCTools-Trace'
+
+# How many of the most repeated statements go in extensions.tracing
+STATEMENTS = 10
+
+# The token /metrics asks for, /metrics is off without one
+METRICS_TOKEN_ENV = 'GCTOOLS_METRICS_TOKEN'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNTS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# The request being traced, and the field being resolved (its FieldStats and info).
+# Context variables rather than thread locals, so they follow a request
+# into async_app.py's threads
+_trace = contextvars.ContextVar('gctools_trace', default=None)
+_field = contextvars.ContextVar('gctools_field', default=None)
+# The fields a DataLoader batch is loading for, as _field values
+_batch = contextvars.ContextVar('gctools_batch', default=())
+
+
+class FieldStats:
+    """ Calls of one field during a request """
+    __slots__ = ('count', 'time', 'queries')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.queries = 0
+
+    def add(self, elapsed):
+        self.count += 1
+        self.time += elapsed
+
+    def to_dict(self):
+        return {'count': self.count, 'time': self.time, 'queries': self.queries}
+
+
+class Trace:
+    """ Everything one request did """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.db_time = 0.0
+        # 'Type.field' -> FieldStats
+        self.fields = {}
+        # statement -> [count, time]
+        self.statements = {}
+        # async_app.py runs statements for the same request in several threads
+        self._lock = threading.Lock()
+
+    def field(self, parent_type, field_name):
+        name = parent_type + '.' + field_name
+        stats = self.fields.get(name)
+        if stats is None:
+            stats = self.fields[name] = FieldStats()
+        return stats
+
+    def query(self, statement, elapsed, fields=()):
+        """ A statement that took elapsed seconds, run for fields (FieldStats) """
+        with self._lock:
+            self.queries += 1
+            self.db_time += elapsed
+            for field in fields:
+                field.queries += 1
+            totals = self.statements.get(statement)
+            if totals is None:
+                totals = self.statements[statement] = [0, 0.0]
+            totals[0] += 1
+            totals[1] += elapsed
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+
+    def to_dict(self):
+        statements = sorted(self.statements.items(), key=lambda item: item[1][0], reverse=True)
+        return {
+            'duration': self.duration,
+            'queries': self.queries,
+            'db_time': self.db_time,
+            'fields': {name: stats.to_dict() for name, stats in self.fields.items()},
+            'statements': [{'statement': statement, 'count': count, 'time': elapsed}
+                           for statement, (count, elapsed) in statements[:STATEMENTS]],
+        }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _trace.get() is not None:
+        context.gctools_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _trace.get()
+    start = getattr(context, 'gctools_start', None)
+    if trace is None or start is None:
+        return
+    trace.query(statement, time.perf_counter() - start, _current_fields())
+
+
+def _current_fields():
+    """ The FieldStats a statement runs for: the resolver's, or every field in the batch """
+    resolving = _field.get()
+    if resolving is not None:
+        return (resolving[0],)
+    fields = []
+    for stats, _ in _batch.get():
+        if not any(stats is field for field in fields):
+            fields.append(stats)
+    return fields
+
+
+def resolving():
+    """ What is being resolved right now (None outside of a traced resolver),
+        for a DataLoader to hand to in_batch() when its batch runs """
+    return _field.get()
+
+
+def in_batch(resolved, fn, *args):
+    """ fn(*args) with its statements counted under resolved, what resolving()
+        returned for each load() that went into the batch """
+    token = _batch.set(tuple(resolved))
+    try:
+        return fn(*args)
+    finally:
+        _batch.reset(token)
+
+
+def current_path():
+    """ The GraphQL path of the field being resolved (groups.edges.0.node.members),
+        or for a DataLoader batch of the first field that went into it.
+        None outside of those or of a traced request """
+    resolving = _field.get()
+    if resolving is None:
+        batch = _batch.get()
+        if not batch:
+            return None
+        resolving = batch[0]
+    return '.'.join(str(key) for key in resolving[1].path)
+
+
+class TracingMiddleware:
+    """ graphene middleware timing each resolver of a traced request """
+    def resolve(self, next, root, info, **args):
+        trace = _trace.get()
+        if trace is None:
+            return next(root, info, **args)
+
+        stats = trace.field(info.parent_type.name, info.field_name)
+        token = _field.set((stats, info))
+        start = time.perf_counter()
+        try:
+            result = next(root, info, **args)
+        except Exception:
+            stats.add(time.perf_counter() - start)
+            raise
+        finally:
+            _field.reset(token)
+
+        if not is_thenable(result):
+            stats.add(time.perf_counter() - start)
+            return result
+
+        # A DataLoader or async_app.py: done once the promise settles
+        def fulfilled(value):
+            stats.add(time.perf_counter() - start)
+            return value
+
+        def rejected(error):
+            stats.add(time.perf_counter() - start)
+            raise error
+
+        return Promise.resolve(result).then(fulfilled, rejected)
+
+
+class Histogram:
+    """ How many observations fell at or under each bucket, Prometheus style """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more for everything above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """ Histograms added up over every traced request """
+    def __init__(self):
+        # name -> (description, buckets)
+        self._kinds = {}
+        # (name, labels) -> Histogram
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, description, buckets):
+        self._kinds[name] = (description, tuple(buckets))
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._kinds[name][1])
+            histogram.observe(value)
+
+    def record(self, trace):
+        """ Adds a finished Trace """
+        self.observe('graphql_request_seconds', trace.duration)
+        self.observe('graphql_request_queries', trace.queries)
+        self.observe('graphql_request_db_seconds', trace.db_time)
+        for name, stats in trace.fields.items():
+            self.observe('graphql_field_seconds', stats.time, field=name)
+            self.observe('graphql_field_queries', stats.queries, field=name)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """ Every histogram in the Prometheus text format """
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            # Copied, so a request coming in doesn't change the numbers halfway through
+            histograms = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines = []
+        for name, (description, buckets) in sorted(self._kinds.items()):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (histogram_name, labels), counts, total, count in histograms:
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for bucket, bucket_count in zip(buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append('{}_bucket{} {}'.format(name, _labels(labels, le=bucket), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), _number(total)))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+METRICS.histogram('graphql_request_seconds', 'Time to execute a GraphQL request', SECONDS)
+METRICS.histogram('graphql_request_queries', 'SQL statements per GraphQL request', COUNTS)
+METRICS.histogram('graphql_request_db_seconds', 'Time in the database per GraphQL request', SECONDS)
+METRICS.histogram('graphql_field_seconds', 'Time resolving a field, per GraphQL request', SECONDS)
+METRICS.histogram('graphql_field_queries', 'SQL statements run by a field\'s resolver, per GraphQL request',
+                  COUNTS)
+
+
+def render_pools(stats):
+    """ database.pool_stats() as Prometheus gauges """
+    lines = []
+    for key in sorted(next(iter(stats.values()), {})):
+        name = 'db_pool_' + key
+        lines.append('# TYPE {} gauge'.format(name))
+        for engine, engine_stats in sorted(stats.items()):
+            lines.append('{}{} {}'.format(name, _labels((), engine=engine), _number(engine_stats[key])))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def metrics_allowed(authorization, environ=None):
+    """ Whether a request with this Authorization header can read /metrics """
+    if environ is None:
+        environ = os.environ
+    token = environ.get(METRICS_TOKEN_ENV)
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode('utf8'), ('Bearer ' + token).encode('utf8'))
+
+
+def render_metrics(engines=None, metrics=METRICS):
+    """ The /metrics page: the histograms, and the pools of engines once they're made """
+    text = metrics.render()
+    if engines is not None and engines.loaded:
+        text += render_pools(database.pool_stats(engines))
+    return text
+
+
+class Tracer:
+    """
+    Traces the requests GCToolsBackend executes.
+
+    metrics: where finished traces are added up (None to not keep them)
+    header:  the request header asking for extensions.tracing
+    """
+    def __init__(self, metrics=METRICS, header=DEBUG_HEADER):
+        self.metrics = metrics
+        self.header = header
+        # Promises are left alone: wrapping every field's value in one
+        # would cost more than the timing itself
+        self._middleware = MiddlewareManager(TracingMiddleware(), wrap_in_promise=False)
+
+    def middleware(self, middleware=None):
+        """ The middleware to execute with, ours after any the view already has """
+        if not middleware:
+            return self._middleware
+        if isinstance(middleware, MiddlewareManager):
+            middleware = middleware.middlewares
+        return MiddlewareManager(*(tuple(middleware) + (TracingMiddleware(),)), wrap_in_promise=False)
+
+    def wants_trace(self, context):
+        """ Whether the client asked for extensions.tracing """
+        headers = getattr(context, 'headers', None)
+        if headers is None:
+            return False
+        return headers.get(self.header) is not None
+
+    @staticmethod
+    def start():
+        """ Starts tracing the current request, returns the Trace and a token for detach() """
+        trace = Trace()
+        return trace, _trace.set(trace)
+
+    @staticmethod
+    def detach(token):
+        """ Stops statements from here on counting towards the trace. Whatever
+            was scheduled meanwhile (async_app.py) still does """
+        _trace.reset(token)
+
+    def finish(self, trace, context):
+        """ Adds up a trace once the response is ready, and returns it
+            for extensions.tracing if the client asked for it """
+        trace.finish()
+        if self.metrics is not None:
+            self.metrics.record(trace)
+        if self.wants_trace(context):
+            return trace.to_dict()
+        return None